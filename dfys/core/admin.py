@@ -1,9 +1,188 @@
+"""
+Admin for the user data tables, built for tables too large for the defaults: changelists count rows
+from planner statistics, load related rows with one join, search indexed prefixes or exact ids only
+and edit foreign keys with raw id inputs. Lists are ordered by descending id, so `?id__lt=<last id>`
+pages through any depth by index instead of OFFSET.
+
+With several shards the views work on the staff user's own shard, `?shard=<alias>` (the shard
+list filter) switches changelists and the change forms opened from them to another shard.
+"""
+from contextlib import nullcontext
+from urllib.parse import parse_qs
+
+from django.conf import settings
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.db.models.lookups import LessThan
+from django.utils.functional import cached_property
 
-# Register your models here.
+from dfys.core.db_routers import use_shard
 from dfys.core.models import Category, Activity, Skill, ActivityEntry
 
-admin.site.register(Category)
-admin.site.register(Skill)
-admin.site.register(Activity)
-admin.site.register(ActivityEntry)
+
+def is_id_cursor(where, model):
+    """
+    Whether the filter is just the `?id__lt=` cursor of the changelist.
+    """
+    if where.negated or len(where.children) != 1:
+        return False
+    lookup = where.children[0]
+    target = getattr(getattr(lookup, 'lhs', None), 'target', None)
+    return isinstance(lookup, LessThan) and target is not None and target.primary_key and target.model is model
+
+
+def estimated_count(queryset):
+    """
+    Row count of the queryset's table according to planner statistics, None for filtered querysets
+    and when the database has no statistics of the table. The id cursor does not count as a filter,
+    the count of the whole table stands for the count of any page deep in it.
+    """
+    query = queryset.query
+    if (query.where and not is_id_cursor(query.where, queryset.model)) or query.distinct or query.is_sliced:
+        return None
+
+    connection = connections[queryset.db]
+    table = queryset.model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [table])
+        elif connection.vendor == 'sqlite':
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+            if cursor.fetchone() is None:
+                return None
+            # The first number of an index's stat is the row count of the table
+            cursor.execute('SELECT MAX(CAST(stat AS INTEGER)) FROM sqlite_stat1 WHERE tbl = %s', [table])
+        else:
+            return None
+        row = cursor.fetchone()
+
+    # PostgreSQL reports -1 for tables which were never analyzed
+    if row is None or row[0] is None or row[0] < 0:
+        return None
+    return row[0]
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Uses the estimated row count for unfiltered lists, or lists filtered by the id cursor only, of more
+    than ADMIN_EXACT_COUNT_LIMIT rows, the last pages may then come out short or empty.
+    """
+    @cached_property
+    def count(self):
+        estimate = estimated_count(self.object_list)
+        if estimate is not None and estimate > settings.ADMIN_EXACT_COUNT_LIMIT:
+            return estimate
+        return super().count
+
+
+def request_shard(request):
+    """
+    Shard chosen with `?shard=`, also when preserved in the changelist filters of a change form.
+    None when the request does not choose one of SHARD_DATABASES.
+    """
+    alias = request.GET.get('shard')
+    if alias is None:
+        alias = parse_qs(request.GET.get('_changelist_filters', '')).get('shard', [None])[0]
+    if len(settings.SHARD_DATABASES) == 1 or alias not in settings.SHARD_DATABASES:
+        return None
+    return alias
+
+
+class ShardListFilter(admin.SimpleListFilter):
+    """
+    Shard selector, shown when there is more than one shard. LargeTableAdmin routes the view to the chosen shard.
+    """
+    title = 'shard'
+    parameter_name = 'shard'
+
+    def lookups(self, request, model_admin):
+        if len(settings.SHARD_DATABASES) == 1:
+            return []
+        return [(alias, alias) for alias in settings.SHARD_DATABASES]
+
+    def queryset(self, request, queryset):
+        return queryset
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    list_filter = (ShardListFilter,)
+    show_full_result_count = False
+    ordering = ('-id',)
+    # Numeric search terms are matched exactly against these fields instead of search_fields
+    id_search_fields = ('id',)
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        alias = request_shard(request)
+        return queryset.using(alias) if alias else queryset
+
+    def on_request_shard(self, request, view, *args, **kwargs):
+        """
+        Runs the view, form validation and saves included, and renders its response on the request's shard.
+        """
+        alias = request_shard(request)
+        with use_shard(alias) if alias else nullcontext():
+            response = view(request, *args, **kwargs)
+            if hasattr(response, 'render') and not response.is_rendered:
+                response.render()
+        return response
+
+    def changelist_view(self, request, *args, **kwargs):
+        return self.on_request_shard(request, super().changelist_view, *args, **kwargs)
+
+    def changeform_view(self, request, *args, **kwargs):
+        return self.on_request_shard(request, super().changeform_view, *args, **kwargs)
+
+    def delete_view(self, request, *args, **kwargs):
+        return self.on_request_shard(request, super().delete_view, *args, **kwargs)
+
+    def history_view(self, request, *args, **kwargs):
+        return self.on_request_shard(request, super().history_view, *args, **kwargs)
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if search_term.isdigit():
+            condition = Q()
+            for field in self.id_search_fields:
+                condition |= Q(**{field: int(search_term)})
+            return queryset.filter(condition), False
+        return super().get_search_results(request, queryset, search_term)
+
+
+@admin.register(Category)
+class CategoryAdmin(LargeTableAdmin):
+    list_display = ('id', 'name', 'owner', 'is_base_category', 'display_order')
+    list_select_related = ('owner',)
+    raw_id_fields = ('owner',)
+    search_fields = ('name__startswith', 'owner__username__exact')
+    id_search_fields = ('id', 'owner_id')
+
+
+@admin.register(Skill)
+class SkillAdmin(LargeTableAdmin):
+    list_display = ('id', 'name', 'owner', 'is_hidden', 'add_date')
+    list_select_related = ('owner',)
+    raw_id_fields = ('owner', 'categories')
+    search_fields = ('name__startswith', 'owner__username__exact')
+    id_search_fields = ('id', 'owner_id')
+
+
+@admin.register(Activity)
+class ActivityAdmin(LargeTableAdmin):
+    list_display = ('id', 'title', 'skill', 'category', 'modify_date', 'version')
+    list_select_related = ('skill', 'category')
+    raw_id_fields = ('skill', 'category')
+    search_fields = ('title__startswith',)
+    id_search_fields = ('id', 'skill_id')
+
+
+@admin.register(ActivityEntry)
+class ActivityEntryAdmin(LargeTableAdmin):
+    list_display = ('id', 'activity', 'attachment_name', 'add_date', 'modify_date', 'version')
+    list_select_related = ('activity',)
+    raw_id_fields = ('activity',)
+    search_fields = ('activity__title__startswith',)
+    id_search_fields = ('id', 'activity_id')
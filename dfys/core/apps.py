@@ -3,3 +3,22 @@ from django.apps import AppConfig
 
 class CoreConfig(AppConfig):
     name = 'dfys.core'
+
+    def ready(self):
+        from django.contrib.auth import user_logged_out
+        from django.contrib.auth.models import User
+        from django.core import checks
+        from django.db.models.signals import post_save, pre_delete, post_delete
+
+        from dfys.core.backends import invalidate_cached_user
+        from dfys.core.checks import check_shard_map_cache
+        from dfys.core import purge  # noqa: F401 registers purge tasks
+        from dfys.core.sharding import mirror_user_on_save, remember_user_shard, delete_user_mirror
+
+        post_save.connect(invalidate_cached_user, sender=User, dispatch_uid='invalidate_cached_user_save')
+        post_delete.connect(invalidate_cached_user, sender=User, dispatch_uid='invalidate_cached_user_delete')
+        user_logged_out.connect(invalidate_cached_user, dispatch_uid='invalidate_cached_user_logout')
+        post_save.connect(mirror_user_on_save, sender=User, dispatch_uid='mirror_user_on_save')
+        pre_delete.connect(remember_user_shard, sender=User, dispatch_uid='remember_user_shard')
+        post_delete.connect(delete_user_mirror, sender=User, dispatch_uid='delete_user_mirror')
+        checks.register(check_shard_map_cache)
@@ -0,0 +1,162 @@
+"""
+Cold archive of old activity entries. `archive_entries` moves entries added before a cutoff into
+ArchivedEntryChunk rows, up to ENTRIES_ARCHIVE_CHUNK_SIZE entries of one activity per chunk.
+Reads serve archived entries straight from the decoded chunks, merged with the live ones by id, so
+readers never see the difference and browsing history writes nothing. A chunk is restored back into
+ActivityEntry (with the original ids and dates) only when one of its entries is changed or deleted.
+Restored entries carry a restore_date and are archived again only after the same period as new ones.
+"""
+import json
+import zlib
+
+from django.conf import settings
+from django.db import router, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from dfys.core.models import ActivityEntry, ArchivedEntryChunk, UserShard
+
+ARCHIVED_FIELDS = ('id', 'add_date', 'modify_date', 'comment', 'attachment', 'attachment_name', 'version')
+
+
+def _archived_value(entry, field):
+    value = getattr(entry, field)
+    if field == 'attachment':
+        return value.name
+    if field in ('add_date', 'modify_date'):
+        # Full isoformat, DjangoJSONEncoder would cut microseconds and restored dates would change
+        return value.isoformat()
+    return value
+
+
+def pack_entries(entries):
+    rows = [[_archived_value(entry, field) for field in ARCHIVED_FIELDS] for entry in entries]
+    return zlib.compress(json.dumps(rows).encode())
+
+
+def unpack_entries(chunk):
+    entries = []
+    for row in json.loads(zlib.decompress(bytes(chunk.content))):
+        values = dict(zip(ARCHIVED_FIELDS, row))
+        values['add_date'] = parse_datetime(values['add_date'])
+        values['modify_date'] = parse_datetime(values['modify_date'])
+        entries.append(ActivityEntry(activity_id=chunk.activity_id, **values))
+    return entries
+
+
+def archived_add_dates(chunks):
+    """
+    Yields add_date of every entry archived in `chunks`.
+    """
+    position = ARCHIVED_FIELDS.index('add_date')
+    for content in chunks.values_list('content', flat=True):
+        for row in json.loads(zlib.decompress(bytes(content))):
+            yield parse_datetime(row[position])
+
+
+def archived_entries(chunks, before_id=None, after_id=None, count=None):
+    """
+    Entries archived in `chunks` as unsaved ActivityEntry instances with ids between `after_id` and `before_id`,
+    newest first, or oldest first when `after_id` is given. With `count` only the chunks holding the first
+    `count` of them are read.
+    """
+    newest_first = after_id is None
+    if before_id is not None:
+        chunks = chunks.filter(first_id__lt=before_id)
+    if after_id is not None:
+        chunks = chunks.filter(last_id__gt=after_id)
+
+    entries = []
+    bounds = chunks.order_by('-last_id' if newest_first else 'first_id').values_list('pk', 'first_id', 'last_id')
+    for pk, first_id, last_id in bounds:
+        if count is not None and len(entries) >= count:
+            # Chunks may overlap, stop at the first one which cannot hold any of the first `count` entries
+            bound = entries[count - 1].pk
+            if (last_id < bound) if newest_first else (first_id > bound):
+                break
+
+        entries.extend(entry for entry in unpack_entries(chunks.get(pk=pk))
+                       if (before_id is None or entry.pk < before_id) and (after_id is None or entry.pk > after_id))
+        entries.sort(key=lambda entry: entry.pk, reverse=newest_first)
+
+    return entries if count is None else entries[:count]
+
+
+def archived_entry(chunks, entry_id):
+    """
+    The entry `entry_id` archived in one of `chunks` as an unsaved ActivityEntry, None when there is none.
+    """
+    for chunk in chunks.filter(first_id__lte=entry_id, last_id__gte=entry_id):
+        for entry in unpack_entries(chunk):
+            if entry.pk == entry_id:
+                return entry
+    return None
+
+
+def archive_entries(cutoff, chunk_size=None):
+    """
+    Archives entries added (or restored) before `cutoff`, returns how many of them were archived.
+    Entries of users being moved to another shard are left for the next run.
+    """
+    chunk_size = chunk_size or settings.ENTRIES_ARCHIVE_CHUNK_SIZE
+    moving = list(UserShard.objects.filter(is_moving=True).values_list('user_id', flat=True))
+    due = ActivityEntry.objects.filter(add_date__lt=cutoff).exclude(restore_date__gte=cutoff)
+    activity_ids = list(due
+                        .exclude(activity__skill__owner_id__in=moving)
+                        .order_by()
+                        .values_list('activity_id', flat=True)
+                        .distinct())
+
+    db = router.db_for_write(ActivityEntry)
+    archived = 0
+    for activity_id in activity_ids:
+        while True:
+            entries = list(due.filter(activity_id=activity_id).order_by('id')[:chunk_size])
+            if not entries:
+                break
+
+            with transaction.atomic(using=db):
+                ArchivedEntryChunk.objects.using(db).create(activity_id=activity_id,
+                                                  first_id=entries[0].pk,
+                                                  last_id=entries[-1].pk,
+                                                  count=len(entries),
+                                                  content=pack_entries(entries))
+                ActivityEntry.objects.filter(pk__in=[entry.pk for entry in entries])._raw_delete(db)
+            archived += len(entries)
+
+    return archived
+
+
+def restore_latest_chunk(chunks):
+    """
+    Moves the newest of `chunks` back into ActivityEntry. Returns False when there was nothing to restore.
+    """
+    return _restore_chunk(chunks.order_by('-last_id'))
+
+
+def restore_entry(chunks, entry_id):
+    """
+    Restores the one of `chunks` which may hold the entry `entry_id`. Returns False when there is none.
+    """
+    return _restore_chunk(chunks.filter(first_id__lte=entry_id, last_id__gte=entry_id))
+
+
+def _restore_chunk(chunks):
+    db = router.db_for_write(ArchivedEntryChunk)
+    with transaction.atomic(using=db):
+        chunk = chunks.using(db).select_for_update().first()
+        if chunk is None:
+            return False
+
+        entries = unpack_entries(chunk)
+        dates = [(entry.add_date, entry.modify_date) for entry in entries]
+        ActivityEntry.objects.using(db).bulk_create(entries)
+
+        # bulk_create stamps auto_now(_add) fields with the current time, bulk_update writes values as they are
+        now = timezone.now()
+        for entry, (add_date, modify_date) in zip(entries, dates):
+            entry.add_date, entry.modify_date, entry.restore_date = add_date, modify_date, now
+        ActivityEntry.objects.using(db).bulk_update(entries, ['add_date', 'modify_date', 'restore_date'])
+
+        chunk.delete()
+    return True
@@ -0,0 +1,129 @@
+"""
+Stateless signed token authentication. Access tokens are short lived and verified with the
+SECRET_KEY alone, refresh tokens are rotated on use and revoked tokens are kept in a deny-list
+in the shared cache until they would expire anyway.
+"""
+import secrets
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from rest_framework.authentication import BaseAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+from dfys.core.backends import CachedModelBackend
+
+TOKEN_SALT = 'dfys.core.authentication'
+ACCESS = 'a'
+REFRESH = 'r'
+
+
+def _lifetime(token_type):
+    return settings.ACCESS_TOKEN_LIFETIME if token_type == ACCESS else settings.REFRESH_TOKEN_LIFETIME
+
+
+def _password_fingerprint(user):
+    return user.get_session_auth_hash()[:16]
+
+
+def _deny_list_key(jti):
+    return 'revoked-token:{}'.format(jti)
+
+
+def make_token(user, token_type):
+    payload = {'uid': user.pk, 'typ': token_type, 'jti': secrets.token_urlsafe(9)}
+    if token_type == REFRESH:
+        payload['pwd'] = _password_fingerprint(user)
+    return signing.dumps(payload, salt=TOKEN_SALT, compress=True)
+
+
+def issue_tokens(user):
+    return {
+        'access': make_token(user, ACCESS),
+        'refresh': make_token(user, REFRESH),
+    }
+
+
+def decode_token(token, token_type):
+    """
+    Returns the payload of a valid, not revoked token of the given type, raises AuthenticationFailed otherwise.
+    """
+    try:
+        payload = signing.loads(token, salt=TOKEN_SALT, max_age=_lifetime(token_type))
+    except signing.SignatureExpired:
+        raise AuthenticationFailed('Token expired')
+    except signing.BadSignature:
+        raise AuthenticationFailed('Invalid token')
+
+    if payload.get('typ') != token_type:
+        raise AuthenticationFailed('Invalid token type')
+    if cache.get(_deny_list_key(payload['jti'])):
+        raise AuthenticationFailed('Token revoked')
+    return payload
+
+
+def revoke_token(payload):
+    cache.set(_deny_list_key(payload['jti']), True, _lifetime(payload['typ']))
+
+
+def get_token_user(payload):
+    user = CachedModelBackend().get_user(payload['uid'])
+    if user is None:
+        raise AuthenticationFailed('User inactive or deleted')
+    return user
+
+
+def refresh_tokens(refresh_token):
+    """
+    Exchanges a refresh token for a new access/refresh pair, the used refresh token is revoked.
+    Revoking claims the token atomically, so concurrent exchanges of one token get a single pair.
+    """
+    payload = decode_token(refresh_token, REFRESH)
+    user = get_token_user(payload)
+    if payload.get('pwd') != _password_fingerprint(user):
+        raise AuthenticationFailed('Password changed')
+
+    if not cache.add(_deny_list_key(payload['jti']), True, _lifetime(REFRESH)):
+        raise AuthenticationFailed('Token revoked')
+    return issue_tokens(user)
+
+
+def get_bearer_token(request):
+    header = request.META.get('HTTP_AUTHORIZATION', '')
+    keyword, _, token = header.partition(' ')
+    if keyword != 'Bearer' or not token:
+        return None
+    return token.strip()
+
+
+class SignedTokenAuthentication(BaseAuthentication):
+    keyword = 'Bearer'
+
+    def authenticate(self, request):
+        token = get_bearer_token(request)
+        if token is None:
+            return None
+
+        payload = decode_token(token, ACCESS)
+        return get_token_user(payload), payload
+
+    def authenticate_header(self, request):
+        return self.keyword
+
+
+def request_user_id(request):
+    """
+    Id of the user a plain Django request is made by, resolved from the bearer token or the session.
+    Used by middlewares which run before DRF authentication.
+    """
+    token = get_bearer_token(request)
+    if token is not None:
+        try:
+            return decode_token(token, ACCESS)['uid']
+        except AuthenticationFailed:
+            return None
+
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return user.pk
+    return None
@@ -0,0 +1,100 @@
+import copy
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.contrib.auth.backends import ModelBackend
+
+
+def _stamp_key(user_id):
+    return 'user-stamp:{}'.format(user_id)
+
+
+class UserCache:
+    """
+    Per-process LRU of user records with a time to live. Entries are dropped explicitly
+    when the user is saved, deleted or logs out (see dfys.core.apps).
+
+    Other processes learn about that through a stamp of the user in the shared cache, which
+    invalidation replaces: entries are stored with the stamp read before loading the user and
+    dropped on a hit when the stamp has changed meanwhile.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._users = OrderedDict()
+
+    @staticmethod
+    def stamp(user_id):
+        return cache.get(_stamp_key(user_id))
+
+    def get(self, user_id):
+        with self._lock:
+            cached = self._users.get(user_id)
+        if cached is None:
+            return None
+
+        user, expires, stamp = cached
+        if expires < time.monotonic() or stamp != self.stamp(user_id):
+            with self._lock:
+                if self._users.get(user_id) is cached:
+                    del self._users[user_id]
+            return None
+
+        with self._lock:
+            if user_id in self._users:
+                self._users.move_to_end(user_id)
+        return copy.copy(user)
+
+    def set(self, user, stamp):
+        """
+        Caches `user` loaded after reading `stamp` with stamp().
+        """
+        with self._lock:
+            self._users[user.pk] = (copy.copy(user), time.monotonic() + settings.USER_CACHE_TIMEOUT, stamp)
+            self._users.move_to_end(user.pk)
+            while len(self._users) > settings.USER_CACHE_SIZE:
+                self._users.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._users.pop(user_id, None)
+        # Outlives every entry stored before, so an expired stamp never matches a stale entry
+        cache.set(_stamp_key(user_id), secrets.token_hex(8), settings.USER_CACHE_TIMEOUT * 2)
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+
+
+user_cache = UserCache()
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    ModelBackend that resolves the session's user id from the process cache before hitting the database,
+    at the cost of one shared cache read.
+    """
+
+    def get_user(self, user_id):
+        try:
+            user_id = int(user_id)
+        except (TypeError, ValueError):
+            return None
+
+        user = user_cache.get(user_id)
+        if user is None:
+            stamp = user_cache.stamp(user_id)
+            user = super().get_user(user_id)
+            if user is not None:
+                user_cache.set(user, stamp)
+        return user if self.user_can_authenticate(user) else None
+
+
+def invalidate_cached_user(sender, instance=None, user=None, **kwargs):
+    user = instance or user
+    if user is not None and user.pk is not None:
+        user_cache.invalidate(user.pk)
@@ -0,0 +1,169 @@
+"""
+Ordered batch of create/update/delete mutations over categories, skills, activities and entries,
+executed in one transaction. Objects created in the batch can be referenced by later mutations
+through client side temporary ids (any string id).
+"""
+from django.db import router, transaction, IntegrityError
+from rest_framework.exceptions import ValidationError
+
+from dfys.core.changes import publish_change, OP_SAVE, OP_DELETE
+from dfys.core.models import Category, Skill, Activity, ActivityEntry
+from dfys.core.purge import hide_skill
+from dfys.core.serializers import CategoryFlatSerializer, SkillFlatSerializer, ActivityFlatSerializer, \
+    ActivityEntrySerializer
+
+OP_CREATE = 'create'
+OP_UPDATE = 'update'
+
+BATCH_MODELS = {
+    'category': (Category, CategoryFlatSerializer),
+    'skill': (Skill, SkillFlatSerializer),
+    'activity': (Activity, ActivityFlatSerializer),
+    'entry': (ActivityEntry, ActivityEntrySerializer),
+}
+
+REFERENCE_FIELDS = ('category', 'skill', 'activity')
+
+
+def owned_queryset(model, user):
+    if model is Category:
+        return model.objects.filter(owner=user)
+    if model is Skill:
+        return model.objects.filter(owner=user, is_hidden=False)
+    if model is Activity:
+        return model.objects.filter(skill__owner=user, skill__is_hidden=False)
+    return model.objects.filter(activity__skill__owner=user, activity__skill__is_hidden=False)
+
+
+def owner_id_of(instance):
+    if isinstance(instance, (Category, Skill)):
+        return instance.owner_id
+    if isinstance(instance, Activity):
+        return instance.skill.owner_id
+    return instance.activity.skill.owner_id
+
+
+class BatchError(Exception):
+    def __init__(self, index, errors):
+        super().__init__(index, errors)
+        self.index = index
+        self.errors = errors
+
+
+class Batch:
+    def __init__(self, request, mutations):
+        self.request = request
+        self.mutations = mutations
+        self.temp_ids = {}
+        self.created = {}
+        self.results = []
+
+    def execute(self):
+        """
+        Runs all mutations or none of them. Raises BatchError pointing at the first failing mutation.
+        """
+        self.validate_structure()
+
+        with transaction.atomic(using=router.db_for_write(Skill)):
+            targets = self.fetch_targets()
+            for index, mutation in enumerate(self.mutations):
+                try:
+                    self.results.append(self.apply(index, mutation, targets))
+                except IntegrityError as e:
+                    raise BatchError(index, str(e))
+
+        return {
+            'ids': [{'temp_id': temp_id, 'id': pk} for temp_id, pk in self.temp_ids.items()],
+            'results': self.results,
+        }
+
+    def validate_structure(self):
+        if not isinstance(self.mutations, list):
+            raise ValidationError({'mutations': 'Expected a list of mutations'})
+
+        for index, mutation in enumerate(self.mutations):
+            if not isinstance(mutation, dict):
+                raise BatchError(index, 'Mutation must be an object')
+            if mutation.get('model') not in BATCH_MODELS:
+                raise BatchError(index, 'Model must be one of: {}'.format(', '.join(BATCH_MODELS)))
+            if mutation.get('op') not in (OP_CREATE, OP_UPDATE, OP_DELETE):
+                raise BatchError(index, 'Op must be one of: create, update, delete')
+            if mutation['op'] != OP_CREATE and 'id' not in mutation:
+                raise BatchError(index, 'Id is required')
+
+    def fetch_targets(self):
+        """
+        Loads objects updated or deleted by real id with one query per model.
+        """
+        ids = {}
+        for mutation in self.mutations:
+            if mutation['op'] != OP_CREATE and not isinstance(mutation['id'], str):
+                ids.setdefault(mutation['model'], set()).add(mutation['id'])
+
+        return {
+            name: owned_queryset(BATCH_MODELS[name][0], self.request.user).in_bulk(model_ids)
+            for name, model_ids in ids.items()
+        }
+
+    def resolve(self, index, value):
+        if isinstance(value, str):
+            try:
+                return self.temp_ids[value]
+            except KeyError:
+                raise BatchError(index, 'Unknown temporary id {}'.format(value))
+        return value
+
+    def get_target(self, index, mutation, targets):
+        pk = mutation['id']
+        if isinstance(pk, str):
+            instance = self.created.get(pk)
+        else:
+            instance = targets.get(mutation['model'], {}).get(pk)
+
+        if instance is None:
+            raise BatchError(index, 'Object not found')
+        return instance
+
+    def apply(self, index, mutation, targets):
+        model, serializer_class = BATCH_MODELS[mutation['model']]
+
+        if mutation['op'] == OP_DELETE:
+            instance = self.get_target(index, mutation, targets)
+            if isinstance(instance, Category) and instance.is_base_category:
+                raise BatchError(index, 'Base category cannot be deleted')
+
+            pk = instance.pk
+            if isinstance(instance, Skill):
+                hide_skill(instance)
+            else:
+                instance.delete()
+            publish_change(self.request.user.pk, model._meta.model_name, pk, OP_DELETE)
+            return None
+
+        data = dict(mutation.get('data') or {})
+        for field in REFERENCE_FIELDS:
+            if field in data:
+                data[field] = self.resolve(index, data[field])
+
+        instance = None if mutation['op'] == OP_CREATE else self.get_target(index, mutation, targets)
+        serializer = serializer_class(instance, data=data, partial=instance is not None,
+                                      context={'request': self.request})
+        if not serializer.is_valid():
+            raise BatchError(index, serializer.errors)
+
+        for field in REFERENCE_FIELDS:
+            referenced = serializer.validated_data.get(field)
+            if referenced is not None and owner_id_of(referenced) != self.request.user.pk:
+                raise BatchError(index, {field: 'Object not found'})
+
+        extra = {}
+        if instance is not None and hasattr(instance, 'version'):
+            extra['version'] = instance.version + 1
+        instance = serializer.save(**extra)
+
+        if mutation['op'] == OP_CREATE and isinstance(mutation.get('id'), str):
+            self.temp_ids[mutation['id']] = instance.pk
+            self.created[mutation['id']] = instance
+
+        publish_change(self.request.user.pk, model._meta.model_name, instance.pk, OP_SAVE)
+        return serializer.data
@@ -0,0 +1,175 @@
+"""
+Per-user change events. Views publish compact {'model', 'id', 'op'} events after their
+writes are committed and `change_stream` pushes them to the user's connected clients.
+"""
+import json
+import logging
+import select
+import threading
+import time
+from collections import defaultdict, deque
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+OP_SAVE = 'save'
+OP_DELETE = 'delete'
+
+
+class Subscription:
+    def __init__(self, broker, user_id):
+        self.broker = broker
+        self.user_id = user_id
+        self.events = deque()
+
+    def get(self, timeout):
+        """
+        Waits up to `timeout` seconds for events, returns the ones received so far (possibly none).
+        """
+        with self.broker.condition:
+            if not self.events:
+                self.broker.condition.wait(timeout)
+            events = list(self.events)
+            self.events.clear()
+        return events
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class InMemoryBroker:
+    """
+    Fans events out to subscriptions of the current process only. Used in tests and single process setups.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.subscriptions = defaultdict(set)
+
+    def subscribe(self, user_id):
+        subscription = Subscription(self, user_id)
+        with self.condition:
+            self.subscriptions[user_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.condition:
+            self.subscriptions[subscription.user_id].discard(subscription)
+            if not self.subscriptions[subscription.user_id]:
+                del self.subscriptions[subscription.user_id]
+
+    def publish(self, user_id, event):
+        self.dispatch(user_id, event)
+
+    def dispatch(self, user_id, event):
+        with self.condition:
+            for subscription in self.subscriptions.get(user_id, ()):
+                subscription.events.append(event)
+            self.condition.notify_all()
+
+
+class PostgresBroker(InMemoryBroker):
+    """
+    Publishes events with NOTIFY, so every app process receives them. Each process keeps a single
+    LISTEN connection in a background thread and dispatches received events to its local subscriptions.
+    """
+    channel = 'dfys_changes'
+
+    def __init__(self):
+        super().__init__()
+        self._listener = None
+        self._listener_lock = threading.Lock()
+
+    def publish(self, user_id, event):
+        with connections['default'].cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [self.channel, json.dumps({'user': user_id, 'event': event})])
+
+    def subscribe(self, user_id):
+        with self._listener_lock:
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._listen_forever, daemon=True)
+                self._listener.start()
+        return super().subscribe(user_id)
+
+    def _listen_forever(self):
+        while True:
+            try:
+                self._listen()
+            except Exception:
+                logger.exception('Change listener connection failed, reconnecting')
+                time.sleep(1)
+
+    def _listen(self):
+        import psycopg2
+        import psycopg2.extensions
+
+        params = connections['default'].get_connection_params()
+        conn = psycopg2.connect(**params)
+        try:
+            conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            with conn.cursor() as cursor:
+                cursor.execute('LISTEN {}'.format(self.channel))
+
+            while True:
+                if select.select([conn], [], [], 5) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    message = json.loads(notify.payload)
+                    self.dispatch(message['user'], message['event'])
+        finally:
+            conn.close()
+
+
+_broker = None
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        _broker = import_string(settings.CHANGES_BROKER)()
+    return _broker
+
+
+def publish_change(user_id, model, pk, op=OP_SAVE):
+    event = {'model': model, 'id': pk, 'op': op}
+    transaction.on_commit(lambda: get_broker().publish(user_id, event))
+
+
+class ChangeEventsMixin:
+    """
+    Publishes change events for objects written through viewset's create/update/destroy.
+    """
+
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+        self.publish_change(serializer.instance)
+
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        self.publish_change(serializer.instance)
+
+    def perform_destroy(self, instance):
+        pk = instance.pk
+        super().perform_destroy(instance)
+        self.publish_change(instance, pk=pk, op=OP_DELETE)
+
+    def publish_change(self, instance, pk=None, op=OP_SAVE):
+        publish_change(self.request.user.pk, instance._meta.model_name, pk or instance.pk, op)
+
+
+def event_stream(subscription, heartbeat):
+    try:
+        yield 'retry: 3000\n\n'
+        while True:
+            events = subscription.get(heartbeat)
+            if not events:
+                yield ': keep-alive\n\n'
+            for event in events:
+                yield 'data: {}\n\n'.format(json.dumps(event))
+    finally:
+        subscription.close()
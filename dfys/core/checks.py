@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.checks import Error
+
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def check_shard_map_cache(app_configs, **kwargs):
+    """
+    Reads follow the cached shard map, a process local cache would keep them on the old shard of a moved user.
+    """
+    if settings.SHARD_DBS and settings.CACHES['default']['BACKEND'] in PROCESS_LOCAL_CACHES:
+        return [Error(
+            'Sharding needs a cache shared by all workers.',
+            hint='Configure CACHES with e.g. Redis or Memcached when SHARD_DBS is set.',
+            obj='settings.CACHES',
+            id='core.E001',
+        )]
+    return []
@@ -0,0 +1,114 @@
+"""
+Set based copying of a skill tree. Rows are copied by INSERT ... SELECT statements, so cloning
+takes the same handful of queries no matter how many activities and entries the skill has.
+Only archive chunks are copied one by one, their entries have to be re-keyed.
+"""
+from django.db import connections, router, transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from dfys.core.archive import pack_entries, unpack_entries
+from dfys.core.models import Skill, Activity, ActivityEntry, ArchivedEntryChunk
+
+
+def clone_skill(skill, name, activities=True, entries=True):
+    """
+    Copies `skill` under a new name together with its category memberships and, optionally,
+    its activities and their entries. Copies get fresh dates and start at version 1.
+    Attachments are shared with the originals, the storage is content addressed.
+    Archived entries are copied into archive chunks of the copied activities, the originals stay archived.
+    """
+    db = router.db_for_write(Skill, instance=skill)
+    with transaction.atomic(using=db):
+        clone = Skill.objects.using(db).create(owner_id=skill.owner_id, name=name)
+
+        with connections[db].cursor() as cursor:
+            through = Skill.categories.through._meta.db_table
+            cursor.execute(
+                'INSERT INTO {table} (skill_id, category_id) '
+                'SELECT %s, category_id FROM {table} WHERE skill_id = %s'.format(table=through),
+                [clone.pk, skill.pk])
+
+            if activities:
+                _copy_activities(cursor, skill, clone)
+                if entries:
+                    # Archived copies get their ids first, so they stay older than the live ones
+                    _copy_archived_entries(cursor, skill, clone)
+                    _copy_entries(cursor, clone)
+
+    return clone
+
+
+def _now(cursor):
+    return cursor.db.ops.adapt_datetimefield_value(timezone.now())
+
+
+def _copy_activities(cursor, skill, clone):
+    """
+    Copies remember the id of their original in cloned_from, so entries can be moved over with a join.
+    """
+    table = Activity._meta.db_table
+    now = _now(cursor)
+    cursor.execute(
+        'INSERT INTO {table} (add_date, modify_date, title, category_id, skill_id, description, version, cloned_from) '
+        'SELECT %s, %s, title, category_id, %s, description, 1, id FROM {table} '
+        'WHERE skill_id = %s'.format(table=table),
+        [now, now, clone.pk, skill.pk])
+
+
+def _copy_entries(cursor, clone):
+    now = _now(cursor)
+    cursor.execute(
+        'INSERT INTO {entries} (add_date, modify_date, activity_id, comment, attachment, attachment_name, version) '
+        'SELECT %s, %s, copy.id, entry.comment, entry.attachment, entry.attachment_name, 1 '
+        'FROM {entries} entry INNER JOIN {activities} copy ON copy.cloned_from = entry.activity_id '
+        'WHERE copy.skill_id = %s ORDER BY entry.id'.format(entries=ActivityEntry._meta.db_table,
+                                                            activities=Activity._meta.db_table),
+        [now, now, clone.pk])
+
+
+def _copy_archived_entries(cursor, skill, clone):
+    """
+    Copies every archive chunk of the skill into a chunk of the activity's copy, with entry ids taken
+    from the entries' id sequence so they never collide with live or other archived entries.
+    """
+    db = cursor.db.alias
+    chunks = ArchivedEntryChunk.objects.using(db).filter(activity__skill=skill).order_by('first_id')
+    ids = iter(_allocate_ids(cursor, ActivityEntry, chunks.aggregate(total=Sum('count'))['total'] or 0))
+    copies = dict(Activity.objects.using(db).filter(skill=clone).values_list('cloned_from', 'pk'))
+    now = timezone.now()
+
+    copied = []
+    for chunk in chunks.iterator():
+        entries = unpack_entries(chunk)
+        for entry in entries:
+            entry.pk, entry.add_date, entry.modify_date, entry.version = next(ids), now, now, 1
+        copied.append(ArchivedEntryChunk(activity_id=copies[chunk.activity_id],
+                                         first_id=min(entry.pk for entry in entries),
+                                         last_id=max(entry.pk for entry in entries),
+                                         count=len(entries),
+                                         content=pack_entries(entries)))
+    ArchivedEntryChunk.objects.using(db).bulk_create(copied)
+
+
+def _allocate_ids(cursor, model, count):
+    """
+    Takes `count` ids from the id sequence of the model's table, the database never hands them out again.
+    """
+    if not count:
+        return []
+
+    connection = cursor.db
+    table = model._meta.db_table
+    if connection.vendor == 'postgresql':
+        cursor.execute("SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s)", [table, count])
+        return sorted(row[0] for row in cursor.fetchall())
+    if connection.vendor == 'sqlite':
+        # AUTOINCREMENT tables continue after the larger of sqlite_sequence and the largest id
+        cursor.execute('SELECT MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name = %s), 0), '
+                       '(SELECT COALESCE(MAX(id), 0) FROM {}))'.format(connection.ops.quote_name(table)), [table])
+        start = cursor.fetchone()[0]
+        cursor.execute('DELETE FROM sqlite_sequence WHERE name = %s', [table])
+        cursor.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)', [table, start + count])
+        return range(start + 1, start + count + 1)
+    raise NotImplementedError('Allocating ids is not supported on {}'.format(connection.vendor))
@@ -0,0 +1,67 @@
+from django.db.models import F, FileField
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+
+
+class PreconditionFailed(APIException):
+    status_code = status.HTTP_412_PRECONDITION_FAILED
+    default_detail = 'Object has been modified in the meantime.'
+    default_code = 'precondition_failed'
+
+
+def parse_if_match(header):
+    """
+    Returns version expected by the If-Match header or None when any version is accepted.
+    """
+    if not header or header.strip() == '*':
+        return None
+
+    value = header.strip()
+    if value.startswith('W/'):
+        value = value[2:]
+    try:
+        return int(value.strip('"'))
+    except ValueError:
+        raise ValidationError(detail='If-Match must hold an object version')
+
+
+class OptimisticLockingMixin:
+    """
+    Versioned updates for models with a `version` column. The version is exposed as ETag and
+    an If-Match precondition is checked and bumped in the same UPDATE statement, so clients can
+    write without reading first and conflicting writes get 412 instead of overwriting each other.
+    """
+
+    etag_actions = ('retrieve', 'update', 'partial_update')
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if self.action in self.etag_actions and response.status_code == status.HTTP_200_OK \
+                and isinstance(response.data, dict) and 'version' in response.data:
+            response['ETag'] = '"{}"'.format(response.data['version'])
+        return response
+
+    def perform_update(self, serializer):
+        instance = serializer.instance
+        model = type(instance)
+        expected_version = parse_if_match(self.request.META.get('HTTP_IF_MATCH'))
+
+        values = dict(serializer.validated_data)
+        for name, value in values.items():
+            if isinstance(model._meta.get_field(name), FileField) and value:
+                getattr(instance, name).save(value.name, value, save=False)
+                values[name] = getattr(instance, name).name
+
+        queryset = model.objects.filter(pk=instance.pk)
+        if expected_version is not None:
+            queryset = queryset.filter(version=expected_version)
+
+        now = timezone.now()
+        if not queryset.update(version=F('version') + 1, modify_date=now, **values):
+            raise PreconditionFailed()
+
+        for name, value in values.items():
+            setattr(instance, name, value)
+        instance.modify_date = now
+        instance.version = (expected_version or instance.version) + 1
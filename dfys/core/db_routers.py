@@ -0,0 +1,202 @@
+import random
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.http import JsonResponse
+from rest_framework.permissions import SAFE_METHODS
+
+from dfys.core.authentication import request_user_id
+
+_state = threading.local()
+
+SHARD_MAP_CACHE_TIMEOUT = 5 * 60
+
+
+@contextmanager
+def replica_reads():
+    """
+    Lets reads done within the block go to read replicas.
+    """
+    previous = getattr(_state, 'replica_reads', False)
+    _state.replica_reads = True
+    try:
+        yield
+    finally:
+        _state.replica_reads = previous
+
+
+def reads_from_replicas():
+    return getattr(_state, 'replica_reads', False)
+
+
+@contextmanager
+def use_shard(alias):
+    """
+    Routes queries of sharded models made within the block to the `alias` shard.
+    """
+    previous = getattr(_state, 'shard', None)
+    _state.shard = alias
+    try:
+        yield
+    finally:
+        _state.shard = previous
+
+
+def current_shard():
+    return getattr(_state, 'shard', None) or DEFAULT_DB_ALIAS
+
+
+def _shard_key(user_id):
+    return 'user-shard:{}'.format(user_id)
+
+
+def shard_for_user(user_id):
+    """
+    Alias of the database holding the user's data. Users missing from the shard map live on 'default'.
+    """
+    if user_id is None or len(settings.SHARD_DATABASES) == 1:
+        return DEFAULT_DB_ALIAS
+
+    alias = cache.get(_shard_key(user_id))
+    if alias is None:
+        from dfys.core.models import UserShard
+
+        alias = UserShard.objects.filter(user_id=user_id).values_list('alias', flat=True).first() or DEFAULT_DB_ALIAS
+        cache.set(_shard_key(user_id), alias, SHARD_MAP_CACHE_TIMEOUT)
+    return alias
+
+
+def forget_user_shard(user_id):
+    cache.delete(_shard_key(user_id))
+
+
+class ShardMoveInProgress(Exception):
+    pass
+
+
+def locate_user_for_write(user_id):
+    """
+    Alias of the user's shard read from the shard map itself, so writes never follow a shard-map cache entry
+    which outlived a move. Raises ShardMoveInProgress while the user's data is being moved.
+    """
+    if user_id is None or len(settings.SHARD_DATABASES) == 1:
+        return DEFAULT_DB_ALIAS
+
+    from dfys.core.models import UserShard
+
+    entry = UserShard.objects.filter(user_id=user_id).values_list('alias', 'is_moving').first()
+    if entry is None:
+        return DEFAULT_DB_ALIAS
+
+    alias, is_moving = entry
+    if is_moving:
+        raise ShardMoveInProgress('Data of user {} is being moved to another shard'.format(user_id))
+    return alias
+
+
+class ShardRouter:
+    """
+    Sends queries of the models owned by a user (categories, skills and everything under them) to
+    the shard selected with use_shard(), or to the shard an instance was loaded from. Queries on
+    'default' and queries of other models are left to the next router.
+    """
+    SHARDED_MODELS = {'category', 'skill', 'skill_categories', 'activity', 'activityentry', 'archivedentrychunk'}
+
+    def _db(self, model, hints):
+        if model._meta.app_label != 'core' or model._meta.model_name not in self.SHARDED_MODELS:
+            return None
+
+        instance = hints.get('instance')
+        alias = instance._state.db if instance is not None and instance._state.db else current_shard()
+        if alias == DEFAULT_DB_ALIAS or alias not in settings.SHARD_DATABASES:
+            return None
+        return alias
+
+    def db_for_read(self, model, **hints):
+        return self._db(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._db(model, hints)
+
+
+class ReplicaRouter:
+    """
+    Sends reads to a random REPLICA_DATABASES alias, but only inside replica_reads().
+    Everything else, including all writes, goes to 'default'.
+    """
+
+    def db_for_read(self, model, **hints):
+        if reads_from_replicas() and settings.REPLICA_DATABASES:
+            return random.choice(settings.REPLICA_DATABASES)
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in settings.REPLICA_DATABASES
+
+
+def _pin_key(user_id):
+    return 'primary-pin:{}'.format(user_id)
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Serves safe requests from replicas, except for users who wrote something within the last
+    REPLICA_STICKY_SECONDS - those keep reading from the primary so they always see their own writes.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.REPLICA_DATABASES:
+            return self.get_response(request)
+
+        user_id = request_user_id(request)
+
+        if request.method in SAFE_METHODS:
+            if user_id is not None and cache.get(_pin_key(user_id)):
+                return self.get_response(request)
+            with replica_reads():
+                return self.get_response(request)
+
+        response = self.get_response(request)
+        if user_id is not None:
+            cache.set(_pin_key(user_id), True, settings.REPLICA_STICKY_SECONDS)
+        return response
+
+
+class ShardRoutingMiddleware:
+    """
+    Routes the requesting user's queries to the shard holding their data. Write requests look
+    the shard up uncached and are refused with 503 while the user's data is being moved.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if len(settings.SHARD_DATABASES) == 1:
+            return self.get_response(request)
+
+        user_id = request_user_id(request)
+        if request.method in SAFE_METHODS:
+            alias = shard_for_user(user_id)
+        else:
+            try:
+                alias = locate_user_for_write(user_id)
+            except ShardMoveInProgress:
+                response = JsonResponse({'detail': 'Your data is being moved, please try again shortly.'}, status=503)
+                response['Retry-After'] = str(settings.SHARD_MOVE_GRACE_SECONDS or 1)
+                return response
+
+        with use_shard(alias):
+            return self.get_response(request)
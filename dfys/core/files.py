@@ -0,0 +1,105 @@
+import hashlib
+import os
+import re
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.deconstruct import deconstructible
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+RANGE_CHUNK_SIZE = 64 * 1024
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Stores files under the sha256 of their content, so identical uploads share one file on disk.
+    Content is hashed chunk by chunk, uploads are never read into memory as a whole.
+    """
+
+    def save(self, name, content, max_length=None):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+
+        sha = digest.hexdigest()
+        _, ext = os.path.splitext(name or '')
+        name = os.path.join(sha[:2], sha[2:4], sha + ext.lower())
+
+        if self.exists(name):
+            return name
+        return super().save(name, content, max_length)
+
+
+def parse_range(header, size):
+    """
+    Parses a single byte range header into (start, end) inclusive offsets.
+    Returns None when there is no usable range and raises ValueError when it cannot be satisfied.
+    """
+    match = RANGE_RE.match(header.strip()) if header else None
+    if match is None:
+        return None
+
+    first, last = match.groups()
+    if not first and not last:
+        return None
+
+    if not first:
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+
+    if start >= size or start > end:
+        raise ValueError('Range not satisfiable')
+    return start, end
+
+
+def read_range(field_file, start, length):
+    with field_file.open('rb') as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(RANGE_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def attachment_response(request, field_file, filename):
+    """
+    Serves a stored file. With ATTACHMENT_ACCEL_REDIRECT set the transfer (including range requests)
+    is handed over to the front web server, otherwise single byte ranges are served here.
+    """
+    disposition = 'attachment; filename="{}"'.format(filename.replace('"', ''))
+
+    if settings.ATTACHMENT_ACCEL_REDIRECT:
+        response = HttpResponse()
+        response['X-Accel-Redirect'] = settings.ATTACHMENT_ACCEL_REDIRECT + field_file.name
+        response['Content-Type'] = 'application/octet-stream'
+        response['Content-Disposition'] = disposition
+        return response
+
+    size = field_file.size
+    try:
+        byte_range = parse_range(request.META.get('HTTP_RANGE'), size)
+    except ValueError:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = 'bytes */{}'.format(size)
+        return response
+
+    if byte_range is None:
+        response = FileResponse(field_file.open('rb'), as_attachment=True, filename=filename)
+    else:
+        start, end = byte_range
+        response = StreamingHttpResponse(read_range(field_file, start, end - start + 1),
+                                         status=206,
+                                         content_type='application/octet-stream')
+        response['Content-Range'] = 'bytes {}-{}/{}'.format(start, end, size)
+        response['Content-Length'] = str(end - start + 1)
+        response['Content-Disposition'] = disposition
+
+    response['Accept-Ranges'] = 'bytes'
+    return response
@@ -0,0 +1,87 @@
+"""
+Cache of serialized objects. Each object's representation is stored under its serializer, database,
+id and the values that change whenever the object does (modify_date, version), so a changed object
+simply gets a new key and stale fragments expire on their own after FRAGMENT_CACHE_TIMEOUT.
+"""
+import zlib
+
+from django.conf import settings
+from django.core.cache import cache
+
+STATS_KEYS = {'hits': 'fragment-stats:hits', 'misses': 'fragment-stats:misses'}
+
+
+def fragment_key(serializer, instance):
+    """
+    Cache key of `instance` rendered by `serializer`, None when it must not be cached
+    (objects loaded without the key fields, e.g. for sparse fieldsets).
+    """
+    key_fields = serializer.fragment_key_fields
+    if instance.pk is None or instance.get_deferred_fields().intersection(key_fields):
+        return None
+
+    values = []
+    for name in key_fields:
+        value = getattr(instance, name)
+        values.append(value.isoformat() if hasattr(value, 'isoformat') else str(value))
+
+    return 'fragment:{}:{}:{}:{}:{:x}:{}'.format(
+        serializer.__class__.__name__,
+        instance._state.db,
+        instance.pk,
+        ':'.join(values),
+        zlib.crc32(','.join(serializer.fields).encode()),
+        settings.FRAGMENT_CACHE_VERSION,
+    )
+
+
+def render_many(serializer, instances):
+    """
+    Representations of `instances` by `serializer`, cached ones fetched with a single get_many,
+    only the misses are serialized (and stored with a single set_many).
+    """
+    timeout = settings.FRAGMENT_CACHE_TIMEOUT
+    if not timeout:
+        return [serializer.to_representation(instance) for instance in instances]
+
+    keys = [fragment_key(serializer, instance) for instance in instances]
+    cached = cache.get_many([key for key in keys if key is not None])
+
+    representations, missed = [], {}
+    for instance, key in zip(instances, keys):
+        representation = cached.get(key) if key is not None else None
+        if representation is None:
+            representation = serializer.to_representation(instance)
+            if key is not None:
+                missed[key] = representation
+        representations.append(representation)
+
+    if missed:
+        cache.set_many(missed, timeout)
+    record_stats(hits=len(cached), misses=len(instances) - len(cached))
+    return representations
+
+
+def record_stats(hits, misses):
+    for name, count in (('hits', hits), ('misses', misses)):
+        if not count:
+            continue
+        try:
+            cache.incr(STATS_KEYS[name], count)
+        except ValueError:
+            cache.add(STATS_KEYS[name], count, timeout=None)
+
+
+def fragment_stats():
+    counts = cache.get_many(STATS_KEYS.values())
+    hits = counts.get(STATS_KEYS['hits'], 0)
+    misses = counts.get(STATS_KEYS['misses'], 0)
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': hits / (hits + misses) if hits + misses else None,
+    }
+
+
+def reset_stats():
+    cache.delete_many(STATS_KEYS.values())
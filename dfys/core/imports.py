@@ -0,0 +1,267 @@
+"""
+Streaming import of a user's categories, skills, activities and entries from a JSON-lines document.
+Each line is {"model": "category" | "skill" | "activity" | "entry", "data": {...}} with the object in
+the same shape as the API returns it. Ids in the document are ids of the source tracker, references
+(skill's categories, activity's skill and category, entry's activity) have to point to objects on earlier lines.
+
+Lines are validated and written in chunks of IMPORT_CHUNK_SIZE with bulk_create, each chunk in its
+own transaction, so memory use does not grow with the document - only the source id to new id maps do.
+When a line fails, chunks written before it stay imported and the failing chunk is not written.
+Skills, activities and entries keep their add_date and modify_date when the document has them.
+"""
+import json
+
+from django.conf import settings
+from django.db import router, transaction
+from djangorestframework_camel_case.settings import api_settings as camel_case_settings
+from djangorestframework_camel_case.util import underscoreize
+from rest_framework import serializers
+
+from dfys.core.models import Category, Skill, Activity, ActivityEntry
+
+IMPORT_MODELS = ('category', 'skill', 'activity', 'entry')
+
+
+class ImportFailed(Exception):
+    def __init__(self, line, errors):
+        super().__init__(line, errors)
+        self.line = line
+        self.errors = errors
+
+
+class CategoryImportSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Category
+        fields = ('name', 'is_base_category', 'display_order')
+
+
+class SkillImportSerializer(serializers.ModelSerializer):
+    add_date = serializers.DateTimeField(required=False)
+
+    class Meta:
+        model = Skill
+        fields = ('name', 'add_date')
+
+
+class ActivityImportSerializer(serializers.ModelSerializer):
+    add_date = serializers.DateTimeField(required=False)
+    modify_date = serializers.DateTimeField(required=False)
+
+    class Meta:
+        model = Activity
+        fields = ('title', 'description', 'add_date', 'modify_date')
+
+
+class ActivityEntryImportSerializer(serializers.ModelSerializer):
+    add_date = serializers.DateTimeField(required=False)
+    modify_date = serializers.DateTimeField(required=False)
+
+    class Meta:
+        model = ActivityEntry
+        fields = ('comment', 'add_date', 'modify_date')
+
+
+DATE_FIELDS = ('add_date', 'modify_date')
+
+
+def pop_dates(attrs):
+    """
+    Removes the imported dates from validated `attrs`, modify_date defaults to add_date.
+    """
+    dates = {field: attrs.pop(field) for field in DATE_FIELDS if field in attrs}
+    if 'add_date' in dates:
+        dates.setdefault('modify_date', dates['add_date'])
+    return dates
+
+
+def write_dates(model, objects, dates):
+    """
+    Sets the imported dates on bulk created `objects`, `dates` are pop_dates() results in the same order.
+    """
+    fields = [field.name for field in model._meta.concrete_fields if field.name in DATE_FIELDS]
+    dated = []
+    for obj, obj_dates in zip(objects, dates):
+        if obj_dates:
+            for field in fields:
+                if field in obj_dates:
+                    setattr(obj, field, obj_dates[field])
+            dated.append(obj)
+
+    # bulk_create stamps auto_now(_add) fields with the current time, bulk_update writes values as they are
+    if dated:
+        model.objects.bulk_update(dated, fields)
+
+
+def parse_lines(lines):
+    """
+    Yields (line number, model, underscoreized data) for each non empty line.
+    """
+    for number, line in enumerate(lines, start=1):
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        line = line.strip()
+        if not line:
+            continue
+
+        try:
+            record = json.loads(line)
+        except ValueError:
+            raise ImportFailed(number, 'Invalid JSON')
+
+        if not isinstance(record, dict) or record.get('model') not in IMPORT_MODELS \
+                or not isinstance(record.get('data'), dict):
+            raise ImportFailed(number, 'Expected {{"model": ..., "data": {{...}}}} with model one of: {}'
+                               .format(', '.join(IMPORT_MODELS)))
+
+        yield number, record['model'], underscoreize(record['data'], **camel_case_settings.JSON_UNDERSCOREIZE)
+
+
+class Importer:
+    """
+    Imports a document into `user`'s account. `progress`, if given, is called with
+    the counts of imported objects per model after each written chunk.
+    """
+
+    def __init__(self, user, chunk_size=None, progress=None):
+        self.user = user
+        self.chunk_size = chunk_size or settings.IMPORT_CHUNK_SIZE
+        self.progress = progress
+        self.ids = {model: {} for model in IMPORT_MODELS}
+        self.counts = dict.fromkeys(IMPORT_MODELS, 0)
+        self._base_categories = None
+
+    def run(self, lines):
+        chunk, chunk_model = [], None
+        for number, model, data in parse_lines(lines):
+            if chunk and (model != chunk_model or len(chunk) >= self.chunk_size):
+                self.write_chunk(chunk_model, chunk)
+                chunk = []
+            chunk_model = model
+            chunk.append((number, data))
+
+        if chunk:
+            self.write_chunk(chunk_model, chunk)
+        return self.counts
+
+    def write_chunk(self, model, chunk):
+        importer = {
+            'category': self.import_categories,
+            'skill': self.import_skills,
+            'activity': self.import_activities,
+            'entry': self.import_entries,
+        }[model]
+
+        with transaction.atomic(using=router.db_for_write(Skill)):
+            importer(chunk)
+
+        self.counts[model] += len(chunk)
+        if self.progress is not None:
+            self.progress(dict(self.counts))
+
+    @staticmethod
+    def validate(serializer_class, chunk):
+        serializer = serializer_class(data=[data for _, data in chunk], many=True)
+        if not serializer.is_valid():
+            errors = serializer.errors
+            # Depending on the DRF version errors come as a list or as a dict keyed by the invalid items' index
+            if not isinstance(errors, dict):
+                errors = dict(enumerate(errors))
+            for index, (number, _) in enumerate(chunk):
+                if errors.get(index):
+                    raise ImportFailed(number, errors[index])
+        return serializer.validated_data
+
+    def remember(self, model, data, pk):
+        if data.get('id') is not None:
+            self.ids[model][data['id']] = pk
+
+    def resolve(self, number, field, model, source_id):
+        try:
+            return self.ids[model][source_id]
+        except (KeyError, TypeError):
+            raise ImportFailed(number, {field: 'Unknown {} id {}'.format(model, source_id)})
+
+    def base_categories(self):
+        if self._base_categories is None:
+            self._base_categories = {
+                category.name: category.pk
+                for category in Category.objects.filter(owner=self.user, is_base_category=True)
+            }
+        return self._base_categories
+
+    def import_categories(self, chunk):
+        """
+        Base categories are not created, they are mapped by name onto the user's own base categories.
+        """
+        created = []
+        for (number, data), attrs in zip(chunk, self.validate(CategoryImportSerializer, chunk)):
+            if attrs.pop('is_base_category', False):
+                try:
+                    self.remember('category', data, self.base_categories()[attrs['name']])
+                except KeyError:
+                    raise ImportFailed(number, {'name': 'Unknown base category {}'.format(attrs['name'])})
+            else:
+                created.append((data, Category(owner=self.user, **attrs)))
+
+        Category.objects.bulk_create([category for _, category in created])
+        for data, category in created:
+            self.remember('category', data, category.pk)
+
+    def import_skills(self, chunk):
+        """
+        Skills without `categories` get the base categories, like skills created through the API.
+        """
+        validated = self.validate(SkillImportSerializer, chunk)
+
+        names = [attrs['name'] for attrs in validated]
+        taken = set(Skill.objects
+                    .filter(owner=self.user, name__in=names, is_hidden=False)
+                    .values_list('name', flat=True))
+        category_ids = []
+        for (number, data), attrs in zip(chunk, validated):
+            if attrs['name'] in taken:
+                raise ImportFailed(number, {'name': 'Skill with this name already exists'})
+            taken.add(attrs['name'])
+
+            if data.get('categories') is None:
+                category_ids.append(set(self.base_categories().values()))
+            else:
+                category_ids.append({self.resolve(number, 'categories', 'category', source_id)
+                                     for source_id in data['categories']})
+
+        dates = [pop_dates(attrs) for attrs in validated]
+        skills = Skill.objects.bulk_create([Skill(owner=self.user, **attrs) for attrs in validated])
+        write_dates(Skill, skills, dates)
+
+        through = Skill.categories.through
+        through.objects.bulk_create([
+            through(skill_id=skill.pk, category_id=category_id)
+            for skill, skill_category_ids in zip(skills, category_ids)
+            for category_id in skill_category_ids
+        ])
+        for (_, data), skill in zip(chunk, skills):
+            self.remember('skill', data, skill.pk)
+
+    def import_activities(self, chunk):
+        activities, dates = [], []
+        for (number, data), attrs in zip(chunk, self.validate(ActivityImportSerializer, chunk)):
+            dates.append(pop_dates(attrs))
+            attrs['skill_id'] = self.resolve(number, 'skill', 'skill', data.get('skill'))
+            if data.get('category') is not None:
+                attrs['category_id'] = self.resolve(number, 'category', 'category', data['category'])
+            activities.append(Activity(**attrs))
+
+        Activity.objects.bulk_create(activities)
+        write_dates(Activity, activities, dates)
+        for (_, data), activity in zip(chunk, activities):
+            self.remember('activity', data, activity.pk)
+
+    def import_entries(self, chunk):
+        entries, dates = [], []
+        for (number, data), attrs in zip(chunk, self.validate(ActivityEntryImportSerializer, chunk)):
+            dates.append(pop_dates(attrs))
+            attrs['activity_id'] = self.resolve(number, 'activity', 'activity', data.get('activity'))
+            entries.append(ActivityEntry(**attrs))
+
+        ActivityEntry.objects.bulk_create(entries)
+        write_dates(ActivityEntry, entries, dates)
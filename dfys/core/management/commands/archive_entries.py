@@ -0,0 +1,23 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from dfys.core.archive import archive_entries
+from dfys.core.db_routers import use_shard
+
+
+class Command(BaseCommand):
+    help = 'Moves entries older than ENTRIES_ARCHIVE_AFTER_DAYS into compressed archive chunks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None, help='Archive entries added more than this many days ago')
+
+    def handle(self, *args, **options):
+        days = options['days'] or settings.ENTRIES_ARCHIVE_AFTER_DAYS
+        cutoff = timezone.now() - timedelta(days=days)
+        for alias in settings.SHARD_DATABASES:
+            with use_shard(alias):
+                archived = archive_entries(cutoff)
+            self.stdout.write('Archived {} entry(ies) on {}'.format(archived, alias))
@@ -0,0 +1,48 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import resolve
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from dfys.core.middleware import available_compressors, compress_bytes
+
+
+class Command(BaseCommand):
+    help = 'Measures bytes saved and CPU time spent compressing API responses of the given user'
+
+    ENDPOINTS = (
+        '/api/categories/',
+        '/api/skills/',
+        '/api/activities/',
+        '/api/activities/recent/',
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError('User {} does not exist'.format(options['username']))
+
+        factory = APIRequestFactory()
+        for path in self.ENDPOINTS:
+            request = factory.get(path)
+            force_authenticate(request, user)
+            match = resolve(path)
+            response = match.func(request, *match.args, **match.kwargs)
+            content = response.render().content
+
+            for compressor_class in available_compressors():
+                start = time.perf_counter()
+                for _ in range(options['repeat']):
+                    compressed = compress_bytes(compressor_class, content)
+                elapsed = (time.perf_counter() - start) / options['repeat']
+
+                self.stdout.write('{:<28} {:<5} {:>9} -> {:>9} bytes ({:>6.1%}) {:>8.3f} ms'.format(
+                    path, compressor_class.encoding, len(content), len(compressed),
+                    len(compressed) / max(len(content), 1), elapsed * 1000
+                ))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from dfys.core.fragments import fragment_stats, reset_stats
+
+
+class Command(BaseCommand):
+    help = 'Prints hit rate of the serialized fragment cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Reset the counters after printing them')
+
+    def handle(self, *args, **options):
+        stats = fragment_stats()
+        hit_rate = '-' if stats['hit_rate'] is None else '{:.1%}'.format(stats['hit_rate'])
+        self.stdout.write('Hits: {hits}, misses: {misses}, hit rate: {rate}'.format(rate=hit_rate, **stats))
+
+        if options['reset']:
+            reset_stats()
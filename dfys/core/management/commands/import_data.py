@@ -0,0 +1,47 @@
+import sys
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from dfys.core.db_routers import use_shard, locate_user_for_write, ShardMoveInProgress
+from dfys.core.imports import Importer, ImportFailed
+
+
+class Command(BaseCommand):
+    help = 'Imports a JSON-lines document into a user account, see dfys.core.imports'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username', help='Owner of the imported objects')
+        parser.add_argument('path', help='JSON-lines file, - reads standard input')
+        parser.add_argument('--chunk-size', type=int, default=None, help='Lines written in one transaction')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError('User {} does not exist'.format(options['username']))
+
+        try:
+            shard = locate_user_for_write(user.pk)
+        except ShardMoveInProgress as e:
+            raise CommandError(str(e))
+
+        importer = Importer(user, chunk_size=options['chunk_size'], progress=self.report)
+        source = sys.stdin if options['path'] == '-' else open(options['path'], encoding='utf-8')
+        try:
+            with use_shard(shard):
+                importer.run(source)
+        except ImportFailed as e:
+            raise CommandError('Line {}: {}'.format(e.line, e.errors))
+        finally:
+            if source is not sys.stdin:
+                source.close()
+
+        self.stdout.write(self.style.SUCCESS('Imported {}'.format(self.format_counts(importer.counts))))
+
+    def report(self, counts):
+        self.stdout.write('Progress: {}'.format(self.format_counts(counts)))
+
+    @staticmethod
+    def format_counts(counts):
+        return ', '.join('{} {}'.format(count, model) for model, count in counts.items())
@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from dfys.core.db_routers import shard_for_user
+from dfys.core.sharding import move_user
+
+
+class Command(BaseCommand):
+    help = "Moves a user's categories, skills, activities and entries to another shard"
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('shard', choices=settings.SHARD_DATABASES)
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError('User {} does not exist'.format(options['username']))
+
+        source = shard_for_user(user.pk)
+        move_user(user, options['shard'], progress=self.report)
+        self.stdout.write(self.style.SUCCESS('Moved {} from {} to {}'.format(user.username, source, options['shard'])))
+
+    def report(self, model, copied):
+        self.stdout.write('Copied {} {} row(s)'.format(copied, model._meta.model_name))
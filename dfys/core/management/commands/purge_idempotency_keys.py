@@ -0,0 +1,16 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from dfys.core.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = 'Deletes stored idempotent responses older than IDEMPOTENCY_KEY_TTL'
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+        deleted, _ = IdempotencyKey.objects.filter(add_date__lt=cutoff).delete()
+        self.stdout.write('Deleted {} idempotency key(s)'.format(deleted))
@@ -0,0 +1,13 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from dfys.core.sharding import reserve_id_range
+
+
+class Command(BaseCommand):
+    help = 'Moves id sequences of every shard into its own id range, run after migrating a new shard'
+
+    def handle(self, *args, **options):
+        for alias in settings.SHARD_DATABASES:
+            reserve_id_range(alias)
+            self.stdout.write('Reserved ids of {}'.format(alias))
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from dfys.core.tasks import run_pending
+
+
+class Command(BaseCommand):
+    help = 'Runs queued background jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Process due jobs once and exit')
+        parser.add_argument('--limit', type=int, default=100, help='Maximum number of jobs claimed at once')
+        parser.add_argument('--sleep', type=float, default=1.0, help='Seconds to wait when the queue is empty')
+
+    def handle(self, *args, **options):
+        while True:
+            processed = run_pending(options['limit'])
+            if processed:
+                self.stdout.write('Processed {} job(s)'.format(processed))
+
+            if options['once']:
+                break
+            if not processed:
+                time.sleep(options['sleep'])
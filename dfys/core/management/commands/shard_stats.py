@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from dfys.core.models import Category, Skill, Activity, ActivityEntry, UserShard
+from dfys.core.sharding import count_across_shards
+
+
+class Command(BaseCommand):
+    help = 'Prints the number of users and rows stored on each shard'
+
+    def handle(self, *args, **options):
+        users = dict(UserShard.objects.values_list('alias').annotate(count=Count('user')))
+        users['default'] = User.objects.count() - sum(users.values())
+
+        counts = {model: count_across_shards(model.objects.all())
+                  for model in (Category, Skill, Activity, ActivityEntry)}
+        for alias in settings.SHARD_DATABASES:
+            self.stdout.write('{}: {} user(s), {}'.format(alias, users.get(alias, 0), ', '.join(
+                '{} {}'.format(model_counts[alias], model._meta.model_name) for model, model_counts in counts.items()
+            )))
@@ -0,0 +1,416 @@
+import hashlib
+import re
+import threading
+import time
+import uuid
+import zlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+
+from dfys.core.authentication import request_user_id
+from dfys.core.db_routers import reads_from_replicas
+from dfys.core.models import IdempotencyKey
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class GzipCompressor:
+    encoding = 'gzip'
+
+    def __init__(self):
+        self._compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class BrotliCompressor:
+    encoding = 'br'
+
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=4)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+class ZstdCompressor:
+    encoding = 'zstd'
+
+    def __init__(self):
+        self._compressor = zstandard.ZstdCompressor(level=3).compressobj()
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+def available_compressors():
+    """
+    Compressors in server preference order, limited to the ones whose libraries are installed.
+    """
+    compressors = []
+    if brotli is not None:
+        compressors.append(BrotliCompressor)
+    if zstandard is not None:
+        compressors.append(ZstdCompressor)
+    compressors.append(GzipCompressor)
+    return compressors
+
+
+def negotiate_compressor(accept_encoding, compressors=None):
+    """
+    Picks the first server preferred compressor that the client accepts with a non-zero q value.
+    """
+    accepted = {}
+    for part in accept_encoding.split(','):
+        coding, _, params = part.strip().partition(';')
+        match = re.search(r'q=([0-9.]+)', params)
+        try:
+            q = float(match.group(1)) if match else 1.0
+        except ValueError:
+            # Malformed q values (q=., q=1.0.0) make the coding not acceptable
+            q = 0
+        accepted[coding.strip().lower()] = q
+
+    for compressor in compressors or available_compressors():
+        q = accepted.get(compressor.encoding, accepted.get('*', 0))
+        if q > 0:
+            return compressor
+    return None
+
+
+def compress_bytes(compressor_class, content):
+    compressor = compressor_class()
+    return compressor.compress(content) + compressor.finish()
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """
+    Negotiated response compression for API payloads. Small bodies are sent as they are,
+    streamed bodies are compressed chunk by chunk (each chunk is flushed so streams stay live)
+    and compressed bytes of repeated identical bodies are served from cache.
+    """
+    # HTML pages carry the CSRF token next to reflected input, compressing them would expose the token
+    # to BREACH. MessagePack is already compact binary.
+    COMPRESSIBLE_TYPES = (
+        'application/json',
+        'application/vnd.dfys.columnar+json',
+        'application/x-ndjson',
+        'application/javascript',
+        'text/css',
+        'text/plain',
+    )
+
+    def process_response(self, request, response):
+        if response.has_header('Content-Encoding') or response.status_code != 200:
+            return response
+
+        content_type = response.get('Content-Type', '').split(';')[0].strip()
+        if content_type not in self.COMPRESSIBLE_TYPES:
+            return response
+
+        if not response.streaming and len(response.content) < settings.COMPRESSION_MIN_SIZE:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+
+        compressor_class = negotiate_compressor(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if compressor_class is None:
+            return response
+
+        if response.streaming:
+            response.streaming_content = self.compress_stream(compressor_class, response.streaming_content)
+            del response['Content-Length']
+        else:
+            response.content = self.compress_content(compressor_class, response.content)
+            response['Content-Length'] = str(len(response.content))
+
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = compressor_class.encoding
+
+        return response
+
+    @staticmethod
+    def compress_content(compressor_class, content):
+        timeout = settings.COMPRESSION_CACHE_TIMEOUT
+        if not timeout:
+            return compress_bytes(compressor_class, content)
+
+        key = 'compressed:{}:{}'.format(compressor_class.encoding, hashlib.sha1(content).hexdigest())
+        compressed = cache.get(key)
+        if compressed is None:
+            compressed = compress_bytes(compressor_class, content)
+            cache.set(key, compressed, timeout)
+        return compressed
+
+    @staticmethod
+    def compress_stream(compressor_class, chunks):
+        compressor = compressor_class()
+        for chunk in chunks:
+            data = compressor.compress(chunk) + compressor.flush()
+            if data:
+                yield data
+        yield compressor.finish()
+
+
+class IdempotencyMiddleware:
+    """
+    Makes authenticated POST requests carrying an Idempotency-Key header safe to retry: the first
+    response is stored for IDEMPOTENCY_KEY_TTL seconds and returned again for retries with the same key,
+    without running the view. Only responses of requests the view processed (2xx and validation errors)
+    are stored, retries of server errors and of throttled or otherwise rejected requests run for real.
+
+    Requests are told apart by their body. Multipart uploads and IDEMPOTENCY_STREAMING_PATHS are not read
+    here, they are identified by the Content-Digest header (RFC 9530) the client has to send along the key.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.streaming_paths = [re.compile(path) for path in settings.IDEMPOTENCY_STREAMING_PATHS]
+
+    def __call__(self, request):
+        key = request.META.get('HTTP_IDEMPOTENCY_KEY')
+        if request.method != 'POST' or not key:
+            return self.get_response(request)
+
+        user_id = request_user_id(request)
+        if user_id is None:
+            return self.get_response(request)
+
+        fingerprint = self.fingerprint(request)
+        if fingerprint is None:
+            return JsonResponse({'detail': 'Idempotency-Key requires a Content-Digest header for this request.'},
+                                status=400)
+
+        record = self.claim(user_id, key[:255], fingerprint)
+        if not isinstance(record, IdempotencyKey):
+            return record
+
+        response = self.get_response(request)
+
+        if response.streaming or not self.is_final(response.status_code):
+            record.delete()
+        else:
+            record.status_code = response.status_code
+            record.content_type = response.get('Content-Type', '')
+            record.content = response.content
+            record.save(update_fields=['status_code', 'content_type', 'content'])
+        return response
+
+    @staticmethod
+    def is_final(status_code):
+        return 200 <= status_code < 300 or status_code == 400
+
+    def fingerprint(self, request):
+        """
+        Digest of the request, None when the body may not be read here and the client sent no Content-Digest.
+        """
+        digest = hashlib.sha256(request.path.encode())
+        if request.content_type == 'multipart/form-data' or \
+                any(path.match(request.path) for path in self.streaming_paths):
+            # Reading these bodies here would buffer uploads and streams in memory
+            content_digest = request.META.get('HTTP_CONTENT_DIGEST')
+            if not content_digest:
+                return None
+            digest.update(content_digest.encode())
+        else:
+            digest.update(request.body)
+        return digest.hexdigest()
+
+    def claim(self, user_id, key, fingerprint):
+        """
+        Returns a new in-progress record or a response to send instead of processing the request.
+        """
+        try:
+            with transaction.atomic():
+                return IdempotencyKey.objects.create(owner_id=user_id, key=key, fingerprint=fingerprint,
+                                                     lock_expires=self.lock_expiry())
+        except IntegrityError:
+            pass
+
+        record = IdempotencyKey.objects.filter(owner_id=user_id, key=key).first()
+        if record is None or record.add_date < timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL):
+            IdempotencyKey.objects.filter(owner_id=user_id, key=key).delete()
+            return self.claim(user_id, key, fingerprint)
+
+        if record.fingerprint != fingerprint:
+            return JsonResponse({'detail': 'Idempotency-Key was used for a different request.'}, status=422)
+
+        if record.status_code is None:
+            if record.lock_expires is None or record.lock_expires < timezone.now():
+                # Take the request over, unless another retry did so meanwhile
+                lock_expires = self.lock_expiry()
+                if IdempotencyKey.objects.filter(pk=record.pk, status_code=None, lock_expires=record.lock_expires) \
+                        .update(lock_expires=lock_expires):
+                    record.lock_expires = lock_expires
+                    return record
+
+            response = JsonResponse({'detail': 'Request with this Idempotency-Key is in progress.'}, status=409)
+            response['Retry-After'] = '1'
+            return response
+
+        response = HttpResponse(bytes(record.content), status=record.status_code, content_type=record.content_type)
+        response['Idempotent-Replayed'] = 'true'
+        return response
+
+    @staticmethod
+    def lock_expiry():
+        return timezone.now() + timedelta(seconds=settings.IDEMPOTENCY_LOCK_TIMEOUT)
+
+
+class Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+class CoalescingMiddleware:
+    """
+    Single-flight for the GET endpoints matching COALESCE_PATHS: concurrent identical requests
+    (same user, URL and Accept header) wait for one of them to compute the response and share it.
+    Threads of one process wait on an in-process event, processes wait on a lock in the shared cache
+    and pick up the leader's response from the cache. Requests arriving after the response is done
+    compute a fresh one, so nothing is served from a cache beyond the lifetime of a computation.
+
+    Requests pinned to the primary after a write (see ReplicaRoutingMiddleware) are never coalesced,
+    a flight which started before the write or reads from a replica could miss it.
+    """
+    _flights = {}
+    _flights_lock = threading.Lock()
+
+    POLL_INTERVAL = 0.05
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.paths = [re.compile(path) for path in settings.COALESCE_PATHS]
+
+    def __call__(self, request):
+        if request.method != 'GET' or not any(path.match(request.path) for path in self.paths):
+            return self.get_response(request)
+
+        user_id = request_user_id(request)
+        if user_id is None or (settings.REPLICA_DATABASES and not reads_from_replicas()):
+            return self.get_response(request)
+
+        key = self.key(user_id, request)
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Flight()
+
+        if not leader:
+            flight.done.wait(settings.COALESCE_WAIT_TIMEOUT)
+            return self.replay(flight.result) or self.get_response(request)
+
+        try:
+            response, flight.result = self.compute_across_processes(key, request)
+        finally:
+            with self._flights_lock:
+                del self._flights[key]
+            flight.done.set()
+        return response
+
+    @staticmethod
+    def key(user_id, request):
+        digest = hashlib.sha1('{}\n{}'.format(request.get_full_path(), request.META.get('HTTP_ACCEPT', '')).encode())
+        return 'coalesce:{}:{}'.format(user_id, digest.hexdigest())
+
+    def compute_across_processes(self, key, request):
+        """
+        Returns the response and its shareable (status, headers, content) form, None if it cannot be shared.
+        Waits for another process computing the same response, computes it itself when there is none
+        or when the other one did not finish in COALESCE_WAIT_TIMEOUT.
+        """
+        lock_key = key + ':lock'
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + settings.COALESCE_WAIT_TIMEOUT
+
+        while not cache.add(lock_key, token, settings.COALESCE_LOCK_TIMEOUT):
+            leader_token = cache.get(lock_key)
+            if leader_token is None:
+                continue
+            result = self.wait_for_result(key, leader_token, deadline)
+            if result is not None:
+                return self.replay(result), result
+            if time.monotonic() >= deadline:
+                response = self.get_response(request)
+                return response, self.shareable(response)
+
+        try:
+            response = self.get_response(request)
+            result = self.shareable(response)
+            if result is not None:
+                cache.set('{}:result:{}'.format(key, token), result, settings.COALESCE_RESULT_TTL)
+        finally:
+            cache.delete(lock_key)
+        return response, result
+
+    def wait_for_result(self, key, leader_token, deadline):
+        """
+        Polls for the response of the leader holding the lock with `leader_token`. Returns None when
+        the leader released the lock without sharing a response or the deadline passed.
+        """
+        result_key = '{}:result:{}'.format(key, leader_token)
+        while time.monotonic() < deadline:
+            result = cache.get(result_key)
+            if result is not None:
+                return result
+            if cache.get(key + ':lock') != leader_token:
+                return cache.get(result_key)
+            time.sleep(self.POLL_INTERVAL)
+        return None
+
+    @staticmethod
+    def shareable(response):
+        if response.streaming or response.status_code != 200 or response.cookies:
+            return None
+        if hasattr(response, 'render') and not response.is_rendered:
+            response.render()
+        return response.status_code, list(response.items()), response.content
+
+    @staticmethod
+    def replay(result):
+        if result is None:
+            return None
+
+        status_code, headers, content = result
+        response = HttpResponse(content, status=status_code)
+        for name, value in headers:
+            response[name] = value
+        return response
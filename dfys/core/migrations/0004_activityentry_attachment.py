@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:18
+
+import dfys.core.files
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_category_display_order'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='activityentry',
+            name='attachment',
+            field=models.FileField(blank=True, storage=dfys.core.files.ContentAddressedStorage(), upload_to=''),
+        ),
+        migrations.AddField(
+            model_name='activityentry',
+            name='attachment_name',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_activity_recent_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='activity',
+            name='version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='activityentry',
+            name='version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:33
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_idempotencykey'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='skill',
+            name='unique_name_per_owner',
+        ),
+        migrations.AddField(
+            model_name='skill',
+            name='is_hidden',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name='skill',
+            index=models.Index(condition=models.Q(('is_hidden', False)), fields=['owner'], name='skill_visible_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='skill',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_hidden', False)), fields=('owner', 'name'), name='unique_name_per_owner'),
+        ),
+    ]
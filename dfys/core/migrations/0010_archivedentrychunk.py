@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_skill_is_hidden'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedEntryChunk',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('add_date', models.DateTimeField(auto_now_add=True)),
+                ('first_id', models.PositiveIntegerField()),
+                ('last_id', models.PositiveIntegerField()),
+                ('count', models.PositiveIntegerField()),
+                ('content', models.BinaryField()),
+                ('activity', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.activity')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['activity', '-last_id'], name='archived_entries_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_admin_search_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usershard',
+            name='is_moving',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_usershard_is_moving'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='activityentry',
+            name='restore_date',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_activityentry_restore_date'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='activity',
+            name='cloned_from',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -1,6 +1,11 @@
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.db import models
+from django.utils import timezone
+
+from dfys.core.files import ContentAddressedStorage
+
+attachment_storage = ContentAddressedStorage()
 
 
 class TrackCreateModel(models.Model):
@@ -30,15 +35,28 @@ class Category(models.Model):
                                                  MaxValueValidator(ORDER_MAX_VALUE)
                                              ])
 
+    class Meta:
+        indexes = [
+            # pattern ops let PostgreSQL use the index for prefix searches (LIKE 'name%')
+            models.Index(fields=['name'], opclasses=['varchar_pattern_ops'], name='category_name_idx'),
+        ]
+
 
 class Skill(TrackCreateModel):
     owner = models.ForeignKey(User, on_delete=models.CASCADE)
     categories = models.ManyToManyField(Category)
     name = models.CharField(max_length=128)
+    # Deleted skills are hidden at once and purged with their activities later, see dfys.core.purge
+    is_hidden = models.BooleanField(default=False)
 
     class Meta:
         constraints = [
-            models.UniqueConstraint(fields=['owner', 'name'], name='unique_name_per_owner')
+            models.UniqueConstraint(fields=['owner', 'name'], condition=models.Q(is_hidden=False),
+                                    name='unique_name_per_owner')
+        ]
+        indexes = [
+            models.Index(fields=['owner'], condition=models.Q(is_hidden=False), name='skill_visible_idx'),
+            models.Index(fields=['name'], opclasses=['varchar_pattern_ops'], name='skill_name_idx'),
         ]
 
 
@@ -47,8 +65,98 @@ class Activity(TrackCreateUpdateModel):
     category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True)
     skill = models.ForeignKey(Skill, on_delete=models.CASCADE)
     description = models.TextField(blank=True, default='')
+    version = models.PositiveIntegerField(default=1)
+    # Id of the activity this one is a copy of, pairs copies with their originals when a skill is cloned
+    cloned_from = models.PositiveIntegerField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['skill', '-modify_date'], name='activity_recent_idx'),
+            models.Index(fields=['title'], opclasses=['varchar_pattern_ops'], name='activity_title_idx'),
+        ]
 
 
 class ActivityEntry(TrackCreateUpdateModel):
     activity = models.ForeignKey(Activity, on_delete=models.CASCADE)
     comment = models.TextField(blank=True)
+    attachment = models.FileField(storage=attachment_storage, blank=True)
+    attachment_name = models.CharField(max_length=255, blank=True)
+    version = models.PositiveIntegerField(default=1)
+    # When the entry was last restored from the archive, it is archived again only once this gets old too
+    restore_date = models.DateTimeField(null=True, blank=True)
+
+
+class ArchivedEntryChunk(TrackCreateModel):
+    """
+    Old entries of an activity moved out of ActivityEntry, stored as a zlib compressed JSON list.
+    Reads decode them in place, a chunk is restored back into ActivityEntry when one of its entries is
+    changed or deleted, see dfys.core.archive.
+    """
+    activity = models.ForeignKey(Activity, on_delete=models.CASCADE)
+    first_id = models.PositiveIntegerField()
+    last_id = models.PositiveIntegerField()
+    count = models.PositiveIntegerField()
+    content = models.BinaryField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['activity', '-last_id'], name='archived_entries_idx'),
+        ]
+
+
+class UserShard(models.Model):
+    """
+    Shard map entry: alias of the database holding the user's data. Lives on 'default',
+    users without an entry keep their data on 'default' too. See dfys.core.sharding.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True)
+    alias = models.CharField(max_length=64)
+    # Set while the user's data is being moved to another shard, their writes are refused meanwhile
+    is_moving = models.BooleanField(default=False)
+
+
+class Job(TrackCreateUpdateModel):
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    name = models.CharField(max_length=128)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    # Running jobs whose lease expired are requeued, their worker is assumed to have died
+    lease_expires = models.DateTimeField(null=True)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='job_pending_idx'),
+        ]
+
+
+class IdempotencyKey(TrackCreateModel):
+    """
+    Response stored for a POST made with an Idempotency-Key header. status_code is empty
+    while the original request is still being processed, retries may take the request over
+    once lock_expires has passed (the worker processing it is then assumed dead).
+    """
+    owner = models.ForeignKey(User, on_delete=models.CASCADE)
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(null=True)
+    lock_expires = models.DateTimeField(null=True)
+    content_type = models.CharField(max_length=255, blank=True)
+    content = models.BinaryField(blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'key'], name='unique_idempotency_key_per_owner')
+        ]
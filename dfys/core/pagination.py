@@ -0,0 +1,82 @@
+from base64 import b64encode
+from urllib import parse
+
+from django.conf import settings
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination, Cursor, _positive_int
+
+
+class EntriesCursorPagination(CursorPagination):
+    """
+    Newest first pages of activity entries. Cursor only remembers the last returned id,
+    so every page is a single indexed range query regardless of how deep the client pages.
+
+    Views with an `archived_entries(before_id, after_id, count)` method get their archived entries
+    merged into the pages by id, ids are unique so cursors need no offsets.
+    """
+    ordering = '-id'
+    page_size_query_param = 'page_size'
+    merges_archive = False
+
+    def paginate_queryset(self, queryset, request, view=None):
+        archived_entries = getattr(view, 'archived_entries', None)
+        if archived_entries is None:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        try:
+            position = int(self.cursor.position) if self.cursor and self.cursor.position is not None else None
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        size = self.page_size
+
+        if self.cursor and self.cursor.reverse:
+            live = list(queryset.filter(id__gt=position).order_by('id')[:size + 1])
+            entries = sorted(live + archived_entries(after_id=position, count=size + 1), key=lambda entry: entry.pk)
+            self.has_previous, self.has_next = len(entries) > size, True
+            self.page = entries[:size][::-1]
+        else:
+            live = queryset.filter(id__lt=position) if position is not None else queryset
+            live = list(live.order_by('-id')[:size + 1])
+            entries = sorted(live + archived_entries(before_id=position, count=size + 1), key=lambda entry: -entry.pk)
+            self.has_previous, self.has_next = position is not None, len(entries) > size
+            self.page = entries[:size]
+
+        self.merges_archive, self.position = True, position
+        return self.page
+
+    def get_next_link(self):
+        if not self.merges_archive:
+            return super().get_next_link()
+        if not self.has_next:
+            return None
+        position = self.page[-1].pk if self.page else self.position
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=str(position)))
+
+    def get_previous_link(self):
+        if not self.merges_archive:
+            return super().get_previous_link()
+        if not self.has_previous:
+            return None
+        position = self.page[0].pk if self.page else self.position
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=str(position)))
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(request.query_params[self.page_size_query_param],
+                                 strict=True,
+                                 cutoff=settings.ENTRIES_MAX_PAGE_SIZE)
+        except (KeyError, ValueError):
+            return settings.ENTRIES_PAGE_SIZE
+
+    @staticmethod
+    def cursor_after(entry):
+        """
+        Cursor token of the page following `entry`, same format as the one in `next` links.
+        """
+        querystring = parse.urlencode({'p': str(entry.pk)})
+        return b64encode(querystring.encode('ascii')).decode('ascii')
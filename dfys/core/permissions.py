@@ -3,4 +3,4 @@ from rest_framework.permissions import BasePermission
 
 class IsOwner(BasePermission):
     def has_object_permission(self, request, view, obj):
-        return request.user == obj.owner
+        return obj.owner_id == request.user.pk
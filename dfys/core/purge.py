@@ -0,0 +1,73 @@
+"""
+Soft delete of skills and accounts. Requests only hide the row, background tasks then remove
+its descendants in batches of PURGE_BATCH_SIZE rows with plain DELETE statements, without loading
+them into Python for Django's cascade collector. Rows are deleted children first, so no cascade is needed.
+"""
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import router, transaction
+
+from dfys.core.db_routers import use_shard, locate_user_for_write
+from dfys.core.models import Category, Skill, Activity, ActivityEntry, ArchivedEntryChunk, IdempotencyKey
+from dfys.core.tasks import task
+
+
+def delete_in_batches(queryset, batch_size=None):
+    """
+    Deletes rows matched by `queryset` without cascading, each batch in its own transaction.
+    """
+    batch_size = batch_size or settings.PURGE_BATCH_SIZE
+    model = queryset.model
+    db = queryset._db or router.db_for_write(model)
+    deleted = 0
+    while True:
+        ids = list(queryset.using(db).order_by().values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        with transaction.atomic(using=db):
+            deleted += model.objects.filter(pk__in=ids)._raw_delete(using=db)
+
+
+def hide_skill(skill):
+    skill.is_hidden = True
+    skill.save(update_fields=['is_hidden'])
+    transaction.on_commit(lambda: purge_skill.delay(skill_id=skill.pk, owner_id=skill.owner_id),
+                          using=skill._state.db)
+
+
+def hide_account(user):
+    user.is_active = False
+    user.save(update_fields=['is_active'])
+    transaction.on_commit(lambda: purge_account.delay(user_id=user.pk))
+
+
+@task(max_attempts=5)
+def purge_skill(skill_id, owner_id=None):
+    # Raises ShardMoveInProgress while the owner's data is being moved, the job is then retried
+    with use_shard(locate_user_for_write(owner_id)):
+        if not Skill.objects.filter(pk=skill_id, is_hidden=True).exists():
+            return
+
+        delete_in_batches(ActivityEntry.objects.filter(activity__skill_id=skill_id))
+        delete_in_batches(ArchivedEntryChunk.objects.filter(activity__skill_id=skill_id))
+        delete_in_batches(Activity.objects.filter(skill_id=skill_id))
+        delete_in_batches(Skill.categories.through.objects.filter(skill_id=skill_id))
+        delete_in_batches(Skill.objects.filter(pk=skill_id))
+
+
+@task(max_attempts=5)
+def purge_account(user_id):
+    user = User.objects.filter(pk=user_id, is_active=False).first()
+    if user is None:
+        return
+
+    with use_shard(locate_user_for_write(user_id)):
+        Skill.objects.filter(owner=user).update(is_hidden=True)
+        for skill_id in Skill.objects.filter(owner=user).values_list('pk', flat=True):
+            purge_skill(skill_id, user_id)
+
+        delete_in_batches(Skill.categories.through.objects.filter(category__owner=user))
+        Activity.objects.filter(category__owner=user).update(category=None)
+        delete_in_batches(Category.objects.filter(owner=user))
+    delete_in_batches(IdempotencyKey.objects.filter(owner=user))
+    user.delete()
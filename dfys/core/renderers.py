@@ -0,0 +1,74 @@
+from djangorestframework_camel_case.settings import api_settings as camel_case_settings
+from djangorestframework_camel_case.util import camelize
+from rest_framework.renderers import JSONRenderer, BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+def is_id_keyed(data):
+    """
+    Tells whether data looks like DictSerializer output: a non empty map of
+    objects, each one stored under its own id.
+    """
+    return isinstance(data, dict) and len(data) > 0 and all(
+        isinstance(item, dict) and item.get('id') == key for key, item in data.items()
+    )
+
+
+def to_columnar(data):
+    """
+    Recursively replaces id-keyed maps with {'fields': [...], 'columns': [[...], ...]}
+    so that field names are sent once per collection instead of once per row.
+    """
+    if is_id_keyed(data):
+        fields = list(next(iter(data.values())).keys())
+        return {
+            'fields': fields,
+            'columns': [[to_columnar(item.get(field)) for item in data.values()] for field in fields],
+        }
+    if isinstance(data, dict):
+        return {key: to_columnar(value) for key, value in data.items()}
+    if isinstance(data, (list, tuple)):
+        return [to_columnar(item) for item in data]
+    return data
+
+
+class ColumnarJSONRenderer(JSONRenderer):
+    media_type = 'application/vnd.dfys.columnar+json'
+    format = 'columnar'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        data = to_columnar(camelize(data, **camel_case_settings.JSON_UNDERSCOREIZE))
+        return super().render(data, accepted_media_type, renderer_context)
+
+
+class ColumnarMessagePackRenderer(BaseRenderer):
+    media_type = 'application/x-msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if msgpack is None:
+            raise ImportError('msgpack has to be installed to use {}'.format(self.__class__.__name__))
+
+        if data is None:
+            return b''
+
+        data = to_columnar(camelize(data, **camel_case_settings.JSON_UNDERSCOREIZE))
+        return msgpack.packb(data, default=JSONEncoder().default)
+
+
+class EventStreamRenderer(BaseRenderer):
+    """
+    Lets content negotiation accept text/event-stream, views using it return the stream themselves.
+    """
+    media_type = 'text/event-stream'
+    format = 'event-stream'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return data
@@ -1,13 +1,23 @@
 from abc import ABC
+from collections import OrderedDict
 
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.db import models
+from djangorestframework_camel_case.settings import api_settings as camel_case_settings
+from djangorestframework_camel_case.util import camel_to_underscore
 from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
 from rest_framework.utils.serializer_helpers import ReturnDict
 
+from dfys.core.archive import archived_entries
+from dfys.core.fragments import render_many
 from dfys.core.models import Category, Skill, Activity, ActivityEntry
+from dfys.core.pagination import EntriesCursorPagination
 
 
 ADD_MODIFY_FIELDS = ['add_date', 'modify_date']
+VERSIONED_FIELDS = ADD_MODIFY_FIELDS + ['version']
 
 
 class DictSerializer(serializers.ListSerializer, ABC):
@@ -36,6 +46,58 @@ class DictSerializer(serializers.ListSerializer, ABC):
         return {item[self.dict_key]: item for item in items}
 
 
+class CachedDictSerializer(DictSerializer, ABC):
+    """
+    DictSerializer assembling the output from cached per-object fragments, see dfys.core.fragments.
+    The child serializer names the fields that make up the cache key in `fragment_key_fields`.
+    """
+
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, models.Manager) else data
+        items = render_many(self.child, list(iterable))
+        return {item[self.dict_key]: item for item in items}
+
+
+def requested_fields(request):
+    """
+    Set of field names requested with ?fields= (camelCase or snake_case) on a read request, None otherwise.
+    """
+    if request is None or request.method not in SAFE_METHODS or not hasattr(request, 'query_params'):
+        return None
+
+    raw = request.query_params.get('fields')
+    if not raw:
+        return None
+    return {camel_to_underscore(name.strip(), **camel_case_settings.JSON_UNDERSCOREIZE)
+            for name in raw.split(',') if name.strip()}
+
+
+class SparseFieldsMixin:
+    """
+    Limits output of the top level serializer to the fields requested with ?fields=, also when it
+    is the child of a list serializer or sits under one of `sparse_fields_envelope` fields of its parent.
+    'id' is always kept, so DictSerializer keys stay intact.
+    Serializers built by method fields get 'nested' in their context and are left untouched.
+    """
+
+    def get_fields(self):
+        fields = super().get_fields()
+        requested = requested_fields(self.context.get('request'))
+        if requested is None or self.context.get('nested') or not self.is_sparse_root():
+            return fields
+
+        return OrderedDict((name, field) for name, field in fields.items() if name in requested or name == 'id')
+
+    def is_sparse_root(self):
+        node, parent = self, self.parent
+        while parent is not None:
+            if not isinstance(parent, serializers.ListSerializer) \
+                    and node.field_name not in getattr(parent, 'sparse_fields_envelope', ()):
+                return False
+            node, parent = parent, parent.parent
+        return True
+
+
 class DisableCreateUpdate:
     def update(self, instance, validated_data):
         raise serializers.ValidationError('This object type cannot be created via {}'.format(self.__class__.__name__))
@@ -44,38 +106,80 @@ class DisableCreateUpdate:
         raise serializers.ValidationError('This object type be created via {}'.format(self.__class__.__name__))
 
 
-class ActivityEntrySerializer(serializers.ModelSerializer):
+class ActivityEntrySerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    fragment_key_fields = ('modify_date', 'version')
+
     class Meta:
         model = ActivityEntry
-        fields = '__all__'
+        exclude = ('restore_date',)
         ordering = ['modify_date']
-        read_only_fields = ADD_MODIFY_FIELDS
-        list_serializer_class = DictSerializer
+        read_only_fields = VERSIONED_FIELDS
+        list_serializer_class = CachedDictSerializer
         extra_kwargs = {
-            'activity': {'write_only': True, 'required': False}
+            'activity': {'write_only': True, 'required': False},
+            'attachment': {'write_only': True, 'required': False},
+            'attachment_name': {'read_only': True},
         }
 
+    def validate(self, attrs):
+        if attrs.get('attachment'):
+            attrs['attachment_name'] = attrs['attachment'].name
+        return attrs
 
-class ActivityFlatSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = Activity
-        fields = '__all__'
-        read_only_fields = ADD_MODIFY_FIELDS
-        list_serializer_class = DictSerializer
 
+class ActivityEntryIncludedSerializer(ActivityEntrySerializer):
+    """
+    Entry representation for side-loaded collections, which need to tell the entry's activity.
+    """
+    class Meta(ActivityEntrySerializer.Meta):
+        extra_kwargs = dict(ActivityEntrySerializer.Meta.extra_kwargs, activity={'read_only': True})
 
-class ActivityDeepSerializer(serializers.ModelSerializer, DisableCreateUpdate):
-    entries = ActivityEntrySerializer(many=True,
-                                      source='activityentry_set',
-                                      read_only=True)
+
+class ActivityFlatSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    # Category is part of the key, deleting a category clears it without touching modify_date
+    fragment_key_fields = ('modify_date', 'version', 'category_id')
 
     class Meta:
         model = Activity
-        fields = '__all__'
-        read_only_fields = ADD_MODIFY_FIELDS
+        exclude = ('cloned_from',)
+        read_only_fields = VERSIONED_FIELDS
+        list_serializer_class = CachedDictSerializer
 
 
-class CategoryFlatSerializer(serializers.ModelSerializer):
+class ActivityDeepSerializer(SparseFieldsMixin, serializers.ModelSerializer, DisableCreateUpdate):
+    """
+    Embeds only the latest ENTRIES_PREVIEW_SIZE entries, `entries_cursor` continues
+    from there on the activity's entries list (None when there is nothing more).
+    """
+    entries = serializers.SerializerMethodField()
+    entries_cursor = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Activity
+        exclude = ('cloned_from',)
+        read_only_fields = VERSIONED_FIELDS
+
+    def get_latest_entries(self, activity):
+        if not hasattr(self, '_latest_entries'):
+            self._latest_entries = {}
+        if activity.pk not in self._latest_entries:
+            size = settings.ENTRIES_PREVIEW_SIZE
+            entries = list(activity.activityentry_set.order_by('-id')[:size + 1])
+            entries += archived_entries(activity.archivedentrychunk_set.all(), count=size + 1)
+            entries.sort(key=lambda entry: -entry.pk)
+            self._latest_entries[activity.pk] = (entries[:size], len(entries) > size)
+        return self._latest_entries[activity.pk]
+
+    def get_entries(self, activity):
+        entries, _has_more = self.get_latest_entries(activity)
+        return ActivityEntrySerializer(entries, many=True, context=dict(self.context, nested=True)).data
+
+    def get_entries_cursor(self, activity):
+        entries, has_more = self.get_latest_entries(activity)
+        return EntriesCursorPagination.cursor_after(entries[-1]) if has_more else None
+
+
+class CategoryFlatSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     owner = serializers.HiddenField(default=serializers.CurrentUserDefault())
 
     class Meta:
@@ -85,20 +189,20 @@ class CategoryFlatSerializer(serializers.ModelSerializer):
         list_serializer_class = DictSerializer
 
 
-class CategoryInSkillSerializer(serializers.ModelSerializer):
+class CategoryInSkillSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Category
         exclude = ('owner', 'is_base_category')
         list_serializer_class = DictSerializer
 
 
-class SkillFlatSerializer(serializers.ModelSerializer):
+class SkillFlatSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     owner = serializers.HiddenField(default=serializers.CurrentUserDefault())
     categories = serializers.PrimaryKeyRelatedField(required=False, many=True, read_only=True)
 
     class Meta:
         model = Skill
-        fields = '__all__'
+        exclude = ('is_hidden', )
         read_only_fields = ['add_date']
         list_serializer_class = DictSerializer
 
@@ -109,23 +213,36 @@ class SkillFlatSerializer(serializers.ModelSerializer):
         return skill
 
 
+class SkillCloneSerializer(DisableCreateUpdate, serializers.Serializer):
+    name = serializers.CharField(max_length=128, required=False)
+    activities = serializers.BooleanField(default=True)
+    entries = serializers.BooleanField(default=True)
+
+
 class SkillListSerializer(DisableCreateUpdate, serializers.Serializer):
+    sparse_fields_envelope = ('skills',)
+
     skills = SkillFlatSerializer(many=True, read_only=True)
     categories = CategoryFlatSerializer(many=True, read_only=True)
 
 
-class SkillDeepSerializer(serializers.ModelSerializer):
+class SkillDeepSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     categories = CategoryInSkillSerializer(read_only=True, many=True)
     activities = serializers.SerializerMethodField()
 
     class Meta:
         model = Skill
-        exclude = ('owner', )
+        exclude = ('owner', 'is_hidden')
         read_only_fields = ['add_date']
 
     def get_activities(self, skill):
-        activities = Activity.objects.filter(skill=skill)
-        return ActivityFlatSerializer(activities, many=True, context={'request': self.context['request']}).data
+        activities = self.context.get('activities')
+        if activities is None:
+            activities = Activity.objects.filter(skill=skill)
+        return ActivityFlatSerializer(activities, many=True, context={
+            'request': self.context['request'],
+            'nested': True,
+        }).data
 
     def create(self, validated_data):
         raise serializers.ValidationError('Skill cannot be created via {}'.format(self.__class__.__name__))
@@ -134,7 +251,7 @@ class SkillDeepSerializer(serializers.ModelSerializer):
         raise serializers.ValidationError('Skill cannot be created via {}'.format(self.__class__.__name__))
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ('username', 'email')
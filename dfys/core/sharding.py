@@ -0,0 +1,194 @@
+"""
+Owner based sharding. Every category, skill, activity and entry belongs to one user, so all rows
+of a user are kept together on one of SHARD_DATABASES, chosen when the user registers and recorded
+in the UserShard map on 'default'. Requests are routed by dfys.core.db_routers.ShardRoutingMiddleware,
+background code wraps its queries in use_shard(shard_for_user(...)).
+
+User rows stay on 'default', each shard keeps a mirrored copy of its users' rows for the foreign keys.
+"""
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from dfys.core.db_routers import shard_for_user, forget_user_shard
+from dfys.core.models import Category, Skill, Activity, ActivityEntry, ArchivedEntryChunk, UserShard
+from dfys.core.purge import delete_in_batches
+
+MOVE_BATCH_SIZE = 1000
+
+SHARDED_MODELS = (Category, Skill, Skill.categories.through, Activity, ActivityEntry, ArchivedEntryChunk)
+
+
+def owned_querysets(user):
+    """
+    Querysets of the user's sharded rows, parents before children.
+    """
+    return [
+        Category.objects.filter(owner=user),
+        Skill.objects.filter(owner=user),
+        Skill.categories.through.objects.filter(skill__owner=user),
+        Activity.objects.filter(skill__owner=user),
+        ActivityEntry.objects.filter(activity__skill__owner=user),
+        ArchivedEntryChunk.objects.filter(activity__skill__owner=user),
+    ]
+
+
+def mirror_user(user, alias):
+    if alias == DEFAULT_DB_ALIAS:
+        return
+
+    values = {field.attname: getattr(user, field.attname) for field in User._meta.concrete_fields
+              if not field.primary_key}
+    User.objects.using(alias).update_or_create(pk=user.pk, defaults=values)
+
+
+def assign_shard(user):
+    """
+    Places a new user on a shard, spreading users evenly by id. Returns the shard alias.
+    """
+    alias = settings.SHARD_DATABASES[user.pk % len(settings.SHARD_DATABASES)]
+    if alias != DEFAULT_DB_ALIAS:
+        UserShard.objects.update_or_create(user=user, defaults={'alias': alias})
+        forget_user_shard(user.pk)
+        mirror_user(user, alias)
+    return alias
+
+
+def mirror_user_on_save(sender, instance, using, **kwargs):
+    if using == DEFAULT_DB_ALIAS:
+        mirror_user(instance, shard_for_user(instance.pk))
+
+
+def remember_user_shard(sender, instance, using, **kwargs):
+    """
+    Looks the shard up before the delete, the collector removes the user's UserShard row along with the user.
+    """
+    if using == DEFAULT_DB_ALIAS:
+        instance._shard_alias = (UserShard.objects.filter(user_id=instance.pk).values_list('alias', flat=True).first()
+                                 or DEFAULT_DB_ALIAS)
+
+
+def delete_user_mirror(sender, instance, using, **kwargs):
+    if using == DEFAULT_DB_ALIAS:
+        alias = getattr(instance, '_shard_alias', DEFAULT_DB_ALIAS)
+        if alias != DEFAULT_DB_ALIAS:
+            User.objects.using(alias).filter(pk=instance.pk).delete()
+        forget_user_shard(instance.pk)
+
+
+def reserve_id_range(alias):
+    """
+    Makes the shard hand out ids from SHARD_ID_SPAN * (shard's index in SHARD_DATABASES) on,
+    so rows keep unique ids when users are moved between shards.
+    """
+    start = settings.SHARD_DATABASES.index(alias) * settings.SHARD_ID_SPAN
+    if not start:
+        return
+
+    connection = connections[alias]
+    with connection.cursor() as cursor:
+        for model in SHARDED_MODELS:
+            table = model._meta.db_table
+            max_id = 'SELECT COALESCE(MAX(id), 0) FROM {}'.format(connection.ops.quote_name(table))
+            if connection.vendor == 'postgresql':
+                cursor.execute("SELECT setval(pg_get_serial_sequence(%s, 'id'), GREATEST(%s, ({})))".format(max_id),
+                               [table, start])
+            elif connection.vendor == 'sqlite':
+                cursor.execute('DELETE FROM sqlite_sequence WHERE name = %s', [table])
+                cursor.execute('INSERT INTO sqlite_sequence (name, seq) SELECT %s, MAX(%s, ({}))'.format(max_id),
+                               [table, start])
+            else:
+                raise NotImplementedError('Reserving id ranges is not supported on {}'.format(connection.vendor))
+
+
+def across_shards(queryset):
+    """
+    Evaluates `queryset` on every shard in turn, for admin and reporting queries spanning all users.
+    """
+    for alias in settings.SHARD_DATABASES:
+        yield from queryset.using(alias)
+
+
+def count_across_shards(queryset):
+    return {alias: queryset.using(alias).count() for alias in settings.SHARD_DATABASES}
+
+
+def copy_rows(queryset, source, target, batch_size=MOVE_BATCH_SIZE):
+    """
+    Copies rows with their ids and dates from `source` to `target`, batch by batch in id order.
+    """
+    model = queryset.model
+    date_fields = [field.name for field in model._meta.concrete_fields
+                   if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)]
+
+    copied, last_pk = 0, None
+    while True:
+        batch = queryset.using(source).order_by('pk')
+        if last_pk is not None:
+            batch = batch.filter(pk__gt=last_pk)
+        rows = list(batch[:batch_size])
+        if not rows:
+            return copied
+
+        dates = [[getattr(row, name) for name in date_fields] for row in rows]
+        model.objects.using(target).bulk_create(rows)
+        if date_fields:
+            # bulk_create stamps auto_now(_add) fields with the current time, bulk_update writes values as they are
+            for row, values in zip(rows, dates):
+                for name, value in zip(date_fields, values):
+                    setattr(row, name, value)
+            model.objects.using(target).bulk_update(rows, date_fields)
+
+        copied += len(rows)
+        last_pk = rows[-1].pk
+
+
+def move_user(user, target, progress=None):
+    """
+    Moves all of the user's rows to the `target` shard. Rows keep their ids, which stay unique when
+    shards hand out disjoint ids (see reserve_id_range), a collision aborts the move before anything is removed.
+
+    The user's writes are refused (see ShardRoutingMiddleware) from the start of the move until the shard map
+    points to `target`, after SHARD_MOVE_GRACE_SECONDS for writes already in progress to finish. Writes look
+    the shard map up uncached, so no worker keeps writing to the old shard once the move is done.
+    """
+    if target not in settings.SHARD_DATABASES:
+        raise ValueError('Unknown shard {}'.format(target))
+
+    source = shard_for_user(user.pk)
+    if source == target:
+        return
+
+    UserShard.objects.update_or_create(user=user, defaults={'alias': source, 'is_moving': True})
+    forget_user_shard(user.pk)
+    try:
+        time.sleep(settings.SHARD_MOVE_GRACE_SECONDS)
+        with transaction.atomic(using=target):
+            mirror_user(user, target)
+            for queryset in owned_querysets(user):
+                copied = copy_rows(queryset, source, target)
+                if progress is not None:
+                    progress(queryset.model, copied)
+    except BaseException:
+        _set_user_shard(user, source)
+        raise
+
+    _set_user_shard(user, target)
+
+    for queryset in reversed(owned_querysets(user)):
+        delete_in_batches(queryset.using(source))
+    if source != DEFAULT_DB_ALIAS:
+        User.objects.using(source).filter(pk=user.pk).delete()
+
+
+def _set_user_shard(user, alias):
+    """
+    Points the shard map to `alias` and lifts the write freeze of a move.
+    """
+    if alias == DEFAULT_DB_ALIAS:
+        UserShard.objects.filter(user=user).delete()
+    else:
+        UserShard.objects.update_or_create(user=user, defaults={'alias': alias, 'is_moving': False})
+    forget_user_shard(user.pk)
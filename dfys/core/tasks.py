@@ -0,0 +1,152 @@
+"""
+Database backed task queue. Tasks are plain functions registered with @task and
+enqueued as Job rows, `manage.py run_worker` executes them outside of the request path.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from dfys.core.models import Job
+
+logger = logging.getLogger(__name__)
+
+_registry = {}
+
+
+class Task:
+    def __init__(self, func, name, max_attempts, batch_size):
+        self.func = func
+        self.name = name
+        self.max_attempts = max_attempts
+        self.batch_size = batch_size
+
+    def __call__(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
+
+    def delay(self, **payload):
+        return enqueue(self.name, **payload)
+
+    def run(self, payloads):
+        """
+        Batched tasks receive a list of payloads, the other ones are called once per payload.
+        """
+        if self.batch_size > 1:
+            self.func(payloads)
+        else:
+            for payload in payloads:
+                self.func(**payload)
+
+
+def task(name=None, max_attempts=3, batch_size=1):
+    """
+    Registers function as a task. With batch_size > 1 pending jobs of the task are
+    grouped and the function is called with a list of their payloads.
+    """
+    def decorator(func):
+        task_name = name or '{}.{}'.format(func.__module__, func.__name__)
+        registered = Task(func, task_name, max_attempts, batch_size)
+        _registry[task_name] = registered
+        return registered
+
+    return decorator
+
+
+def get_task(name):
+    return _registry[name]
+
+
+def enqueue(name, **payload):
+    if name not in _registry:
+        raise KeyError('Task {} is not registered'.format(name))
+
+    if settings.TASKS_ALWAYS_EAGER:
+        get_task(name).run([payload])
+        return None
+
+    return Job.objects.create(name=name, payload=payload)
+
+
+def lease_expiry():
+    return timezone.now() + timedelta(seconds=settings.TASKS_LEASE_SECONDS)
+
+
+def requeue_abandoned():
+    """
+    Retries (or fails, when out of attempts) running jobs whose lease expired. Returns how many there were.
+    """
+    with transaction.atomic():
+        jobs = list(Job.objects
+                    .select_for_update(skip_locked=True)
+                    .filter(status=Job.STATUS_RUNNING, lease_expires__lt=timezone.now()))
+        for job in jobs:
+            logger.warning('Job %s of task %s was abandoned', job.pk, job.name)
+            retry_or_fail(job, TimeoutError('Lease expired'))
+    return len(jobs)
+
+
+def claim_jobs(limit):
+    requeue_abandoned()
+    with transaction.atomic():
+        jobs = list(Job.objects
+                    .select_for_update(skip_locked=True)
+                    .filter(status=Job.STATUS_PENDING, run_after__lte=timezone.now())
+                    .order_by('run_after')[:limit])
+        Job.objects.filter(pk__in=[job.pk for job in jobs]).update(status=Job.STATUS_RUNNING,
+                                                                   lease_expires=lease_expiry())
+    return jobs
+
+
+def run_pending(limit=100):
+    """
+    Runs up to `limit` due jobs and returns how many of them were processed.
+    """
+    jobs = claim_jobs(limit)
+
+    batches = []
+    by_name = {}
+    for job in jobs:
+        registered = _registry.get(job.name)
+        batch_size = registered.batch_size if registered else 1
+        batch = by_name.get(job.name)
+        if batch is None or len(batch) >= batch_size:
+            batch = by_name[job.name] = []
+            batches.append(batch)
+        batch.append(job)
+
+    for batch in batches:
+        run_batch(batch)
+
+    return len(jobs)
+
+
+def run_batch(jobs):
+    name = jobs[0].name
+    ids = [job.pk for job in jobs]
+    # The lease covers this batch only, not the batches of the claim which ran before it
+    Job.objects.filter(pk__in=ids).update(lease_expires=lease_expiry())
+
+    try:
+        get_task(name).run([job.payload for job in jobs])
+    except Exception as e:
+        logger.exception('Task %s failed', name)
+        for job in jobs:
+            retry_or_fail(job, e)
+    else:
+        Job.objects.filter(pk__in=ids).update(status=Job.STATUS_DONE, modify_date=timezone.now())
+
+
+def retry_or_fail(job, error):
+    job.attempts += 1
+    job.last_error = repr(error)
+
+    registered = _registry.get(job.name)
+    if registered is not None and job.attempts < registered.max_attempts:
+        job.status = Job.STATUS_PENDING
+        job.run_after = timezone.now() + timedelta(seconds=settings.TASKS_RETRY_DELAY * 2 ** (job.attempts - 1))
+    else:
+        job.status = Job.STATUS_FAILED
+
+    job.save(update_fields=['attempts', 'last_error', 'status', 'run_after', 'modify_date'])
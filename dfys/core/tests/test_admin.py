@@ -0,0 +1,96 @@
+import pytest
+from django.db import connection
+from django.urls import reverse
+
+from dfys.core.admin import estimated_count, EstimatedCountPaginator
+from dfys.core.models import ActivityEntry
+from dfys.core.tests.test_factory import UserFactory, SkillFactory, ActivityFactory, CommentFactory
+
+
+@pytest.mark.django_db
+class TestAdmin:
+    @pytest.fixture(autouse=True)
+    def admin_user(self, client):
+        self.user = UserFactory(is_staff=True, is_superuser=True)
+        client.force_login(self.user)
+        self.client = client
+
+    def analyze(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def create_entries(self):
+        activity = ActivityFactory(title='Running', skill=SkillFactory(owner=self.user))
+        return [CommentFactory(activity=activity) for _ in range(5)]
+
+    def test_estimated_count(self):
+        self.create_entries()
+        assert estimated_count(ActivityEntry.objects.all()) is None
+
+        self.analyze()
+
+        assert estimated_count(ActivityEntry.objects.all()) == 5
+        assert estimated_count(ActivityEntry.objects.filter(comment='comment')) is None
+
+    def test_paginator(self, settings):
+        settings.ADMIN_EXACT_COUNT_LIMIT = 2
+        entries = self.create_entries()
+        self.analyze()
+        ActivityEntry.objects.filter(pk=entries[0].pk).delete()
+
+        assert EstimatedCountPaginator(ActivityEntry.objects.order_by('-id'), 2).count == 5
+        assert EstimatedCountPaginator(ActivityEntry.objects.filter(comment='comment').order_by('-id'), 2).count == 4
+
+        settings.ADMIN_EXACT_COUNT_LIMIT = 10
+        assert EstimatedCountPaginator(ActivityEntry.objects.order_by('-id'), 2).count == 4
+
+    def test_paginator_id_cursor(self, settings, django_assert_num_queries):
+        settings.ADMIN_EXACT_COUNT_LIMIT = 2
+        entries = self.create_entries()
+        self.analyze()
+
+        assert estimated_count(ActivityEntry.objects.filter(id__lt=entries[2].pk)) == 5
+        assert estimated_count(ActivityEntry.objects.filter(id__lt=entries[2].pk, comment='comment')) is None
+        assert estimated_count(ActivityEntry.objects.filter(activity_id__lt=entries[2].pk)) is None
+        assert estimated_count(ActivityEntry.objects.filter(activity__id__lt=entries[2].pk)) is None
+
+        page = ActivityEntry.objects.filter(id__lt=entries[2].pk).order_by('-id')
+        with django_assert_num_queries(2):
+            assert EstimatedCountPaginator(page, 2).count == 5
+
+    def test_changelists(self, django_assert_max_num_queries):
+        self.create_entries()
+
+        for model in ('category', 'skill', 'activity', 'activityentry'):
+            with django_assert_max_num_queries(8):
+                response = self.client.get(reverse('admin:core_{}_changelist'.format(model)))
+            assert response.status_code == 200
+
+    def test_search(self):
+        entries = self.create_entries()
+        url = reverse('admin:core_activityentry_changelist')
+
+        by_title = self.client.get(url, {'q': 'Run'})
+        by_id = self.client.get(url, {'q': str(entries[-1].pk)})
+        by_activity = self.client.get(url, {'q': str(entries[0].activity_id)})
+        not_found = self.client.get(url, {'q': 'Walk'})
+
+        assert by_title.context['cl'].result_count == 5
+        assert [entry.pk for entry in by_id.context['cl'].result_list] == [entries[-1].pk]
+        assert by_activity.context['cl'].result_count == 5
+        assert not_found.context['cl'].result_count == 0
+
+    def test_id_cursor(self):
+        entries = self.create_entries()
+
+        response = self.client.get(reverse('admin:core_activityentry_changelist'), {'id__lt': entries[2].pk})
+
+        assert [entry.pk for entry in response.context['cl'].result_list] == [entries[1].pk, entries[0].pk]
+
+    def test_raw_id_widgets(self):
+        skill = SkillFactory(owner=self.user)
+
+        response = self.client.get(reverse('admin:core_skill_change', args=[skill.pk]))
+
+        assert 'vForeignKeyRawIdAdminField' in response.content.decode()
+        assert 'vManyToManyRawIdAdminField' in response.content.decode()
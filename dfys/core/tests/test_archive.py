@@ -0,0 +1,182 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from dfys.core.archive import archive_entries, restore_latest_chunk, restore_entry
+from dfys.core.models import Activity, ActivityEntry, ArchivedEntryChunk
+from dfys.core.tests.test_factory import UserFactory, SkillFactory, ActivityFactory, CommentFactory
+
+
+@override_settings(ENTRIES_ARCHIVE_CHUNK_SIZE=2, ENTRIES_PAGE_SIZE=2, ENTRIES_PREVIEW_SIZE=2)
+class TestArchive(APITestCase):
+    def setUp(self) -> None:
+        self.user = UserFactory()
+        self.act = ActivityFactory(skill=SkillFactory(owner=self.user))
+        self.entries = [CommentFactory(activity=self.act, comment=str(i)) for i in range(5)]
+        self.old_date = timezone.now() - timedelta(days=400)
+        ActivityEntry.objects.filter(pk__in=[entry.pk for entry in self.entries[:3]]) \
+            .update(add_date=self.old_date, modify_date=self.old_date)
+
+    def test_archive_and_restore(self):
+        archived = archive_entries(timezone.now() - timedelta(days=365))
+
+        self.assertEqual(archived, 3)
+        self.assertEqual(ArchivedEntryChunk.objects.count(), 2)
+        self.assertEqual(list(ActivityEntry.objects.values_list('pk', flat=True).order_by('pk')),
+                         [self.entries[3].pk, self.entries[4].pk])
+
+        self.assertTrue(restore_latest_chunk(ArchivedEntryChunk.objects.all()))
+        restored = ActivityEntry.objects.get(pk=self.entries[2].pk)
+        self.assertEqual((restored.comment, restored.add_date), ('2', self.old_date))
+        self.assertEqual(ArchivedEntryChunk.objects.count(), 1)
+
+    def test_entries_list_reads_archive(self):
+        archive_entries(timezone.now() - timedelta(days=365))
+        self.client.force_login(self.user)
+        url = reverse('activity-entry-list', kwargs={'activity_pk': self.act.pk})
+
+        ids = []
+        response = self.client.get(url)
+        while True:
+            ids.extend(response.data['results'])
+            if not response.data['next']:
+                break
+            response = self.client.get(response.data['next'])
+
+        self.assertEqual(ids, [entry.pk for entry in reversed(self.entries)])
+        self.assertEqual(ArchivedEntryChunk.objects.count(), 2)
+        self.assertEqual(ActivityEntry.objects.count(), 2)
+
+        previous = []
+        while response.data['previous']:
+            response = self.client.get(response.data['previous'])
+            previous = list(response.data['results']) + previous
+        self.assertEqual(previous, ids[:4])
+
+    def test_entries_list_merges_restored_chunk(self):
+        archive_entries(timezone.now() - timedelta(days=365))
+        # Restores the older chunk, the newest archived entry stays archived between live ones
+        restore_entry(ArchivedEntryChunk.objects.all(), self.entries[0].pk)
+        self.client.force_login(self.user)
+        url = reverse('activity-entry-list', kwargs={'activity_pk': self.act.pk})
+
+        first = self.client.get(url)
+        second = self.client.get(first.data['next'])
+        third = self.client.get(second.data['next'])
+
+        self.assertEqual(list(first.data['results']), [self.entries[4].pk, self.entries[3].pk])
+        self.assertEqual(list(second.data['results']), [self.entries[2].pk, self.entries[1].pk])
+        self.assertEqual(list(third.data['results']), [self.entries[0].pk])
+        self.assertIsNone(third.data['next'])
+
+    def test_activity_details_read_archive(self):
+        ActivityEntry.objects.filter(pk__in=[entry.pk for entry in self.entries[3:]]).delete()
+        archive_entries(timezone.now() - timedelta(days=365))
+        self.client.force_login(self.user)
+
+        response = self.client.get(reverse('activity-detail', kwargs={'pk': self.act.pk}))
+
+        self.assertEqual(list(response.data['entries']), [self.entries[2].pk, self.entries[1].pk])
+        self.assertIsNotNone(response.data['entries_cursor'])
+        self.assertFalse(ActivityEntry.objects.exists())
+
+    def test_command(self):
+        out = StringIO()
+        call_command('archive_entries', stdout=out)
+
+        self.assertIn('Archived 3', out.getvalue())
+
+    def test_restored_entries_are_not_archived_again(self):
+        cutoff = timezone.now() - timedelta(days=365)
+        archive_entries(cutoff)
+        restore_latest_chunk(ArchivedEntryChunk.objects.all())
+
+        self.assertEqual(archive_entries(cutoff), 0)
+        self.assertIsNotNone(ActivityEntry.objects.get(pk=self.entries[2].pk).restore_date)
+
+    def test_entry_details_restore_on_demand(self):
+        archive_entries(timezone.now() - timedelta(days=365))
+        self.client.force_login(self.user)
+        url = reverse('activity-entry-detail', kwargs={'activity_pk': self.act.pk, 'pk': self.entries[0].pk})
+
+        response = self.client.patch(url, data={'comment': 'changed'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(ActivityEntry.objects.get(pk=self.entries[0].pk).comment, 'changed')
+        self.assertEqual(ArchivedEntryChunk.objects.count(), 1)
+
+        missing = reverse('activity-entry-detail', kwargs={'activity_pk': self.act.pk, 'pk': 12345})
+        self.assertEqual(self.client.patch(missing, data={'comment': 'x'}).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_entry_attachment_reads_archive(self):
+        archive_entries(timezone.now() - timedelta(days=365))
+        self.client.force_login(self.user)
+        url = reverse('activity-entry-attachment', kwargs={'activity_pk': self.act.pk, 'pk': self.entries[0].pk})
+
+        response = self.client.get(url)
+
+        self.assertEqual(response.data['detail'], 'Entry has no attachment')
+        self.assertEqual(ArchivedEntryChunk.objects.count(), 2)
+
+    def test_hidden_skill_is_not_restored(self):
+        archive_entries(timezone.now() - timedelta(days=365))
+        self.act.skill.is_hidden = True
+        self.act.skill.save()
+        self.client.force_login(self.user)
+
+        self.client.get(reverse('activity-entry-list', kwargs={'activity_pk': self.act.pk}))
+
+        self.assertEqual(ArchivedEntryChunk.objects.count(), 2)
+
+    def test_timeline_counts_archived_entries(self):
+        archive_entries(timezone.now() - timedelta(days=365))
+        self.client.force_login(self.user)
+
+        response = self.client.get(reverse('skill-timeline', kwargs={'pk': self.act.skill.pk}))
+
+        self.assertEqual(list(response.data['starts']), [self.old_date.date(), timezone.now().date()])
+        self.assertEqual(list(response.data['counts']), [3, 2])
+
+    def test_clone_copies_archived_entries(self):
+        archive_entries(timezone.now() - timedelta(days=365))
+        self.client.force_login(self.user)
+
+        response = self.client.post(reverse('skill-clone', kwargs={'pk': self.act.skill.pk}), data={'name': 'Copy'})
+
+        # The originals stay archived, copies of archived entries are archived in the clone
+        self.assertEqual(ArchivedEntryChunk.objects.filter(activity=self.act).count(), 2)
+        self.assertEqual(ActivityEntry.objects.filter(activity=self.act).count(), 2)
+        copy = Activity.objects.get(skill_id=response.data['id'])
+        self.assertEqual(ArchivedEntryChunk.objects.filter(activity=copy).count(), 2)
+        self.assertEqual(ActivityEntry.objects.filter(activity=copy).count(), 2)
+
+        listed = self.client.get(reverse('activity-entry-list', kwargs={'activity_pk': copy.pk}),
+                                 data={'page_size': 10})
+        self.assertEqual([entry['comment'] for entry in listed.data['results'].values()], ['4', '3', '2', '1', '0'])
+        self.assertTrue(set(listed.data['results']).isdisjoint(entry.pk for entry in self.entries))
+
+        # Restoring a copied entry does not collide with its original
+        oldest = list(listed.data['results'])[-1]
+        url = reverse('activity-entry-detail', kwargs={'activity_pk': copy.pk, 'pk': oldest})
+        self.assertEqual(self.client.patch(url, data={'comment': 'changed'}).status_code, status.HTTP_200_OK)
+        self.assertEqual(ActivityEntry.objects.get(pk=oldest).comment, 'changed')
+        # New entries continue after the ids taken for the archived copies
+        self.assertGreater(CommentFactory(activity=copy).pk, max(listed.data['results']))
+
+    def test_skill_includes_read_archive(self):
+        ActivityEntry.objects.filter(pk__in=[entry.pk for entry in self.entries[3:]]).delete()
+        archive_entries(timezone.now() - timedelta(days=365))
+        self.client.force_login(self.user)
+
+        response = self.client.get(reverse('skill-detail', kwargs={'pk': self.act.skill_id}),
+                                   data={'include': 'activities.entries'})
+
+        self.assertEqual(set(response.data['included']['entries']), {self.entries[2].pk, self.entries[1].pk})
+        self.assertIsNotNone(response.data['included']['entries_cursors'][self.act.pk])
+        self.assertFalse(ActivityEntry.objects.exists())
@@ -0,0 +1,99 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.test import APITestCase
+
+from dfys.core.authentication import decode_token, refresh_tokens, REFRESH
+from dfys.core.backends import user_cache
+from dfys.core.tests.test_factory import UserFactory
+
+
+class TestSignedTokenAuthentication(APITestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        user_cache.clear()
+        self.user = UserFactory()
+        self.user.set_password('secret-password')
+        self.user.save()
+
+    def obtain_tokens(self):
+        response = self.client.post('/api/auth/token', data={
+            'username': self.user.username,
+            'password': 'secret-password',
+        })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def get_categories(self, access):
+        return self.client.get(reverse('category-list'), HTTP_AUTHORIZATION='Bearer ' + access)
+
+    def test_obtain_with_wrong_password(self):
+        response = self.client.post('/api/auth/token', data={
+            'username': self.user.username,
+            'password': 'wrong',
+        })
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_access(self):
+        tokens = self.obtain_tokens()
+
+        self.assertEqual(self.get_categories(tokens['access']).status_code, status.HTTP_200_OK)
+
+    def test_access_without_db_lookup(self):
+        tokens = self.obtain_tokens()
+        self.get_categories(tokens['access'])
+
+        with self.assertNumQueries(1):
+            self.get_categories(tokens['access'])
+
+    def test_invalid_and_expired_access(self):
+        tokens = self.obtain_tokens()
+
+        self.assertEqual(self.get_categories(tokens['access'] + 'x').status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self.get_categories(tokens['refresh']).status_code, status.HTTP_401_UNAUTHORIZED)
+        with self.settings(ACCESS_TOKEN_LIFETIME=-1):
+            self.assertEqual(self.get_categories(tokens['access']).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_refresh_rotates_token(self):
+        tokens = self.obtain_tokens()
+
+        response = self.client.post('/api/auth/token/refresh', data={'refresh': tokens['refresh']})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.get_categories(response.data['access']).status_code, status.HTTP_200_OK)
+
+        response = self.client.post('/api/auth/token/refresh', data={'refresh': tokens['refresh']})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_refresh_claims_token_once(self):
+        tokens = self.obtain_tokens()
+        payload = decode_token(tokens['refresh'], REFRESH)
+        refresh_tokens(tokens['refresh'])
+
+        # a concurrent exchange which passed the deny list check before the token was revoked
+        with mock.patch('dfys.core.authentication.decode_token', return_value=payload):
+            with self.assertRaises(AuthenticationFailed):
+                refresh_tokens(tokens['refresh'])
+
+    def test_refresh_after_password_change(self):
+        tokens = self.obtain_tokens()
+        self.user.set_password('new-secret-password')
+        self.user.save()
+
+        response = self.client.post('/api/auth/token/refresh', data={'refresh': tokens['refresh']})
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_revoke(self):
+        tokens = self.obtain_tokens()
+
+        response = self.client.post('/api/auth/token/revoke', data={'refresh': tokens['refresh']},
+                                    HTTP_AUTHORIZATION='Bearer ' + tokens['access'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.assertEqual(self.get_categories(tokens['access']).status_code, status.HTTP_401_UNAUTHORIZED)
+        response = self.client.post('/api/auth/token/refresh', data={'refresh': tokens['refresh']})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
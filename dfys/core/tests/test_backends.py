@@ -0,0 +1,70 @@
+import pytest
+from django.contrib.auth.models import User
+from django.urls import reverse
+from rest_framework.test import APITestCase
+
+from dfys.core.backends import CachedModelBackend, UserCache, user_cache
+from dfys.core.tests.test_factory import UserFactory
+
+
+@pytest.mark.django_db
+class TestCachedModelBackend:
+    @pytest.fixture(autouse=True)
+    def clear_cache(self):
+        user_cache.clear()
+
+    def test_get_user_is_cached(self, django_assert_num_queries):
+        user = UserFactory()
+        backend = CachedModelBackend()
+
+        with django_assert_num_queries(1):
+            assert backend.get_user(user.pk) == user
+            assert backend.get_user(user.pk) == user
+
+    def test_invalidated_on_save(self, django_assert_num_queries):
+        user = UserFactory()
+        backend = CachedModelBackend()
+        backend.get_user(user.pk)
+
+        User.objects.get(pk=user.pk).save()
+
+        with django_assert_num_queries(1):
+            backend.get_user(user.pk)
+
+    def test_invalidated_by_other_process(self, django_assert_num_queries):
+        user = UserFactory()
+        backend = CachedModelBackend()
+        backend.get_user(user.pk)
+
+        # Another worker handles a password change, its own process cache is invalidated
+        UserCache().invalidate(user.pk)
+
+        with django_assert_num_queries(1):
+            backend.get_user(user.pk)
+        with django_assert_num_queries(0):
+            backend.get_user(user.pk)
+
+    def test_inactive_user(self):
+        user = UserFactory(is_active=False)
+
+        assert CachedModelBackend().get_user(user.pk) is None
+
+    def test_cached_copy_is_not_shared(self):
+        user = UserFactory()
+        backend = CachedModelBackend()
+
+        backend.get_user(user.pk).first_name = 'Changed'
+
+        assert backend.get_user(user.pk).first_name == ''
+
+
+class TestCachedAuthentication(APITestCase):
+    def test_authenticated_request_does_not_query_session_and_user(self):
+        user = UserFactory()
+        user_cache.clear()
+
+        self.client.force_login(user)
+        self.client.get(reverse('category-list'))
+
+        with self.assertNumQueries(1):
+            self.client.get(reverse('category-list'))
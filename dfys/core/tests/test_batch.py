@@ -0,0 +1,96 @@
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from dfys.core.models import Category, Skill, Activity, ActivityEntry
+from dfys.core.tests.test_factory import UserFactory, SkillFactory, ActivityFactory, CategoryFactory, CommentFactory
+
+
+class TestBatch(APITestCase):
+    def setUp(self) -> None:
+        self.user = UserFactory()
+        self.base_category = CategoryFactory(owner=self.user, is_base_category=True)
+        self.client.force_login(self.user)
+
+    def post_batch(self, mutations):
+        return self.client.post('/api/batch', data={'mutations': mutations})
+
+    def test_create_tree_with_temp_ids(self):
+        response = self.post_batch([
+            {'op': 'create', 'model': 'category', 'id': 'c1', 'data': {'name': 'Cat'}},
+            {'op': 'create', 'model': 'skill', 'id': 's1', 'data': {'name': 'Skill'}},
+            {'op': 'create', 'model': 'activity', 'id': 'a1', 'data': {'title': 'Act', 'skill': 's1', 'category': 'c1'}},
+            {'op': 'create', 'model': 'entry', 'data': {'comment': 'Entry', 'activity': 'a1'}},
+        ])
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        ids = {item['temp_id']: item['id'] for item in response.data['ids']}
+        activity = Activity.objects.get(pk=ids['a1'])
+        self.assertEqual(activity.skill_id, ids['s1'])
+        self.assertEqual(activity.category_id, ids['c1'])
+        self.assertEqual(ActivityEntry.objects.get(activity=activity).comment, 'Entry')
+        self.assertTrue(Skill.objects.get(pk=ids['s1']).categories.filter(pk=self.base_category.pk).exists())
+        self.assertEqual(len(response.data['results']), 4)
+
+    def test_update_and_delete(self):
+        act = ActivityFactory(title='Old')
+        entry = CommentFactory(activity=act)
+
+        response = self.post_batch([
+            {'op': 'update', 'model': 'activity', 'id': act.pk, 'data': {'title': 'New'}},
+            {'op': 'delete', 'model': 'entry', 'id': entry.pk},
+        ])
+
+        act.refresh_from_db()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(act.title, 'New')
+        self.assertEqual(act.version, 2)
+        self.assertFalse(ActivityEntry.objects.filter(pk=entry.pk).exists())
+        self.assertEqual(response.data['results'][1], None)
+
+    def test_failure_rolls_back_whole_batch(self):
+        response = self.post_batch([
+            {'op': 'create', 'model': 'skill', 'id': 's1', 'data': {'name': 'Skill'}},
+            {'op': 'create', 'model': 'activity', 'data': {'title': 'Act', 'skill': 'unknown'}},
+        ])
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['index'], 1)
+        self.assertFalse(Skill.objects.filter(name='Skill').exists())
+
+    def test_duplicate_skill_name(self):
+        response = self.post_batch([
+            {'op': 'create', 'model': 'skill', 'data': {'name': 'Skill'}},
+            {'op': 'create', 'model': 'skill', 'data': {'name': 'Skill'}},
+        ])
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['index'], 1)
+        self.assertFalse(Skill.objects.exists())
+
+    def test_other_users_objects(self):
+        other_skill = SkillFactory(owner=UserFactory(username='Other user'), name='Other')
+
+        response = self.post_batch([
+            {'op': 'delete', 'model': 'skill', 'id': other_skill.pk},
+        ])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.post_batch([
+            {'op': 'create', 'model': 'activity', 'data': {'title': 'Act', 'skill': other_skill.pk}},
+        ])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertTrue(Skill.objects.filter(pk=other_skill.pk).exists())
+
+    def test_base_category_cannot_be_deleted(self):
+        response = self.post_batch([
+            {'op': 'delete', 'model': 'category', 'id': self.base_category.pk},
+        ])
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertTrue(Category.objects.filter(pk=self.base_category.pk).exists())
+
+    def test_invalid_mutation(self):
+        response = self.post_batch([{'op': 'create', 'model': 'user'}])
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['index'], 0)
@@ -0,0 +1,82 @@
+from django.urls import reverse
+from rest_framework.test import APITestCase
+
+from dfys.core.changes import InMemoryBroker, get_broker, event_stream
+from dfys.core.tests.test_factory import UserFactory, ActivityFactory
+
+
+class TestInMemoryBroker:
+    def test_publish_to_user_subscriptions(self):
+        broker = InMemoryBroker()
+        subscription = broker.subscribe(1)
+        other_subscription = broker.subscribe(2)
+
+        broker.publish(1, {'model': 'skill', 'id': 1, 'op': 'save'})
+
+        assert subscription.get(0) == [{'model': 'skill', 'id': 1, 'op': 'save'}]
+        assert subscription.get(0) == []
+        assert other_subscription.get(0) == []
+
+    def test_close(self):
+        broker = InMemoryBroker()
+        subscription = broker.subscribe(1)
+        subscription.close()
+
+        broker.publish(1, {'model': 'skill', 'id': 1, 'op': 'save'})
+
+        assert subscription.get(0) == []
+        assert broker.subscriptions == {}
+
+    def test_event_stream(self):
+        broker = InMemoryBroker()
+        stream = event_stream(broker.subscribe(1), heartbeat=0)
+
+        assert next(stream) == 'retry: 3000\n\n'
+        assert next(stream) == ': keep-alive\n\n'
+        broker.publish(1, {'model': 'category', 'id': 3, 'op': 'delete'})
+        assert next(stream) == 'data: {"model": "category", "id": 3, "op": "delete"}\n\n'
+
+        stream.close()
+        assert broker.subscriptions == {}
+
+
+class TestChangeEvents(APITestCase):
+    def setUp(self) -> None:
+        self.user = UserFactory()
+        self.subscription = get_broker().subscribe(self.user.pk)
+        self.addCleanup(self.subscription.close)
+
+    def test_entry_create_publishes_change(self):
+        act = ActivityFactory()
+
+        self.client.force_login(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('activity-entry-list', kwargs={'activity_pk': act.id}), data={
+                'comment': 'comment',
+                'activity': act.id,
+            })
+
+        self.assertEqual(self.subscription.get(0), [
+            {'model': 'activityentry', 'id': response.data['id'], 'op': 'save'}
+        ])
+
+    def test_activity_destroy_publishes_change(self):
+        act = ActivityFactory()
+
+        self.client.force_login(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(reverse('activity-detail', kwargs={'pk': act.pk}))
+
+        self.assertEqual(self.subscription.get(0), [{'model': 'activity', 'id': act.pk, 'op': 'delete'}])
+
+    def test_stream(self):
+        self.client.force_login(self.user)
+        response = self.client.get('/api/changes', HTTP_ACCEPT='text/event-stream')
+        stream = iter(response.streaming_content)
+
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(next(stream), b'retry: 3000\n\n')
+
+        get_broker().publish(self.user.pk, {'model': 'skill', 'id': 1, 'op': 'save'})
+        self.assertEqual(next(stream), b'data: {"model": "skill", "id": 1, "op": "save"}\n\n')
+        response.close()
@@ -0,0 +1,122 @@
+import pytest
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import RequestFactory
+
+from dfys.core.db_routers import ReplicaRouter, ReplicaRoutingMiddleware, replica_reads, ShardRouter, \
+    ShardRoutingMiddleware, use_shard, shard_for_user
+from dfys.core.models import Skill, ActivityEntry, Job, UserShard
+from dfys.core.sharding import assign_shard
+from dfys.core.tests.test_factory import UserFactory
+
+
+class FakeUser:
+    pk = 1
+    is_authenticated = True
+
+
+class TestReplicaRouter:
+    @pytest.fixture(autouse=True)
+    def replica_settings(self, settings):
+        settings.REPLICA_DATABASES = ['replica']
+        settings.REPLICA_STICKY_SECONDS = 10
+        cache.clear()
+
+    def route_request(self, method, user=None):
+        seen = []
+
+        def get_response(request):
+            seen.append(ReplicaRouter().db_for_read(Skill))
+            return HttpResponse()
+
+        request = getattr(RequestFactory(), method)('/api/skills/')
+        request.user = user or AnonymousUser()
+        ReplicaRoutingMiddleware(get_response)(request)
+        return seen[0]
+
+    def test_reads_go_to_primary_outside_requests(self):
+        assert ReplicaRouter().db_for_read(Skill) == 'default'
+        with replica_reads():
+            assert ReplicaRouter().db_for_read(Skill) == 'replica'
+        assert ReplicaRouter().db_for_write(Skill) == 'default'
+
+    def test_safe_request_reads_from_replica(self):
+        assert self.route_request('get') == 'replica'
+
+    def test_write_request_uses_primary(self):
+        assert self.route_request('post', FakeUser()) == 'default'
+
+    def test_reads_stick_to_primary_after_write(self):
+        self.route_request('post', FakeUser())
+
+        assert self.route_request('get', FakeUser()) == 'default'
+        assert self.route_request('get') == 'replica'
+
+    def test_no_migrations_on_replicas(self):
+        assert ReplicaRouter().allow_migrate('replica', 'core') is False
+        assert ReplicaRouter().allow_migrate('default', 'core') is True
+
+    def test_no_replicas_configured(self, settings):
+        settings.REPLICA_DATABASES = []
+
+        assert self.route_request('get') == 'default'
+
+
+class TestShardRouter:
+    @pytest.fixture(autouse=True)
+    def shard_settings(self, settings):
+        settings.SHARD_DATABASES = ['default', 'shard1']
+        cache.clear()
+
+    def test_sharded_models_follow_current_shard(self):
+        assert ShardRouter().db_for_read(Skill) is None
+        with use_shard('shard1'):
+            assert ShardRouter().db_for_read(Skill) == 'shard1'
+            assert ShardRouter().db_for_write(ActivityEntry) == 'shard1'
+            assert ShardRouter().db_for_write(Job) is None
+        with use_shard('default'):
+            assert ShardRouter().db_for_write(Skill) is None
+
+    def test_instances_stay_on_their_shard(self):
+        skill = Skill()
+        skill._state.db = 'shard1'
+
+        assert ShardRouter().db_for_write(Skill, instance=skill) == 'shard1'
+
+    @pytest.mark.django_db
+    def test_shard_map(self):
+        user = UserFactory()
+        assert shard_for_user(user.pk) == 'default'
+
+        UserShard.objects.create(user=user, alias='shard1')
+        assert shard_for_user(user.pk) == 'default'
+
+        cache.clear()
+        assert shard_for_user(user.pk) == 'shard1'
+        assert shard_for_user(None) == 'default'
+
+    @pytest.mark.django_db
+    def test_middleware_routes_by_user(self):
+        user = UserFactory()
+        UserShard.objects.create(user=user, alias='shard1')
+        cache.clear()
+        seen = []
+
+        def get_response(request):
+            seen.append(ShardRouter().db_for_read(Skill))
+            return HttpResponse()
+
+        request = RequestFactory().get('/api/skills/')
+        request.user = user
+        ShardRoutingMiddleware(get_response)(request)
+
+        assert seen == ['shard1']
+
+    @pytest.mark.django_db
+    def test_new_users_on_default_shard_are_not_mapped(self, settings):
+        settings.SHARD_DATABASES = ['default']
+        user = UserFactory()
+
+        assert assign_shard(user) == 'default'
+        assert not UserShard.objects.exists()
@@ -0,0 +1,148 @@
+import json
+import os
+import tempfile
+from datetime import datetime, timezone as dt_timezone
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from dfys.core.imports import Importer, ImportFailed
+from dfys.core.models import Category, Skill, Activity, ActivityEntry
+from dfys.core.tests.test_factory import UserFactory, CategoryFactory, SkillFactory
+
+
+def jsonl(*records):
+    return '\n'.join(json.dumps({'model': model, 'data': data}) for model, data in records) + '\n'
+
+
+DOCUMENT = jsonl(
+    ('category', {'id': 1, 'name': 'DONE', 'isBaseCategory': True}),
+    ('category', {'id': 2, 'name': 'Hobby', 'displayOrder': 5}),
+    ('skill', {'id': 10, 'name': 'Guitar', 'categories': [1, 2]}),
+    ('skill', {'id': 11, 'name': 'Piano'}),
+    ('activity', {'id': 20, 'title': 'Scales', 'skill': 10, 'category': 2}),
+    ('activity', {'id': 21, 'title': 'Chords', 'skill': 11}),
+    ('entry', {'comment': 'First', 'activity': 20}),
+    ('entry', {'comment': 'Second', 'activity': 20}),
+    ('entry', {'comment': 'Third', 'activity': 21}),
+)
+
+
+class TestImport(APITestCase):
+    def setUp(self) -> None:
+        self.user = UserFactory()
+        self.base_category = CategoryFactory(owner=self.user, name='DONE', is_base_category=True)
+
+    def test_import_tree(self):
+        counts = Importer(self.user, chunk_size=2).run(DOCUMENT.splitlines())
+
+        self.assertEqual(counts, {'category': 2, 'skill': 2, 'activity': 2, 'entry': 3})
+        hobby = Category.objects.get(owner=self.user, name='Hobby')
+        self.assertEqual(hobby.display_order, 5)
+        self.assertEqual(Category.objects.filter(owner=self.user, name='DONE').count(), 1)
+
+        guitar = Skill.objects.get(owner=self.user, name='Guitar')
+        self.assertEqual(set(guitar.categories.all()), {self.base_category, hobby})
+        piano = Skill.objects.get(owner=self.user, name='Piano')
+        self.assertEqual(list(piano.categories.all()), [self.base_category])
+
+        scales = Activity.objects.get(title='Scales')
+        self.assertEqual((scales.skill, scales.category), (guitar, hobby))
+        self.assertEqual(ActivityEntry.objects.filter(activity=scales).count(), 2)
+        self.assertEqual(ActivityEntry.objects.get(comment='Third').activity.skill, piano)
+
+    def test_import_keeps_dates(self):
+        document = jsonl(
+            ('skill', {'id': 1, 'name': 'Skill', 'addDate': '2015-03-01T10:00:00Z'}),
+            ('activity', {'id': 2, 'title': 'Act', 'skill': 1, 'addDate': '2015-03-02T10:00:00Z',
+                          'modifyDate': '2016-01-01T10:00:00Z'}),
+            ('entry', {'comment': 'Old', 'activity': 2, 'addDate': '2015-03-03T10:00:00Z'}),
+            ('entry', {'comment': 'New', 'activity': 2}),
+        )
+
+        Importer(self.user).run(document.splitlines())
+
+        self.assertEqual(Skill.objects.get(name='Skill').add_date, datetime(2015, 3, 1, 10, tzinfo=dt_timezone.utc))
+        activity = Activity.objects.get(title='Act')
+        self.assertEqual((activity.add_date.year, activity.modify_date.year), (2015, 2016))
+        old = ActivityEntry.objects.get(comment='Old')
+        self.assertEqual(old.add_date, datetime(2015, 3, 3, 10, tzinfo=dt_timezone.utc))
+        self.assertEqual(old.modify_date, old.add_date)
+        self.assertEqual(ActivityEntry.objects.get(comment='New').add_date.date(), timezone.now().date())
+
+    def test_invalid_date(self):
+        document = jsonl(('skill', {'name': 'Skill', 'addDate': 'yesterday'}))
+
+        with self.assertRaises(ImportFailed) as context:
+            Importer(self.user).run(document.splitlines())
+
+        self.assertIn('add_date', context.exception.errors)
+
+    def test_progress_is_reported_per_chunk(self):
+        reports = []
+        Importer(self.user, chunk_size=2, progress=reports.append).run(DOCUMENT.splitlines())
+
+        self.assertEqual(len(reports), 5)
+        self.assertEqual(reports[0], {'category': 2, 'skill': 0, 'activity': 0, 'entry': 0})
+
+    def test_queries_per_chunk_do_not_depend_on_chunk_size(self):
+        document = jsonl(('skill', {'id': 1, 'name': 'Skill'}),
+                         ('activity', {'id': 2, 'title': 'Act', 'skill': 1}),
+                         *[('entry', {'comment': str(i), 'activity': 2}) for i in range(100)])
+
+        with self.assertNumQueries(6 + 3 + 3):
+            Importer(self.user).run(document.splitlines())
+
+    def test_unknown_reference(self):
+        document = jsonl(('activity', {'title': 'Act', 'skill': 99}))
+
+        with self.assertRaises(ImportFailed) as context:
+            Importer(self.user).run(document.splitlines())
+
+        self.assertEqual(context.exception.line, 1)
+        self.assertFalse(Activity.objects.exists())
+
+    def test_existing_skill_name(self):
+        SkillFactory(owner=self.user, name='Guitar')
+
+        with self.assertRaises(ImportFailed) as context:
+            Importer(self.user).run(DOCUMENT.splitlines())
+
+        self.assertEqual(context.exception.line, 3)
+
+    def test_endpoint(self):
+        self.client.force_login(self.user)
+        response = self.client.post('/api/import', data=DOCUMENT, content_type='application/x-ndjson')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['imported']['entry'], 3)
+        self.assertEqual(ActivityEntry.objects.count(), 3)
+
+    def test_endpoint_invalid_line(self):
+        self.client.force_login(self.user)
+        document = jsonl(('skill', {'id': 1, 'name': 'Skill'})) + '{not json\n'
+        response = self.client.post('/api/import', data=document, content_type='application/x-ndjson')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['line'], 2)
+        self.assertEqual(response.data['imported']['skill'], 0)
+
+    def test_command(self):
+        path = self.create_document_file()
+        out = StringIO()
+        call_command('import_data', self.user.username, path, stdout=out)
+
+        self.assertIn('Imported 2 category, 2 skill, 2 activity, 3 entry', out.getvalue())
+
+        with self.assertRaises(CommandError):
+            call_command('import_data', 'nobody', path, stdout=out)
+
+    def create_document_file(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False) as f:
+            f.write(DOCUMENT)
+        self.addCleanup(os.remove, f.name)
+        return f.name
@@ -0,0 +1,326 @@
+import gzip
+import shutil
+import tempfile
+import threading
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
+
+import pytest
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from dfys.core.db_routers import ReplicaRoutingMiddleware
+from dfys.core.middleware import CompressionMiddleware, CoalescingMiddleware, GzipCompressor, negotiate_compressor
+from dfys.core.models import Skill, IdempotencyKey
+from dfys.core.tests.test_factory import UserFactory, SkillFactory, ActivityFactory
+from dfys.core.throttling import WriteRateThrottle
+
+
+def get_response(response):
+    return CompressionMiddleware(lambda request: response)
+
+
+class TestNegotiateCompressor:
+    def test_accepted(self):
+        assert negotiate_compressor('deflate, gzip;q=0.5', [GzipCompressor]) is GzipCompressor
+
+    def test_refused(self):
+        assert negotiate_compressor('gzip;q=0', [GzipCompressor]) is None
+        assert negotiate_compressor('', [GzipCompressor]) is None
+
+    def test_malformed_q(self):
+        assert negotiate_compressor('gzip;q=.', [GzipCompressor]) is None
+        assert negotiate_compressor('gzip;q=1.0.0', [GzipCompressor]) is None
+        assert negotiate_compressor('gzip;q=1.0.0, *', [GzipCompressor]) is None
+
+
+class TestCompressionMiddleware:
+    @pytest.fixture(autouse=True)
+    def compression_settings(self, settings):
+        settings.COMPRESSION_MIN_SIZE = 100
+        settings.COMPRESSION_CACHE_TIMEOUT = 0
+
+    def request(self, encoding='gzip'):
+        return RequestFactory().get('/api/skills/', HTTP_ACCEPT_ENCODING=encoding)
+
+    def test_compresses_large_json(self):
+        body = b'{"name": "value"}' * 100
+        response = get_response(HttpResponse(body, content_type='application/json'))(self.request())
+
+        assert response['Content-Encoding'] == 'gzip'
+        assert response['Vary'] == 'Accept-Encoding'
+        assert gzip.decompress(response.content) == body
+
+    def test_malformed_accept_encoding(self):
+        body = b'{"name": "value"}' * 100
+        response = get_response(HttpResponse(body, content_type='application/json'))(self.request('gzip;q=.'))
+
+        assert response.status_code == 200
+        assert not response.has_header('Content-Encoding')
+        assert response.content == body
+
+    def test_skips_small_body(self):
+        body = b'{}'
+        response = get_response(HttpResponse(body, content_type='application/json'))(self.request())
+
+        assert not response.has_header('Content-Encoding')
+        assert response.content == body
+
+    def test_skips_not_compressible_type(self):
+        body = b'0' * 1000
+        response = get_response(HttpResponse(body, content_type='image/png'))(self.request())
+
+        assert not response.has_header('Content-Encoding')
+
+    @pytest.mark.parametrize('content_type', ['text/html', 'application/x-msgpack'])
+    def test_skips_html_and_msgpack(self, content_type):
+        body = b'<p>value</p>' * 100
+        response = get_response(HttpResponse(body, content_type=content_type))(self.request())
+
+        assert not response.has_header('Content-Encoding')
+
+    def test_compresses_stream(self):
+        chunks = [b'{"line": 1}\n', b'{"line": 2}\n']
+        response = get_response(StreamingHttpResponse(iter(chunks), content_type='application/x-ndjson'))(
+            self.request()
+        )
+
+        assert response['Content-Encoding'] == 'gzip'
+        assert gzip.decompress(b''.join(response.streaming_content)) == b''.join(chunks)
+
+
+class TestIdempotencyMiddleware(APITestCase):
+    def setUp(self) -> None:
+        self.user = UserFactory()
+        self.client.force_login(self.user)
+
+    def create_skill(self, name='Skill', key='key-1'):
+        return self.client.post(reverse('skill-list'), data={'name': name}, HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_returns_original_response(self):
+        first = self.create_skill()
+        retry = self.create_skill()
+
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.content, first.content)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Skill.objects.filter(owner=self.user).count(), 1)
+
+    def test_different_keys_are_executed(self):
+        self.create_skill('Skill1', key='key-1')
+        self.create_skill('Skill2', key='key-2')
+
+        self.assertEqual(Skill.objects.filter(owner=self.user).count(), 2)
+
+    def test_key_reused_for_different_request(self):
+        self.create_skill('Skill1')
+        response = self.create_skill('Skill2')
+
+        self.assertEqual(response.status_code, 422)
+        self.assertFalse(Skill.objects.filter(name='Skill2').exists())
+
+    def test_request_in_progress(self):
+        self.create_skill()
+        IdempotencyKey.objects.filter(key='key-1').update(status_code=None)
+
+        response = self.create_skill()
+
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+    def test_abandoned_request_is_taken_over(self):
+        self.create_skill()
+        Skill.objects.all().delete()
+        IdempotencyKey.objects.update(status_code=None, lock_expires=timezone.now() - timedelta(seconds=1))
+
+        response = self.create_skill()
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Skill.objects.filter(owner=self.user).count(), 1)
+        self.assertEqual(IdempotencyKey.objects.get().status_code, status.HTTP_201_CREATED)
+
+    def test_throttled_request_is_not_stored(self):
+        with mock.patch.object(WriteRateThrottle, 'THROTTLE_RATES', {'write': '0/min'}):
+            throttled = self.create_skill()
+        retry = self.create_skill()
+
+        self.assertEqual(throttled.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertNotIn('Idempotent-Replayed', retry)
+        self.assertEqual(Skill.objects.filter(owner=self.user).count(), 1)
+
+    def test_validation_error_is_stored(self):
+        self.client.post(reverse('skill-list'), data={}, HTTP_IDEMPOTENCY_KEY='key-1')
+
+        self.assertEqual(IdempotencyKey.objects.get().status_code, status.HTTP_400_BAD_REQUEST)
+
+    def upload(self, key, digest=None):
+        url = reverse('activity-entry-list', kwargs={'activity_pk': self.activity.pk})
+        headers = {'HTTP_CONTENT_DIGEST': digest} if digest else {}
+        return self.client.post(url, data={'attachment': SimpleUploadedFile('a.txt', b'content'),
+                                           'activity': self.activity.pk},
+                                format='multipart', HTTP_IDEMPOTENCY_KEY=key, **headers)
+
+    def test_multipart_needs_content_digest(self):
+        self.activity = ActivityFactory(skill=SkillFactory(owner=self.user))
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media_settings = self.settings(MEDIA_ROOT=media_root)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+        self.assertEqual(self.upload('key-1').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.upload('key-1', 'sha-256=:abc=:').status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.upload('key-1', 'sha-256=:abc=:')['Idempotent-Replayed'], 'true')
+        self.assertEqual(self.upload('key-1', 'sha-256=:def=:').status_code, 422)
+
+    def test_streaming_body_is_not_read(self):
+        response = self.client.post('/api/import', data='{}', content_type='application/x-ndjson',
+                                    HTTP_IDEMPOTENCY_KEY='key-1')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    def test_without_key(self):
+        self.client.post(reverse('skill-list'), data={'name': 'Skill'})
+
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+
+class TestCoalescingMiddleware:
+    @pytest.fixture(autouse=True)
+    def setup(self, settings):
+        settings.COALESCE_PATHS = [r'^/api/skills/$']
+        settings.COALESCE_WAIT_TIMEOUT = 5
+        cache.clear()
+        self.calls = []
+        self.release = threading.Event()
+
+    def view(self, request):
+        self.calls.append(request.path)
+        self.release.wait(5)
+        return HttpResponse('response {}'.format(len(self.calls)), content_type='application/json')
+
+    def request(self, path='/api/skills/', user_id=1, method='get'):
+        request = getattr(RequestFactory(), method)(path)
+        request.user = SimpleNamespace(pk=user_id, is_authenticated=True)
+        return request
+
+    def run_concurrently(self, middleware, requests):
+        responses = [None] * len(requests)
+
+        def run(index):
+            responses[index] = middleware(requests[index])
+
+        threads = [threading.Thread(target=run, args=(index,)) for index in range(len(requests))]
+        for thread in threads:
+            thread.start()
+        while not self.calls:
+            self.release.wait(0.01)
+        # give the other requests time to join the flight
+        self.release.wait(0.2)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        return responses
+
+    def test_identical_requests_share_response(self):
+        middleware = CoalescingMiddleware(self.view)
+
+        responses = self.run_concurrently(middleware, [self.request() for _ in range(5)])
+
+        assert len(self.calls) == 1
+        assert {response.content for response in responses} == {b'response 1'}
+        assert all(response['Content-Type'] == 'application/json' for response in responses)
+
+    def test_different_users_and_paths(self):
+        middleware = CoalescingMiddleware(self.view)
+
+        self.run_concurrently(middleware, [self.request(user_id=1), self.request(user_id=2),
+                                           self.request('/api/skills/?ordering=name')])
+
+        assert len(self.calls) == 3
+
+    def test_not_coalesced(self):
+        middleware = CoalescingMiddleware(self.view)
+        self.release.set()
+
+        middleware(self.request(method='post'))
+        middleware(self.request('/api/categories/'))
+        middleware(self.request(user_id=None))
+        request = self.request()
+        request.user = SimpleNamespace(pk=None, is_authenticated=False)
+        middleware(request)
+
+        assert len(self.calls) == 4
+        assert not CoalescingMiddleware._flights
+
+    def test_sequential_requests_are_computed(self):
+        middleware = CoalescingMiddleware(self.view)
+        self.release.set()
+
+        assert middleware(self.request()).content == b'response 1'
+        assert middleware(self.request()).content == b'response 2'
+
+    def test_waits_for_other_process(self):
+        middleware = CoalescingMiddleware(self.view)
+        key = CoalescingMiddleware.key(1, self.request())
+        cache.set(key + ':lock', 'other')
+
+        def finish_other_process():
+            cache.set(key + ':result:other', (200, [('Content-Type', 'application/json')], b'other'))
+            cache.delete(key + ':lock')
+
+        timer = threading.Timer(0.2, finish_other_process)
+        timer.start()
+        response = middleware(self.request())
+        timer.join()
+
+        assert response.content == b'other'
+        assert not self.calls
+
+    def test_other_process_failed(self):
+        middleware = CoalescingMiddleware(self.view)
+        self.release.set()
+        key = CoalescingMiddleware.key(1, self.request())
+        cache.set(key + ':lock', 'other')
+
+        timer = threading.Timer(0.2, cache.delete, args=(key + ':lock',))
+        timer.start()
+        response = middleware(self.request())
+        timer.join()
+
+        assert response.content == b'response 1'
+        assert cache.get(key + ':lock') is None
+
+    def test_requests_pinned_to_primary_are_not_coalesced(self, settings):
+        settings.REPLICA_DATABASES = ['replica']
+        middleware = ReplicaRoutingMiddleware(CoalescingMiddleware(self.view))
+
+        self.run_concurrently(middleware, [self.request() for _ in range(3)])
+        assert len(self.calls) == 1
+
+        # user 1 has just written something
+        middleware(self.request(method='post'))
+        self.calls.clear()
+        self.release.clear()
+        self.run_concurrently(middleware, [self.request() for _ in range(3)])
+        assert len(self.calls) == 3
+
+    def test_error_response_not_shared(self):
+        def view(request):
+            self.calls.append(request.path)
+            self.release.wait(5)
+            return HttpResponse(status=500)
+
+        responses = self.run_concurrently(CoalescingMiddleware(view), [self.request() for _ in range(3)])
+
+        assert len(self.calls) == 3
+        assert all(response.status_code == 500 for response in responses)
@@ -0,0 +1,95 @@
+import pytest
+from django.contrib.auth.models import User
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from dfys.core.models import Category, Skill, Activity, ActivityEntry, Job
+from dfys.core.purge import purge_skill, purge_account, delete_in_batches
+from dfys.core.tasks import run_pending
+from dfys.core.tests.test_factory import UserFactory, SkillFactory, ActivityFactory, CommentFactory, CategoryFactory
+
+
+@pytest.mark.django_db
+class TestPurge:
+    @pytest.fixture(autouse=True)
+    def purge_settings(self, settings):
+        settings.PURGE_BATCH_SIZE = 2
+        settings.TASKS_ALWAYS_EAGER = False
+
+    def create_tree(self, owner=None, name='Skill'):
+        skill = SkillFactory(owner=owner or UserFactory(), name=name)
+        for _ in range(3):
+            act = ActivityFactory(skill=skill)
+            for _ in range(3):
+                CommentFactory(activity=act)
+        return skill
+
+    def test_delete_in_batches(self, django_assert_num_queries):
+        skill = self.create_tree()
+
+        with django_assert_num_queries(5 * 4 + 1):
+            deleted = delete_in_batches(ActivityEntry.objects.filter(activity__skill=skill))
+
+        assert deleted == 9
+        assert not ActivityEntry.objects.exists()
+
+    def test_purge_skill(self):
+        skill = self.create_tree()
+        other = self.create_tree(owner=skill.owner, name='Other')
+        Skill.objects.filter(pk=skill.pk).update(is_hidden=True)
+
+        purge_skill(skill_id=skill.pk)
+
+        assert not Skill.objects.filter(pk=skill.pk).exists()
+        assert not Activity.objects.filter(skill_id=skill.pk).exists()
+        assert ActivityEntry.objects.filter(activity__skill=other).count() == 9
+
+    def test_visible_skill_is_not_purged(self):
+        skill = self.create_tree()
+
+        purge_skill(skill_id=skill.pk)
+
+        assert ActivityEntry.objects.filter(activity__skill=skill).count() == 9
+
+    def test_purge_account(self):
+        skill = self.create_tree()
+        user = skill.owner
+        CategoryFactory(owner=user)
+        other_user = UserFactory(username='Other user')
+        other_skill = self.create_tree(owner=other_user, name='Other')
+        User.objects.filter(pk=user.pk).update(is_active=False)
+
+        purge_account(user_id=user.pk)
+
+        assert not User.objects.filter(pk=user.pk).exists()
+        assert not Category.objects.filter(owner_id=user.pk).exists()
+        assert ActivityEntry.objects.filter(activity__skill=other_skill).count() == 9
+
+
+class TestDeleteAccount(APITestCase):
+    def setUp(self) -> None:
+        self.user = UserFactory()
+        self.user.set_password('password')
+        self.user.save()
+        self.skill = SkillFactory(owner=self.user)
+        CommentFactory(activity=ActivityFactory(skill=self.skill))
+        self.client.force_login(self.user)
+
+    def test_delete_account(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/auth/delete', data={'password': 'password'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(User.objects.get(pk=self.user.pk).is_active)
+        self.assertFalse(self.client.login(username=self.user.username, password='password'))
+
+        run_pending()
+        self.assertFalse(User.objects.filter(pk=self.user.pk).exists())
+        self.assertFalse(ActivityEntry.objects.exists())
+        self.assertEqual(Job.objects.get().status, Job.STATUS_DONE)
+
+    def test_wrong_password(self):
+        response = self.client.post('/api/auth/delete', data={'password': 'wrong'})
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertTrue(User.objects.get(pk=self.user.pk).is_active)
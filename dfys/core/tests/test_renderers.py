@@ -0,0 +1,49 @@
+import json
+
+import pytest
+
+from dfys.core.renderers import to_columnar, ColumnarJSONRenderer, ColumnarMessagePackRenderer
+
+
+class TestToColumnar:
+    def test_id_keyed_map(self):
+        data = {
+            1: {'id': 1, 'name': 'A', 'categories': [1, 2]},
+            2: {'id': 2, 'name': 'B', 'categories': []},
+        }
+
+        assert to_columnar(data) == {
+            'fields': ['id', 'name', 'categories'],
+            'columns': [[1, 2], ['A', 'B'], [[1, 2], []]],
+        }
+
+    def test_nested_maps(self):
+        data = {
+            'skills': {3: {'id': 3, 'name': 'S'}},
+            'categories': {},
+        }
+
+        assert to_columnar(data) == {
+            'skills': {'fields': ['id', 'name'], 'columns': [[3], ['S']]},
+            'categories': {},
+        }
+
+    def test_plain_object_is_untouched(self):
+        data = {'id': 1, 'name': 'A'}
+
+        assert to_columnar(data) == data
+
+
+class TestColumnarRenderers:
+    data = {5: {'id': 5, 'display_order': 0}}
+
+    def test_json(self):
+        rendered = json.loads(ColumnarJSONRenderer().render(self.data))
+
+        assert rendered == {'fields': ['id', 'displayOrder'], 'columns': [[5], [0]]}
+
+    def test_msgpack(self):
+        msgpack = pytest.importorskip('msgpack')
+        rendered = msgpack.unpackb(ColumnarMessagePackRenderer().render(self.data))
+
+        assert rendered == {'fields': ['id', 'displayOrder'], 'columns': [[5], [0]]}
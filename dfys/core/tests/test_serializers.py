@@ -1,13 +1,16 @@
 import os
 
 import pytest
+from django.core.cache import cache
 from django.utils.dateparse import parse_datetime
 from rest_framework import serializers
 from rest_framework.test import APIRequestFactory
 
+from dfys.core.fragments import fragment_key, fragment_stats
 from dfys.core.models import Category, Skill, Activity, ActivityEntry
 from dfys.core.serializers import CategoryFlatSerializer, SkillFlatSerializer, SkillDeepSerializer, \
-    ActivityFlatSerializer, CategoryInSkillSerializer, ActivityDeepSerializer, SkillListSerializer
+    ActivityFlatSerializer, CategoryInSkillSerializer, ActivityDeepSerializer, SkillListSerializer, \
+    ActivityEntrySerializer
 from dfys.core.tests.test_factory import CategoryFactory, SkillFactory, ActivityFactory, CommentFactory, \
     AttachmentFactory
 from dfys.core.tests.utils import create_user_request, mock_now
@@ -202,7 +205,8 @@ class TestSkillDeepSerializer:
                     skill=skill.id,
                     description=act.description,
                     add_date=mock_now(),
-                    modify_date=mock_now()
+                    modify_date=mock_now(),
+                    version=1,
                 )
             }
         )
@@ -339,18 +343,78 @@ class TestActivityDeepSerializer:
             category=act.category.id,
             add_date=mock_now(),
             modify_date=mock_now(),
+            version=1,
+            entries_cursor=None,
             entries={
                 attachment.id: dict(
                     id=attachment.id,
                     add_date=mock_now(),
                     modify_date=mock_now(),
-                    comment=''
+                    comment='',
+                    attachment_name='',
+                    version=1,
                 ),
                 comment.id: dict(
                     id=comment.id,
                     add_date=mock_now(),
                     modify_date=mock_now(),
                     comment=comment.comment,
+                    attachment_name='',
+                    version=1,
                 ),
             }
         )
+
+
+@pytest.mark.django_db
+class TestFragmentCache:
+    @pytest.fixture(autouse=True)
+    def clear_cache(self, settings):
+        settings.FRAGMENT_CACHE_TIMEOUT = 60
+        cache.clear()
+
+    def test_cached_fragments_are_reused(self):
+        act = ActivityFactory()
+        entries = [CommentFactory(activity=act, comment=str(i)) for i in range(3)]
+
+        first = ActivityEntrySerializer(entries, many=True).data
+        assert fragment_stats() == {'hits': 0, 'misses': 3, 'hit_rate': 0.0}
+
+        second = ActivityEntrySerializer(entries, many=True).data
+        assert second == first
+        assert fragment_stats() == {'hits': 3, 'misses': 3, 'hit_rate': 0.5}
+
+    def test_changed_object_is_serialized_again(self):
+        act = ActivityFactory(title='Old')
+        ActivityFlatSerializer([act], many=True).data
+
+        act.title = 'New'
+        act.version += 1
+        act.save()
+
+        assert ActivityFlatSerializer([act], many=True).data[act.id]['title'] == 'New'
+
+    def test_cleared_category_changes_key(self):
+        category = CategoryFactory()
+        act = ActivityFactory(category=category)
+        ActivityFlatSerializer([act], many=True).data
+
+        Activity.objects.filter(pk=act.pk).update(category=None)
+        act.refresh_from_db()
+
+        assert ActivityFlatSerializer([act], many=True).data[act.id]['category'] is None
+
+    def test_objects_without_key_fields_are_not_cached(self):
+        act = ActivityFactory()
+        partial = list(Activity.objects.only('id', 'title').filter(pk=act.pk))
+
+        assert fragment_key(ActivityFlatSerializer(), partial[0]) is None
+        assert fragment_key(ActivityFlatSerializer(), act) is not None
+
+    def test_disabled(self, settings):
+        settings.FRAGMENT_CACHE_TIMEOUT = 0
+        act = ActivityFactory()
+
+        ActivityFlatSerializer([act], many=True).data
+
+        assert fragment_stats()['hits'] + fragment_stats()['misses'] == 0
@@ -0,0 +1,226 @@
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from dfys.core.checks import check_shard_map_cache
+from dfys.core.db_routers import shard_for_user, use_shard, ShardMoveInProgress
+from dfys.core.models import Category, Skill, Activity, ActivityEntry, UserShard
+from dfys.core.purge import purge_skill, purge_account
+from dfys.core.sharding import move_user, across_shards, count_across_shards, reserve_id_range
+
+
+@override_settings(SHARD_DATABASES=['default', 's1'], SHARD_ID_SPAN=1000, SHARD_MOVE_GRACE_SECONDS=0)
+class TestSharding(APITestCase):
+    """
+    Runs users' data on two SQLite databases, 'default' and the 's1' shard.
+    """
+    databases = {'default', 's1'}
+
+    def setUp(self) -> None:
+        cache.clear()
+        reserve_id_range('s1')
+        for username in ('alice', 'bob'):
+            self.client.post('/api/auth/register', data={
+                'username': username,
+                'password': 'secret-password',
+                'email': '{}@user.com'.format(username),
+            })
+        # Users are spread by id, one of two consecutive ones lands on each shard
+        users = {shard_for_user(user.pk): user for user in User.objects.filter(username__in=['alice', 'bob'])}
+        self.user, self.other = users['s1'], users['default']
+        self.client.force_login(self.user)
+
+    def create_tree(self):
+        skill_id = self.client.post(reverse('skill-list'), data={'name': 'Skill'}).data['id']
+        activity_id = self.client.post(reverse('activity-list'),
+                                       data={'title': 'Activity', 'skill': skill_id}).data['id']
+        self.client.post(reverse('activity-entry-list', kwargs={'activity_pk': activity_id}),
+                         data={'comment': 'comment', 'activity': activity_id})
+        return skill_id
+
+    def test_register(self):
+        self.assertEqual(UserShard.objects.get(user=self.user).alias, 's1')
+        self.assertFalse(UserShard.objects.filter(user=self.other).exists())
+        self.assertTrue(User.objects.using('s1').filter(pk=self.user.pk, username=self.user.username).exists())
+        self.assertEqual(Category.objects.using('s1').filter(owner=self.user).count(), 3)
+        self.assertEqual(Category.objects.using('default').filter(owner=self.other).count(), 3)
+
+    def test_crud_on_shard(self):
+        skill_id = self.create_tree()
+
+        self.assertTrue(Skill.objects.using('s1').filter(pk=skill_id, owner=self.user).exists())
+        self.assertFalse(Skill.objects.using('default').filter(owner=self.user).exists())
+        self.assertEqual(ActivityEntry.objects.using('s1').filter(activity__skill_id=skill_id).count(), 1)
+
+        response = self.client.patch(reverse('skill-detail', kwargs={'pk': skill_id}), data={'name': 'Renamed'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Skill.objects.using('s1').get(pk=skill_id).name, 'Renamed')
+
+        response = self.client.get(reverse('skill-list'))
+        self.assertEqual(list(response.data['skills']), [skill_id])
+
+    def test_across_shards(self):
+        self.create_tree()
+        self.client.force_login(self.other)
+        self.create_tree()
+
+        self.assertEqual(sorted(skill.owner_id for skill in across_shards(Skill.objects.all())),
+                         sorted([self.user.pk, self.other.pk]))
+        self.assertEqual(count_across_shards(Activity.objects.all()), {'default': 1, 's1': 1})
+
+    def test_reserve_id_range(self):
+        self.assertGreaterEqual(self.create_tree(), 1000)
+        self.assertTrue(all(pk >= 1000 for pk in Category.objects.using('s1').values_list('pk', flat=True)))
+
+    def test_move(self):
+        skill_id = self.create_tree()
+        entry_ids = list(ActivityEntry.objects.using('s1').values_list('pk', flat=True))
+
+        move_user(self.user, 'default')
+
+        self.assertEqual(shard_for_user(self.user.pk), 'default')
+        self.assertFalse(UserShard.objects.filter(user=self.user).exists())
+        self.assertFalse(Skill.objects.using('s1').exists())
+        self.assertFalse(User.objects.using('s1').filter(pk=self.user.pk).exists())
+        self.assertEqual(list(ActivityEntry.objects.using('default').filter(activity__skill__owner=self.user)
+                              .values_list('pk', flat=True)), entry_ids)
+
+        response = self.client.get(reverse('skill-detail', kwargs={'pk': skill_id}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        move_user(self.user, 's1')
+
+        self.assertEqual(shard_for_user(self.user.pk), 's1')
+        self.assertTrue(Skill.objects.using('s1').filter(pk=skill_id).exists())
+        self.assertFalse(Skill.objects.using('default').filter(owner=self.user).exists())
+
+    def test_writes_frozen_during_move(self):
+        skill_id = self.create_tree()
+        UserShard.objects.filter(user=self.user).update(is_moving=True)
+
+        response = self.client.post(reverse('skill-list'), data={'name': 'Skill2'})
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(self.client.get(reverse('skill-detail', kwargs={'pk': skill_id})).status_code,
+                         status.HTTP_200_OK)
+        with self.assertRaises(ShardMoveInProgress):
+            purge_skill(skill_id, self.user.pk)
+
+    def test_writes_follow_shard_map_uncached(self):
+        move_user(self.user, 'default')
+        # another worker still has the old shard cached
+        cache.set('user-shard:{}'.format(self.user.pk), 's1')
+
+        skill_id = self.client.post(reverse('skill-list'), data={'name': 'Skill2'}).data['id']
+
+        self.assertTrue(Skill.objects.using('default').filter(pk=skill_id).exists())
+
+    def test_failed_move_lifts_freeze(self):
+        self.create_tree()
+
+        with mock.patch('dfys.core.sharding.copy_rows', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                move_user(self.user, 'default')
+
+        self.assertEqual(UserShard.objects.get(user=self.user).alias, 's1')
+        self.assertFalse(UserShard.objects.get(user=self.user).is_moving)
+        self.assertTrue(Skill.objects.using('s1').filter(owner=self.user).exists())
+
+    def test_move_freezes_writes(self):
+        seen = []
+
+        def copy_rows(queryset, source, target):
+            seen.append(UserShard.objects.get(user=self.user).is_moving)
+            return 0
+
+        with mock.patch('dfys.core.sharding.copy_rows', side_effect=copy_rows):
+            move_user(self.user, 'default')
+
+        self.assertTrue(all(seen))
+        self.assertFalse(UserShard.objects.filter(user=self.user, is_moving=True).exists())
+
+    def test_shared_cache_required(self):
+        with self.settings(SHARD_DBS={'s1': {}}):
+            self.assertEqual([error.id for error in check_shard_map_cache(None)], ['core.E001'])
+        self.assertEqual(check_shard_map_cache(None), [])
+
+    def test_purge_on_shard(self):
+        skill_id = self.create_tree()
+        self.client.delete(reverse('skill-detail', kwargs={'pk': skill_id}))
+
+        purge_skill(skill_id, self.user.pk)
+
+        self.assertFalse(Skill.objects.using('s1').filter(pk=skill_id).exists())
+        self.assertFalse(Activity.objects.using('s1').exists())
+
+    def test_purge_account(self):
+        self.create_tree()
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+
+        purge_account(self.user.pk)
+
+        self.assertFalse(User.objects.filter(pk=self.user.pk).exists())
+        self.assertFalse(User.objects.using('s1').filter(pk=self.user.pk).exists())
+        with use_shard('s1'):
+            self.assertFalse(Category.objects.exists())
+            self.assertFalse(Skill.objects.exists())
+
+    def test_import_command_on_shard(self):
+        document = '\n'.join([
+            '{"model": "category", "data": {"id": 1, "name": "DONE", "isBaseCategory": true}}',
+            '{"model": "skill", "data": {"id": 2, "name": "Imported", "categories": [1]}}',
+            '{"model": "activity", "data": {"id": 3, "title": "Act", "skill": 2}}',
+            '{"model": "entry", "data": {"comment": "comment", "activity": 3}}',
+        ])
+
+        with mock.patch('sys.stdin', StringIO(document)):
+            call_command('import_data', self.user.username, '-', stdout=StringIO())
+
+        self.assertTrue(Skill.objects.using('s1').filter(owner=self.user, name='Imported').exists())
+        self.assertFalse(Skill.objects.using('default').filter(owner=self.user).exists())
+        self.assertEqual(ActivityEntry.objects.using('s1').filter(activity__skill__owner=self.user).count(), 1)
+
+        UserShard.objects.filter(user=self.user).update(is_moving=True)
+        with mock.patch('sys.stdin', StringIO(document)):
+            with self.assertRaises(CommandError):
+                call_command('import_data', self.user.username, '-', stdout=StringIO())
+
+    def test_admin_shard_selector(self):
+        skill_id = self.create_tree()
+        User.objects.filter(pk=self.other.pk).update(is_staff=True, is_superuser=True)
+        self.client.force_login(User.objects.get(pk=self.other.pk))
+        changelist = reverse('admin:core_skill_changelist')
+
+        own = self.client.get(changelist)
+        selected = self.client.get(changelist, {'shard': 's1'})
+
+        self.assertEqual(list(own.context['cl'].result_list), [])
+        self.assertEqual([skill.pk for skill in selected.context['cl'].result_list], [skill_id])
+
+        change = reverse('admin:core_skill_change', args=[skill_id])
+        filters = {'_changelist_filters': 'shard=s1'}
+        self.assertEqual(self.client.get(change).status_code, status.HTTP_302_FOUND)
+        self.assertEqual(self.client.get(change, filters).status_code, status.HTTP_200_OK)
+
+        category_ids = list(Category.objects.using('s1').filter(owner=self.user).values_list('pk', flat=True))
+        response = self.client.post('{}?_changelist_filters=shard%3Ds1'.format(change), {
+            'name': 'Renamed', 'owner': self.user.pk, 'categories': ','.join(map(str, category_ids)),
+        }, format='multipart')
+
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        self.assertEqual(Skill.objects.using('s1').get(pk=skill_id).name, 'Renamed')
+
+    def test_delete_user_removes_mirror(self):
+        cache.clear()
+        user_id = self.user.pk
+
+        self.user.delete()
+
+        self.assertFalse(User.objects.using('s1').filter(pk=user_id).exists())
@@ -0,0 +1,101 @@
+from datetime import timedelta
+
+import pytest
+from django.utils import timezone
+
+from dfys.core.models import Job
+from dfys.core.tasks import task, enqueue, run_pending
+
+calls = []
+
+
+@task(name='test.record')
+def record(value):
+    calls.append(value)
+
+
+@task(name='test.record_batch', batch_size=10)
+def record_batch(payloads):
+    calls.append(sorted(payload['value'] for payload in payloads))
+
+
+@task(name='test.fail', max_attempts=2)
+def fail():
+    raise RuntimeError('failure')
+
+
+@pytest.mark.django_db
+class TestTasks:
+    @pytest.fixture(autouse=True)
+    def clear_calls(self, settings):
+        settings.TASKS_ALWAYS_EAGER = False
+        calls.clear()
+
+    def test_enqueue_and_run(self):
+        job = record.delay(value=1)
+
+        assert calls == []
+        assert run_pending() == 1
+        assert calls == [1]
+        assert Job.objects.get(pk=job.pk).status == Job.STATUS_DONE
+
+    def test_eager(self, settings):
+        settings.TASKS_ALWAYS_EAGER = True
+
+        assert enqueue('test.record', value=2) is None
+        assert calls == [2]
+        assert not Job.objects.exists()
+
+    def test_batching(self):
+        for value in (3, 1, 2):
+            record_batch.delay(value=value)
+
+        assert run_pending() == 3
+        assert calls == [[1, 2, 3]]
+
+    def test_retry_then_fail(self):
+        job = fail.delay()
+
+        run_pending()
+        job.refresh_from_db()
+        assert job.status == Job.STATUS_PENDING
+        assert job.attempts == 1
+        assert 'failure' in job.last_error
+        assert run_pending() == 0
+
+        Job.objects.filter(pk=job.pk).update(run_after=timezone.now() - timedelta(seconds=1))
+        run_pending()
+        job.refresh_from_db()
+        assert job.status == Job.STATUS_FAILED
+
+    def test_unknown_task(self):
+        with pytest.raises(KeyError):
+            enqueue('test.unknown')
+
+    def test_abandoned_job_is_retried(self):
+        job = fail.delay()
+        Job.objects.filter(pk=job.pk).update(status=Job.STATUS_RUNNING,
+                                             lease_expires=timezone.now() + timedelta(minutes=1))
+
+        assert run_pending() == 0
+        assert Job.objects.get(pk=job.pk).status == Job.STATUS_RUNNING
+
+        Job.objects.filter(pk=job.pk).update(lease_expires=timezone.now() - timedelta(seconds=1))
+        run_pending()
+        job.refresh_from_db()
+        assert job.status == Job.STATUS_PENDING
+        assert job.attempts == 1
+        assert 'Lease expired' in job.last_error
+
+        Job.objects.filter(pk=job.pk).update(status=Job.STATUS_RUNNING,
+                                             lease_expires=timezone.now() - timedelta(seconds=1))
+        run_pending()
+        job.refresh_from_db()
+        assert job.status == Job.STATUS_FAILED
+
+    def test_claimed_jobs_get_lease(self):
+        job = record.delay(value=1)
+
+        run_pending()
+
+        assert Job.objects.get(pk=job.pk).lease_expires > timezone.now()
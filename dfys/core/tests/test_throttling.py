@@ -0,0 +1,71 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from dfys.core.tests.test_factory import UserFactory
+from dfys.core.throttling import AuthRateThrottle, AuthUsernameRateThrottle, WriteRateThrottle
+
+
+class TestThrottling(APITestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = UserFactory()
+
+    def login(self, username='testuser'):
+        return self.client.post('/api/auth/login', data={'username': username, 'password': 'wrong'})
+
+    def test_auth_per_ip(self):
+        with mock.patch.object(AuthRateThrottle, 'THROTTLE_RATES', {'auth': '2/min'}), \
+                mock.patch.object(AuthUsernameRateThrottle, 'THROTTLE_RATES', {'auth_username': '100/min'}):
+            self.assertEqual(self.login('a').status_code, status.HTTP_401_UNAUTHORIZED)
+            self.assertEqual(self.login('b').status_code, status.HTTP_401_UNAUTHORIZED)
+
+            with mock.patch('dfys.core.views.authenticate') as authenticate:
+                response = self.login('c')
+
+            self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            self.assertIn('Retry-After', response)
+            authenticate.assert_not_called()
+
+    def test_auth_ignores_forwarded_for(self):
+        with mock.patch.object(AuthRateThrottle, 'THROTTLE_RATES', {'auth': '1/min'}), \
+                mock.patch.object(AuthUsernameRateThrottle, 'THROTTLE_RATES', {'auth_username': '100/min'}):
+            self.client.post('/api/auth/login', data={'username': 'a', 'password': 'wrong'},
+                             HTTP_X_FORWARDED_FOR='10.0.0.1')
+            response = self.client.post('/api/auth/login', data={'username': 'b', 'password': 'wrong'},
+                                        HTTP_X_FORWARDED_FOR='10.0.0.2')
+
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_auth_per_username(self):
+        with mock.patch.object(AuthRateThrottle, 'THROTTLE_RATES', {'auth': '100/min'}), \
+                mock.patch.object(AuthUsernameRateThrottle, 'THROTTLE_RATES', {'auth_username': '1/min'}):
+            self.assertEqual(self.login('a').status_code, status.HTTP_401_UNAUTHORIZED)
+            self.assertEqual(self.login('A').status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            self.assertEqual(self.login('b').status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_register(self):
+        with mock.patch.object(AuthRateThrottle, 'THROTTLE_RATES', {'auth': '0/min'}):
+            response = self.client.post('/api/auth/register', data={
+                'username': 'newuser',
+                'password': 'secret-password',
+                'email': 'new@user.com',
+            })
+
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertFalse(User.objects.filter(username='newuser').exists())
+
+    def test_writes_per_user(self):
+        self.client.force_login(self.user)
+
+        with mock.patch.object(WriteRateThrottle, 'THROTTLE_RATES', {'write': '1/min'}):
+            self.assertEqual(self.client.post(reverse('category-list'), data={'name': 'A'}).status_code,
+                             status.HTTP_201_CREATED)
+            self.assertEqual(self.client.post(reverse('category-list'), data={'name': 'B'}).status_code,
+                             status.HTTP_429_TOO_MANY_REQUESTS)
+            self.assertEqual(self.client.get(reverse('category-list')).status_code, status.HTTP_200_OK)
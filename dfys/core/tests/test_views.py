@@ -1,13 +1,35 @@
+import shutil
+import tempfile
+from datetime import timedelta
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.db.models import F
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase
 
-from dfys.core.models import Category, Skill, ActivityEntry, Activity
+from dfys.core.models import Category, Skill, ActivityEntry, Activity, Job
 from dfys.core.serializers import CategoryFlatSerializer
 from dfys.core.tests.test_factory import CategoryFactory, UserFactory, SkillFactory, ActivityFactory, CommentFactory, \
     AttachmentFactory
 
 
+class TestRegister(APITestCase):
+    def test_register(self):
+        response = self.client.post('/api/auth/register', data={
+            'username': 'newuser',
+            'password': 'secret-password',
+            'email': 'new@user.com',
+        })
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['username'], 'newuser')
+        self.assertEqual(Category.objects.filter(owner__username='newuser', is_base_category=True).count(), 3)
+
+
 class TestCategoryViewSet(APITestCase):
     def setUp(self) -> None:
         self.user = UserFactory()
@@ -52,6 +74,17 @@ class TestCategoryViewSet(APITestCase):
         self.assertEqual(response.data[cat2.pk], s.data[cat2.pk])
         self.assertEqual(response.data[cat3.pk], s.data[cat3.pk])
 
+    def test_list_columnar(self):
+        cat = CategoryFactory(is_base_category=True)
+
+        self.client.force_login(cat.owner)
+        response = self.client.get(reverse('category-list'), HTTP_ACCEPT='application/vnd.dfys.columnar+json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.json()
+        self.assertEqual(data['columns'][data['fields'].index('id')], [cat.pk])
+        self.assertEqual(data['columns'][data['fields'].index('isBaseCategory')], [True])
+
     def test_destroy(self):
         cat = CategoryFactory(is_base_category=False)
 
@@ -119,6 +152,17 @@ class TestSkillViewSet(APITestCase):
         self.assertEqual(len(response.data['skills']), 2)
         self.assertEqual(len(response.data['categories']), 4)
 
+    def test_list_sparse_fields(self):
+        skill = SkillFactory(name='Skill1')
+
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('skill-list'), data={'fields': 'name,categories'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(response.data['skills'][skill.id]), {'id', 'name', 'categories'})
+        category = next(iter(response.data['categories'].values()))
+        self.assertIn('display_order', category)
+
     def test_details(self):
         """
         Should provide skill detailed deep overview
@@ -135,6 +179,147 @@ class TestSkillViewSet(APITestCase):
         self.assertEqual(len(response.data['categories']), 2)
         self.assertEqual(len(response.data['activities']), 2)
 
+    def test_details_with_includes(self):
+        skill = SkillFactory(name='Skill1')
+        act1 = ActivityFactory(skill=skill)
+        act2 = ActivityFactory(skill=skill)
+        entry1 = CommentFactory(activity=act1)
+        entry2 = CommentFactory(activity=act2)
+
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('skill-detail', kwargs={'pk': skill.pk}),
+                                   data={'include': 'activities,activities.entries'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(response.data['activities']), {act1.id, act2.id})
+        self.assertNotIn('activities', response.data['included'])
+        self.assertEqual(response.data['included']['entries'][entry1.id]['activity'], act1.id)
+        self.assertEqual(response.data['included']['entries'][entry2.id]['activity'], act2.id)
+        self.assertEqual(response.data['included']['entries_cursors'], {act1.id: None, act2.id: None})
+
+    @override_settings(ENTRIES_PREVIEW_SIZE=2)
+    def test_details_includes_latest_entries(self):
+        skill = SkillFactory()
+        act = ActivityFactory(skill=skill)
+        entries = [CommentFactory(activity=act) for _ in range(3)]
+
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('skill-detail', kwargs={'pk': skill.pk}),
+                                   data={'include': 'activities.entries'})
+
+        self.assertEqual(set(response.data['included']['entries']), {entries[2].id, entries[1].id})
+        cursor = response.data['included']['entries_cursors'][act.id]
+        response = self.client.get(reverse('activity-entry-list', kwargs={'activity_pk': act.id}),
+                                   data={'cursor': cursor})
+        self.assertEqual(list(response.data['results']), [entries[0].id])
+
+    def test_details_includes_query_count_does_not_depend_on_tree_size(self):
+        def count_queries(skill):
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(reverse('skill-detail', kwargs={'pk': skill.pk}),
+                                data={'include': 'activities.entries'})
+            return len(queries)
+
+        self.client.force_login(self.user)
+        small_skill = SkillFactory(name='Small')
+        CommentFactory(activity=ActivityFactory(skill=small_skill))
+        self.client.get(reverse('category-list'))
+        small_count = count_queries(small_skill)
+
+        big_skill = SkillFactory(name='Big')
+        for _ in range(3):
+            act = ActivityFactory(skill=big_skill)
+            CommentFactory(activity=act)
+            CommentFactory(activity=act)
+
+        self.assertEqual(count_queries(big_skill), small_count)
+
+    def test_details_unknown_include(self):
+        skill = SkillFactory()
+
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('skill-detail', kwargs={'pk': skill.pk}), data={'include': 'owner'})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_clone(self):
+        category = CategoryFactory(owner=self.user)
+        skill = SkillFactory(name='Template')
+        skill.categories.add(category)
+        act1 = ActivityFactory(skill=skill, title='Act1', category=category)
+        act2 = ActivityFactory(skill=skill, title='Act2')
+        CommentFactory(activity=act1, comment='Entry1')
+        CommentFactory(activity=act1, comment='Entry2')
+        CommentFactory(activity=act2, comment='Entry3')
+
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('skill-clone', kwargs={'pk': skill.pk}), data={'name': 'Copy'})
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        clone = Skill.objects.get(pk=response.data['id'])
+        self.assertEqual(clone.name, 'Copy')
+        self.assertEqual(set(clone.categories.all()), set(skill.categories.all()))
+
+        copies = {activity.title: activity for activity in Activity.objects.filter(skill=clone)}
+        self.assertEqual(set(copies), {'Act1', 'Act2'})
+        self.assertEqual(copies['Act1'].category, category)
+        act1_comments = ActivityEntry.objects.filter(activity=copies['Act1']).values_list('comment', flat=True)
+        self.assertEqual(sorted(act1_comments), ['Entry1', 'Entry2'])
+        self.assertEqual(list(ActivityEntry.objects.filter(activity=copies['Act2']).values_list('comment', flat=True)),
+                         ['Entry3'])
+        self.assertEqual(ActivityEntry.objects.filter(activity__skill=skill).count(), 3)
+
+    def test_clone_query_count_does_not_depend_on_tree_size(self):
+        def count_queries(skill, name):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(reverse('skill-clone', kwargs={'pk': skill.pk}), data={'name': name})
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            return len(queries)
+
+        self.client.force_login(self.user)
+        small_skill = SkillFactory(name='Small')
+        CommentFactory(activity=ActivityFactory(skill=small_skill))
+        self.client.get(reverse('category-list'))
+        small_count = count_queries(small_skill, 'Small copy')
+
+        big_skill = SkillFactory(name='Big')
+        for _ in range(5):
+            act = ActivityFactory(skill=big_skill)
+            CommentFactory(activity=act)
+            CommentFactory(activity=act)
+
+        self.assertEqual(count_queries(big_skill, 'Big copy'), small_count)
+        self.assertEqual(ActivityEntry.objects.filter(activity__skill__name='Big copy').count(), 10)
+
+    def test_clone_large_skill(self):
+        skill = SkillFactory(name='Large')
+        activities = Activity.objects.bulk_create([Activity(skill=skill, title=str(i)) for i in range(400)])
+        ActivityEntry.objects.bulk_create([ActivityEntry(activity=act, comment=act.title) for act in activities])
+
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('skill-clone', kwargs={'pk': skill.pk}), data={'name': 'Copy'})
+        copy_response = self.client.post(reverse('skill-clone', kwargs={'pk': response.data['id']}),
+                                         data={'name': 'Copy of copy'})
+
+        for skill_id in (response.data['id'], copy_response.data['id']):
+            entries = ActivityEntry.objects.filter(activity__skill_id=skill_id)
+            self.assertEqual(entries.count(), 400)
+            self.assertFalse(entries.exclude(comment=F('activity__title')).exists())
+
+    def test_clone_without_activities(self):
+        skill = SkillFactory(name='Template')
+        ActivityFactory(skill=skill)
+
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('skill-clone', kwargs={'pk': skill.pk}), data={'activities': False})
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['name'], 'Template (copy)')
+        self.assertFalse(Activity.objects.filter(skill_id=response.data['id']).exists())
+
+        response = self.client.post(reverse('skill-clone', kwargs={'pk': skill.pk}), data={'activities': False})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_add_category(self):
         skill = SkillFactory()
         cat = CategoryFactory()
@@ -174,13 +359,48 @@ class TestSkillViewSet(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
         self.assertEqual(len(skill.categories.all()), 2)
 
+    def test_timeline(self):
+        skill = SkillFactory()
+        act = ActivityFactory(skill=skill)
+        _comment1 = CommentFactory(activity=act)
+        _comment2 = CommentFactory(activity=act)
+        _other_skill_comment = CommentFactory(activity=ActivityFactory(skill=SkillFactory(name='Other')))
+
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('skill-timeline', kwargs={'pk': skill.pk}), data={'bucket': 'month'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['bucket'], 'month')
+        self.assertEqual(len(response.data['starts']), 1)
+        self.assertEqual(response.data['starts'][0].day, 1)
+        self.assertEqual(list(response.data['counts']), [2])
+
+    def test_timeline_invalid_bucket(self):
+        skill = SkillFactory()
+
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('skill-timeline', kwargs={'pk': skill.pk}), data={'bucket': 'year'})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_destroy(self):
         skill1 = SkillFactory(name='Skill1')
         self.client.force_login(self.user)
-        response = self.client.delete(reverse('skill-detail', kwargs={'pk': skill1.pk}))
+        act = ActivityFactory(skill=skill1)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete(reverse('skill-detail', kwargs={'pk': skill1.pk}))
 
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
-        self.assertFalse(Skill.objects.filter(pk=skill1.pk).exists())
+        self.assertTrue(Skill.objects.get(pk=skill1.pk).is_hidden)
+        self.assertTrue(Job.objects.filter(name='dfys.core.purge.purge_skill',
+                                           payload={'skill_id': skill1.pk, 'owner_id': self.user.pk}).exists())
+
+        self.assertEqual(self.client.get(reverse('skill-detail', kwargs={'pk': skill1.pk})).status_code,
+                         status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get(reverse('activity-detail', kwargs={'pk': act.pk})).status_code,
+                         status.HTTP_404_NOT_FOUND)
+        response = self.client.post(reverse('skill-list'), data={'name': 'Skill1'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
 
 
 class TestActivityViewSet(APITestCase):
@@ -202,6 +422,50 @@ class TestActivityViewSet(APITestCase):
         self.assertEqual(response.data[act2.id]['id'], act2.id)
         self.assertEqual(response.data[act1.id]['id'], act1.id)
 
+    def test_recent_only_own_activities(self):
+        own_act = ActivityFactory(skill=SkillFactory(owner=self.user))
+        other_act = ActivityFactory(skill=SkillFactory(owner=UserFactory(username='Other user')))
+
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('activity-recent'))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn(own_act.id, response.data)
+        self.assertNotIn(other_act.id, response.data)
+
+    def test_recent_limit(self):
+        skill = SkillFactory()
+        activities = [ActivityFactory(skill=skill) for _ in range(3)]
+        Activity.objects.filter(pk=activities[1].pk).update(modify_date=activities[1].modify_date - timedelta(days=1))
+
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('activity-recent'), data={'limit': 2})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 2)
+        self.assertNotIn(activities[1].id, response.data)
+
+    def test_list_sparse_fields(self):
+        act = ActivityFactory(description='long description')
+
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('activity-list'), data={'fields': 'id,title,modifyDate'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(response.data[act.id]), {'id', 'title', 'modify_date'})
+        self.assertNotIn('description', queries.captured_queries[-1]['sql'])
+
+    def test_details_sparse_fields(self):
+        act = ActivityFactory()
+        comment = CommentFactory(activity=act)
+
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('activity-detail', kwargs={'pk': act.pk}), data={'fields': 'title,entries'})
+
+        self.assertEqual(set(response.data), {'id', 'title', 'entries'})
+        self.assertEqual(response.data['entries'][comment.id]['comment'], comment.comment)
+
     def test_details(self):
         act = ActivityFactory()
         _attachment = AttachmentFactory(activity=act)
@@ -234,6 +498,51 @@ class TestActivityViewSet(APITestCase):
         self.assertEqual(activity.category, cat)
         self.assertEqual(activity.skill, skill)
 
+    def test_update_with_matching_version(self):
+        act = ActivityFactory()
+
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('activity-detail', kwargs={'pk': act.pk}))
+        self.assertEqual(response['ETag'], '"1"')
+
+        response = self.client.patch(reverse('activity-detail', kwargs={'pk': act.pk}), data={
+            'title': 'newTitle',
+        }, HTTP_IF_MATCH='"1"')
+
+        act.refresh_from_db()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['ETag'], '"2"')
+        self.assertEqual(response.data['version'], 2)
+        self.assertEqual(act.title, 'newTitle')
+        self.assertEqual(act.version, 2)
+
+    def test_update_with_stale_version(self):
+        act = ActivityFactory(title='oldTitle')
+        Activity.objects.filter(pk=act.pk).update(version=2)
+
+        self.client.force_login(self.user)
+        response = self.client.patch(reverse('activity-detail', kwargs={'pk': act.pk}), data={
+            'title': 'newTitle',
+        }, HTTP_IF_MATCH='"1"')
+
+        act.refresh_from_db()
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertEqual(act.title, 'oldTitle')
+        self.assertEqual(act.version, 2)
+
+    def test_update_without_precondition(self):
+        act = ActivityFactory()
+        Activity.objects.filter(pk=act.pk).update(version=5)
+
+        self.client.force_login(self.user)
+        response = self.client.patch(reverse('activity-detail', kwargs={'pk': act.pk}), data={
+            'title': 'newTitle',
+        })
+
+        act.refresh_from_db()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(act.version, 6)
+
     def test_destroy(self):
         act = ActivityFactory()
 
@@ -248,6 +557,20 @@ class TestEntriesViewSet(APITestCase):
     def setUp(self) -> None:
         self.user = UserFactory()
 
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media_settings = self.settings(MEDIA_ROOT=media_root, ATTACHMENT_ACCEL_REDIRECT=None)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+    def upload_attachment(self, entry, content, name='notes.txt'):
+        return self.client.patch(reverse('activity-entry-detail', kwargs={
+            'activity_pk': entry.activity.id,
+            'pk': entry.id,
+        }), data={
+            'attachment': SimpleUploadedFile(name, content),
+        }, format='multipart')
+
     def test_create(self):
         act = ActivityFactory()
 
@@ -283,6 +606,21 @@ class TestEntriesViewSet(APITestCase):
         self.assertEqual(entry.activity, entry.activity)
         self.assertEqual(entry.comment, 'newComment')
 
+    def test_update_with_stale_version(self):
+        entry = CommentFactory(comment='oldComment')
+
+        self.client.force_login(self.user)
+        response = self.client.put(reverse('activity-entry-detail', kwargs={
+            'activity_pk': entry.activity.id,
+            'pk': entry.id,
+        }), data={
+            'comment': 'newComment',
+        }, HTTP_IF_MATCH='"7"')
+
+        entry.refresh_from_db()
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertEqual(entry.comment, 'oldComment')
+
     def test_delete(self):
         entry = CommentFactory(comment='oldComment')
 
@@ -295,13 +633,83 @@ class TestEntriesViewSet(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
         self.assertFalse(ActivityEntry.objects.filter(id=entry.id).exists())
 
-    def test_list_not_allowed(self):
+    def test_upload_attachment(self):
+        entry = AttachmentFactory()
+        other_entry = AttachmentFactory(activity=entry.activity)
+
+        self.client.force_login(self.user)
+        response = self.upload_attachment(entry, b'attachment content')
+        self.upload_attachment(other_entry, b'attachment content', name='copy.txt')
+
+        entry.refresh_from_db()
+        other_entry.refresh_from_db()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['attachment_name'], 'notes.txt')
+        self.assertEqual(entry.attachment.name, other_entry.attachment.name)
+        self.assertEqual(entry.attachment.read(), b'attachment content')
+
+    def test_download_attachment_range(self):
+        entry = AttachmentFactory()
+
+        self.client.force_login(self.user)
+        self.upload_attachment(entry, b'0123456789')
+        url = reverse('activity-entry-attachment', kwargs={'activity_pk': entry.activity.id, 'pk': entry.id})
+
+        response = self.client.get(url, HTTP_RANGE='bytes=2-5')
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(response['Content-Range'], 'bytes 2-5/10')
+        self.assertEqual(b''.join(response.streaming_content), b'2345')
+
+        response = self.client.get(url, HTTP_RANGE='bytes=20-')
+        self.assertEqual(response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+
+    def test_download_attachment_accel_redirect(self):
+        entry = AttachmentFactory()
+
+        self.client.force_login(self.user)
+        self.upload_attachment(entry, b'0123456789')
+        entry.refresh_from_db()
+
+        with self.settings(ATTACHMENT_ACCEL_REDIRECT='/protected/'):
+            response = self.client.get(reverse('activity-entry-attachment', kwargs={
+                'activity_pk': entry.activity.id,
+                'pk': entry.id,
+            }))
+
+        self.assertEqual(response['X-Accel-Redirect'], '/protected/' + entry.attachment.name)
+
+    def test_list(self):
         act = ActivityFactory()
+        entries = [CommentFactory(activity=act) for _ in range(3)]
+        _other_activity_entry = CommentFactory(activity=ActivityFactory(skill=act.skill))
+
         self.client.force_login(self.user)
-        response = self.client.get(reverse(
-            'activity-entry-list',
-            kwargs={'activity_pk': act.id}))
-        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+        with self.settings(ENTRIES_PAGE_SIZE=2):
+            response = self.client.get(reverse('activity-entry-list', kwargs={'activity_pk': act.id}))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(list(response.data['results']), [entries[2].id, entries[1].id])
+
+            response = self.client.get(response.data['next'])
+            self.assertEqual(list(response.data['results']), [entries[0].id])
+            self.assertIsNone(response.data['next'])
+
+    def test_list_continues_activity_details(self):
+        act = ActivityFactory()
+        entries = [CommentFactory(activity=act) for _ in range(3)]
+
+        self.client.force_login(self.user)
+        with self.settings(ENTRIES_PREVIEW_SIZE=2):
+            details = self.client.get(reverse('activity-detail', kwargs={'pk': act.pk}))
+        self.assertEqual(list(details.data['entries']), [entries[2].id, entries[1].id])
+
+        response = self.client.get(reverse('activity-entry-list', kwargs={'activity_pk': act.id}),
+                                   data={'cursor': details.data['entries_cursor']})
+        self.assertEqual(list(response.data['results']), [entries[0].id])
 
     def test_get_not_allowed(self):
         entry = CommentFactory()
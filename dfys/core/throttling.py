@@ -0,0 +1,55 @@
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.throttling import SimpleRateThrottle
+
+
+class AuthRateThrottle(SimpleRateThrottle):
+    """
+    Limits login, token and register calls per client IP, before any password hashing happens.
+    """
+    scope = 'auth'
+
+    def get_cache_key(self, request, view):
+        return self.cache_format % {
+            'scope': self.scope,
+            'ident': self.get_ident(request),
+        }
+
+
+class AuthUsernameRateThrottle(SimpleRateThrottle):
+    """
+    Limits login attempts per submitted username, whatever IPs they come from.
+    """
+    scope = 'auth_username'
+
+    def get_cache_key(self, request, view):
+        username = request.data.get('username') if hasattr(request.data, 'get') else None
+        if not username:
+            return None
+
+        return self.cache_format % {
+            'scope': self.scope,
+            'ident': str(username).lower(),
+        }
+
+
+class WriteRateThrottle(SimpleRateThrottle):
+    """
+    Limits mutating requests per user (per IP for anonymous ones), safe methods are not counted.
+    """
+    scope = 'write'
+
+    def allow_request(self, request, view):
+        if request.method in SAFE_METHODS:
+            return True
+        return super().allow_request(request, view)
+
+    def get_cache_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            ident = request.user.pk
+        else:
+            ident = self.get_ident(request)
+
+        return self.cache_format % {
+            'scope': self.scope,
+            'ident': ident,
+        }
@@ -1,22 +1,47 @@
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.conf import settings
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
+from django.db import router
+from django.db.models import Count, DateField, F, Window
+from django.db.models.functions import TruncDay, TruncWeek, TruncMonth, RowNumber
+from django.http import Http404, StreamingHttpResponse
 from django.shortcuts import render
+from django.utils import timezone
 
 from rest_framework import viewsets, mixins, status
-from rest_framework.decorators import action, api_view, permission_classes
-from rest_framework.exceptions import ValidationError, NotFound
-from rest_framework.permissions import BasePermission, AllowAny
+from rest_framework.decorators import action, api_view, permission_classes, renderer_classes, throttle_classes
+from rest_framework.exceptions import ValidationError, NotFound, AuthenticationFailed
+from rest_framework.permissions import BasePermission, AllowAny, SAFE_METHODS
 from rest_framework.response import Response
 
-from dfys.core.models import Category, Skill, Activity, ActivityEntry
+from dfys.core.archive import restore_entry, archived_entries, archived_entry, archived_add_dates
+from dfys.core.authentication import issue_tokens, refresh_tokens, decode_token, revoke_token, REFRESH
+from dfys.core.batch import Batch, BatchError
+from dfys.core.changes import ChangeEventsMixin, get_broker, event_stream, OP_DELETE
+from dfys.core.cloning import clone_skill
+from dfys.core.concurrency import OptimisticLockingMixin
+from dfys.core.files import attachment_response
+from dfys.core.imports import Importer, ImportFailed
+from dfys.core.models import Category, Skill, Activity, ActivityEntry, ArchivedEntryChunk
+from dfys.core.pagination import EntriesCursorPagination
+from dfys.core.db_routers import use_shard
 from dfys.core.permissions import IsOwner
+from dfys.core.purge import hide_skill, hide_account
+from dfys.core.renderers import EventStreamRenderer
+from dfys.core.sharding import assign_shard
 from dfys.core.serializers import CategoryFlatSerializer, SkillFlatSerializer, SkillDeepSerializer, \
-    ActivityFlatSerializer, ActivityDeepSerializer, ActivityEntrySerializer, SkillListSerializer, UserSerializer
+    ActivityFlatSerializer, ActivityDeepSerializer, ActivityEntrySerializer, SkillListSerializer, UserSerializer, \
+    ActivityEntryIncludedSerializer, SkillCloneSerializer, requested_fields
+from dfys.core.throttling import AuthRateThrottle, AuthUsernameRateThrottle
 
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@throttle_classes([AuthRateThrottle, AuthUsernameRateThrottle])
 def login_view(request):
     username, password = request.data['username'], request.data['password']
     user = authenticate(username=username, password=password)
@@ -37,36 +62,147 @@ def logout_view(request):
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@throttle_classes([AuthRateThrottle, AuthUsernameRateThrottle])
+def token_obtain_view(request):
+    username, password = request.data['username'], request.data['password']
+    user = authenticate(username=username, password=password)
+
+    if user is None:
+        return Response(status=status.HTTP_401_UNAUTHORIZED)
+    return Response(issue_tokens(user), status=status.HTTP_200_OK)
+
+
+@api_view(['POST'])
+@permission_classes([AllowAny])
+@throttle_classes([AuthRateThrottle])
+def token_refresh_view(request):
+    try:
+        tokens = refresh_tokens(request.data['refresh'])
+    except AuthenticationFailed:
+        return Response(status=status.HTTP_401_UNAUTHORIZED)
+    return Response(tokens, status=status.HTTP_200_OK)
+
+
+@api_view(['POST'])
+def token_revoke_view(request):
+    """
+    Revokes the access token used for the request and, if given, the refresh token.
+    """
+    if isinstance(request.auth, dict):
+        revoke_token(request.auth)
+
+    if request.data.get('refresh'):
+        try:
+            revoke_token(decode_token(request.data['refresh'], REFRESH))
+        except AuthenticationFailed:
+            pass
+    return Response(status=status.HTTP_200_OK)
+
+
+@api_view(['POST'])
+@permission_classes([AllowAny])
+@throttle_classes([AuthRateThrottle])
 def register(request):
     def create_base_categories(owner):
-        Category.objects.create(owner=owner, name='DONE', is_base_category=True, display_order=Category.ORDER_MIN_VALUE)
-        Category.objects.create(owner=owner, name='IN PROGRESS', is_base_category=True, display_order=0)
-        Category.objects.create(
-            owner=owner, name='FUTURE', is_base_category=True, display_order=Category.ORDER_MAX_VALUE
-        )
+        Category.objects.bulk_create([
+            Category(owner=owner, name='DONE', is_base_category=True, display_order=Category.ORDER_MIN_VALUE),
+            Category(owner=owner, name='IN PROGRESS', is_base_category=True, display_order=0),
+            Category(owner=owner, name='FUTURE', is_base_category=True, display_order=Category.ORDER_MAX_VALUE),
+        ])
 
     username, password, email = request.data['username'], \
                                 request.data['password'], \
                                 request.data['email']
 
     user = User.objects.create_user(username, email, password)
-    create_base_categories(user)
+    with use_shard(assign_shard(user)):
+        create_base_categories(user)
 
     serialized = UserSerializer(user)
     return Response(serialized.data, status=status.HTTP_200_OK)
 
 
+@api_view(['POST'])
+def delete_account_view(request):
+    """
+    Deactivates the account at once, its data is purged in the background, see dfys.core.purge.
+    """
+    if not request.user.check_password(request.data.get('password', '')):
+        return Response(status=status.HTTP_401_UNAUTHORIZED)
+
+    hide_account(request.user)
+    logout(request)
+    return Response(status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+@renderer_classes([EventStreamRenderer])
+def change_stream(request):
+    """
+    Server-sent events stream of changes to the requesting user's objects.
+    """
+    subscription = get_broker().subscribe(request.user.pk)
+    response = StreamingHttpResponse(event_stream(subscription, settings.CHANGES_HEARTBEAT),
+                                     content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@api_view(['POST'])
+def batch_view(request):
+    """
+    Applies an ordered list of mutations in one transaction, see dfys.core.batch.
+    """
+    try:
+        result = Batch(request, request.data.get('mutations')).execute()
+    except BatchError as e:
+        return Response({'index': e.index, 'errors': e.errors}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(result, status=status.HTTP_200_OK)
+
+
+@api_view(['POST'])
+def import_view(request):
+    """
+    Imports a JSON-lines document sent as the request body, see dfys.core.imports.
+    The body is read line by line, it is never loaded as a whole.
+    """
+    importer = Importer(request.user)
+    try:
+        importer.run(request.stream or ())
+    except ImportFailed as e:
+        return Response({'line': e.line, 'errors': e.errors, 'imported': importer.counts},
+                        status=status.HTTP_400_BAD_REQUEST)
+    return Response({'imported': importer.counts}, status=status.HTTP_200_OK)
+
+
 @login_required
 def index(request):
     return render(request, 'core/index.html')
 
 
-class CategoryViewSet(viewsets.ModelViewSet):
+class SparseQuerysetMixin:
+    """
+    Loads only the columns requested with ?fields= in list actions. Detail actions keep full rows,
+    their permission checks need the ownership columns.
+    """
+    sparse_actions = ('list',)
+
+    def sparse_queryset(self, queryset):
+        requested = requested_fields(self.request)
+        if requested is None or self.action not in self.sparse_actions:
+            return queryset
+
+        columns = {field.name for field in queryset.model._meta.concrete_fields}
+        return queryset.only('id', *(requested & columns))
+
+
+class CategoryViewSet(ChangeEventsMixin, SparseQuerysetMixin, viewsets.ModelViewSet):
     serializer_class = CategoryFlatSerializer
     permission_classes = [IsOwner]
 
     def get_queryset(self):
-        return Category.objects.filter(owner=self.request.user)
+        return self.sparse_queryset(Category.objects.filter(owner=self.request.user))
 
     def destroy(self, request, *args, **kwargs):
         if self.get_object().is_base_category:
@@ -75,17 +211,78 @@ class CategoryViewSet(viewsets.ModelViewSet):
         return super().destroy(request, *args, **kwargs)
 
 
-class SkillViewSet(viewsets.ModelViewSet):
+class SkillViewSet(ChangeEventsMixin, SparseQuerysetMixin, viewsets.ModelViewSet):
     permission_classes = [IsOwner]
 
     def get_queryset(self):
-        return Skill.objects.filter(owner=self.request.user)
+        return self.sparse_queryset(Skill.objects.filter(owner=self.request.user, is_hidden=False))
 
     def get_serializer_class(self):
         if self.action == 'retrieve':
             return SkillDeepSerializer
         return SkillFlatSerializer
 
+    def perform_destroy(self, instance):
+        hide_skill(instance)
+        self.publish_change(instance, op=OP_DELETE)
+
+    INCLUDES = ('activities', 'activities.entries')
+
+    def retrieve(self, request, *args, **kwargs):
+        """
+        Skill details, its activities are embedded. ?include=activities.entries adds an `included` section
+        with the latest ENTRIES_PREVIEW_SIZE entries of each activity, keyed by id, and `entries_cursors`
+        continuing on each activity's entries list (None when there is nothing more).
+        """
+        includes = {name.strip() for name in request.query_params.get('include', '').split(',') if name.strip()}
+        unknown = includes.difference(self.INCLUDES)
+        if unknown:
+            raise ValidationError(detail='Unknown include: {}'.format(', '.join(sorted(unknown))))
+
+        skill = self.get_object()
+        context = self.get_serializer_context()
+        data = None
+
+        if 'activities.entries' in includes:
+            activities = list(Activity.objects.filter(skill=skill))
+            context['activities'] = activities
+            entries, cursors = self.latest_entries(skill, activities)
+            data = self.get_serializer(skill, context=context).data
+            data['included'] = {
+                'entries': ActivityEntryIncludedSerializer(entries, many=True,
+                                                           context=dict(context, nested=True)).data,
+                'entries_cursors': cursors,
+            }
+
+        return Response(data if data is not None else self.get_serializer(skill, context=context).data)
+
+    def latest_entries(self, skill, activities):
+        """
+        Latest ENTRIES_PREVIEW_SIZE entries of every activity of the skill, live ones in a single query merged
+        with archived ones of the activities which have any, and {activity id: cursor of the rest of its entries}.
+        """
+        size = settings.ENTRIES_PREVIEW_SIZE
+        entries = ActivityEntry.objects.filter(activity__skill=skill).annotate(
+            position=Window(RowNumber(), partition_by=F('activity_id'), order_by=F('id').desc()),
+        ).filter(position__lte=size + 1)
+
+        by_activity = defaultdict(list)
+        for entry in entries:
+            by_activity[entry.activity_id].append(entry)
+
+        chunks = ArchivedEntryChunk.objects.filter(activity__skill=skill)
+        for activity_id in set(chunks.values_list('activity_id', flat=True).distinct()):
+            by_activity[activity_id].extend(archived_entries(chunks.filter(activity_id=activity_id), count=size + 1))
+
+        latest, cursors = [], {}
+        for activity in activities:
+            activity_entries = sorted(by_activity[activity.pk], key=lambda entry: -entry.pk)
+            latest.extend(activity_entries[:size])
+            has_more = len(activity_entries) > size
+            cursors[activity.pk] = \
+                EntriesCursorPagination.cursor_after(activity_entries[size - 1]) if has_more else None
+        return latest, cursors
+
     def list(self, request, *args, **kwargs):
         skills = self.get_queryset()
         skill_ids = skills.values_list('categories', flat=True)
@@ -94,7 +291,7 @@ class SkillViewSet(viewsets.ModelViewSet):
         serializer = SkillListSerializer({
             'skills': skills,
             'categories': categories
-        })
+        }, context=self.get_serializer_context())
 
         return Response(serializer.data)
 
@@ -105,6 +302,7 @@ class SkillViewSet(viewsets.ModelViewSet):
             skill = skill_serializer.save()
             base_categories = Category.objects.filter(owner=request.user, is_base_category=True)
             skill.categories.add(*base_categories)
+            self.publish_change(skill)
 
             response = SkillFlatSerializer(skill)
             return Response(response.data, status=status.HTTP_201_CREATED)
@@ -113,14 +311,36 @@ class SkillViewSet(viewsets.ModelViewSet):
     def add_category(self, request, pk=None):
         category, skill = self.get_category_skill_for_action(request)
         skill.categories.add(category)
+        self.publish_change(skill)
         return Response(status=status.HTTP_200_OK)
 
     @action(['post'], detail=True)
     def remove_category(self, request, pk=None):
         category, skill = self.get_category_skill_for_action(request)
         skill.categories.remove(category)
+        self.publish_change(skill)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    @action(['post'], detail=True)
+    def clone(self, request, pk=None):
+        """
+        Copies the skill with its categories and, unless `activities` or `entries` is false,
+        its activities and entries. The copy is named `name`, by default "<skill name> (copy)".
+        """
+        skill = self.get_object()
+        serializer = SkillCloneSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        name = serializer.validated_data.get('name') or '{} (copy)'.format(skill.name)
+        if Skill.objects.filter(owner=request.user, name=name, is_hidden=False).exists():
+            raise ValidationError(detail='Skill with this name already exists')
+
+        clone = clone_skill(skill, name,
+                            activities=serializer.validated_data['activities'],
+                            entries=serializer.validated_data['entries'])
+        self.publish_change(clone)
+        return Response(SkillFlatSerializer(clone).data, status=status.HTTP_201_CREATED)
+
     def get_category_skill_for_action(self, request):
         try:
             category_pk = request.data
@@ -131,46 +351,145 @@ class SkillViewSet(viewsets.ModelViewSet):
         skill = self.get_object()
         return category, skill
 
+    # Bucket: (database truncation, the same truncation of a local date in Python)
+    TIMELINE_BUCKETS = {
+        'day': (TruncDay, lambda day: day),
+        'week': (TruncWeek, lambda day: day - timedelta(days=day.weekday())),
+        'month': (TruncMonth, lambda day: day.replace(day=1)),
+    }
+
+    @action(detail=True)
+    def timeline(self, request, pk=None):
+        """
+        Counts skill's entries per time bucket. Live entries are aggregated by the database,
+        archived ones are added from their chunks. The response holds two parallel arrays:
+        bucket start dates and entry counts.
+        """
+        bucket = request.query_params.get('bucket', 'day')
+        try:
+            trunc, truncate_date = self.TIMELINE_BUCKETS[bucket]
+        except KeyError:
+            raise ValidationError(detail='Bucket must be one of: {}'.format(', '.join(self.TIMELINE_BUCKETS)))
+
+        skill = self.get_object()
+        counts = Counter(dict(ActivityEntry.objects
+                              .filter(activity__skill=skill)
+                              .annotate(bucket=trunc('add_date', output_field=DateField()))
+                              .values('bucket')
+                              .annotate(count=Count('id'))
+                              .values_list('bucket', 'count')))
+        for add_date in archived_add_dates(ArchivedEntryChunk.objects.filter(activity__skill=skill)):
+            counts[truncate_date(timezone.localtime(add_date).date())] += 1
+
+        starts = tuple(sorted(counts))
+        counts = tuple(counts[start] for start in starts)
+        return Response({
+            'bucket': bucket,
+            'starts': starts,
+            'counts': counts,
+        })
 
-class ActivitiesViewSet(viewsets.ModelViewSet):
+
+class ActivitiesViewSet(ChangeEventsMixin, OptimisticLockingMixin, SparseQuerysetMixin, viewsets.ModelViewSet):
     class IsActivityOwner(BasePermission):
         def has_object_permission(self, request, view, obj):
-            return obj.skill.owner == request.user
+            return obj.skill.owner_id == request.user.pk
 
     permission_classes = [IsActivityOwner]
+    sparse_actions = ('list', 'recent')
 
     def get_queryset(self):
-        return Activity.objects.filter(skill__owner=self.request.user)
+        return self.sparse_queryset(Activity.objects.filter(skill__owner=self.request.user, skill__is_hidden=False))
 
     def get_serializer_class(self):
         if self.action == 'retrieve':
             return ActivityDeepSerializer
         return ActivityFlatSerializer
 
+    RECENT_DEFAULT_LIMIT = 20
+    RECENT_MAX_LIMIT = 100
+
     @action(detail=False)
-    def recent(self, _request):
-        recent_activities = Activity.objects.all().order_by('-modify_date')
+    def recent(self, request):
+        """
+        Requesting user's most recently modified activities, newest first, at most ?limit= of them.
+        """
+        try:
+            limit = int(request.query_params.get('limit', self.RECENT_DEFAULT_LIMIT))
+        except ValueError:
+            raise ValidationError(detail='Limit must be a number')
+        limit = max(1, min(limit, self.RECENT_MAX_LIMIT))
 
-        page = self.paginate_queryset(recent_activities)
-        if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
+        recent_activities = self.get_queryset().order_by('-modify_date')[:limit]
 
         serializer = self.get_serializer(recent_activities, many=True)
         return Response(serializer.data)
 
 
-class EntriesViewSet(mixins.CreateModelMixin,
+class EntriesViewSet(ChangeEventsMixin,
+                     OptimisticLockingMixin,
+                     SparseQuerysetMixin,
+                     mixins.ListModelMixin,
+                     mixins.CreateModelMixin,
                      mixins.DestroyModelMixin,
                      mixins.UpdateModelMixin,
                      viewsets.GenericViewSet):
     class IsActivityOwner(BasePermission):
         def has_object_permission(self, request, view, obj):
-            return obj.activity.skill.owner == request.user
+            return obj.activity.skill.owner_id == request.user.pk
 
     permission_classes = [IsActivityOwner]
     serializer_class = ActivityEntrySerializer
+    pagination_class = EntriesCursorPagination
+
+    read_from_primary = False
 
     def get_queryset(self):
-        return ActivityEntry.objects.filter(activity__skill__owner=self.request.user,
-                                            activity=self.kwargs['activity_pk'])
+        queryset = ActivityEntry.objects.filter(activity__skill__owner=self.request.user,
+                                                activity__skill__is_hidden=False,
+                                                activity=self.kwargs['activity_pk'])
+        if self.read_from_primary:
+            queryset = queryset.using(router.db_for_write(ActivityEntry))
+        return self.sparse_queryset(queryset)
+
+    def archived_chunks(self):
+        return ArchivedEntryChunk.objects.filter(activity__skill__owner=self.request.user,
+                                                 activity__skill__is_hidden=False,
+                                                 activity=self.kwargs['activity_pk'])
+
+    def archived_entries(self, before_id=None, after_id=None, count=None):
+        """
+        Archived entries EntriesCursorPagination merges into the pages of live ones.
+        """
+        return archived_entries(self.archived_chunks(), before_id=before_id, after_id=after_id, count=count)
+
+    def get_object(self):
+        """
+        Falls back to the archive for ids which are not live. Safe requests get the entry decoded from its chunk,
+        others restore the chunk and look the entry up again on the database it was written to.
+        """
+        try:
+            return super().get_object()
+        except Http404:
+            entry_id = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+            if not entry_id.isdigit():
+                raise
+            if self.request.method in SAFE_METHODS:
+                entry = archived_entry(self.archived_chunks(), int(entry_id))
+                if entry is None:
+                    raise
+                self.check_object_permissions(self.request, entry)
+                return entry
+            if not restore_entry(self.archived_chunks(), int(entry_id)):
+                raise
+
+        self.read_from_primary = True
+        return super().get_object()
+
+    @action(detail=True)
+    def attachment(self, request, activity_pk=None, pk=None):
+        entry = self.get_object()
+        if not entry.attachment:
+            raise NotFound('Entry has no attachment')
+
+        return attachment_response(request, entry.attachment, entry.attachment_name)
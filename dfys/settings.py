@@ -19,7 +19,10 @@ with open(os.environ.get('SETTINGS_CONFIG', 'dfys/dev.env.json')) as f:
     configs = json.loads(f.read())
 
 
-def get_setting(setting, config=configs):
+_REQUIRED = object()
+
+
+def get_setting(setting, config=configs, default=_REQUIRED):
     try:
         val = config[setting]
         if val == 'True':
@@ -28,6 +31,8 @@ def get_setting(setting, config=configs):
             val = False
         return val
     except KeyError:
+        if default is not _REQUIRED:
+            return default
         raise ImproperlyConfigured('Improperly configured: Setting {} not found'.format(setting))
 
 
@@ -63,10 +68,15 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'dfys.core.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'dfys.core.db_routers.ShardRoutingMiddleware',
+    'dfys.core.db_routers.ReplicaRoutingMiddleware',
+    'dfys.core.middleware.CoalescingMiddleware',
+    'dfys.core.middleware.IdempotencyMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -99,6 +109,62 @@ DATABASES = {
     'default': get_setting('DEFAULT_DB')
 }
 
+# Optional read replicas: {alias: database config}. Safe requests read from them,
+# see dfys.core.db_routers.ReplicaRoutingMiddleware
+REPLICA_DBS = get_setting('REPLICA_DBS', default={})
+for replica_alias, replica_config in REPLICA_DBS.items():
+    DATABASES[replica_alias] = dict(replica_config, TEST={'MIRROR': 'default'})
+
+REPLICA_DATABASES = list(REPLICA_DBS)
+# How long a user keeps reading from the primary after a write
+REPLICA_STICKY_SECONDS = get_setting('REPLICA_STICKY_SECONDS', default=10)
+
+# Optional shards: {alias: database config}. Each user's categories, skills, activities and entries
+# live on one of 'default' and these databases, see dfys.core.sharding
+SHARD_DBS = get_setting('SHARD_DBS', default={})
+DATABASES.update(SHARD_DBS)
+
+SHARD_DATABASES = ['default'] + list(SHARD_DBS)
+# Size of the id range each shard hands out ids from, see `manage.py reserve_shard_ids`
+SHARD_ID_SPAN = get_setting('SHARD_ID_SPAN', default=100000000)
+# Seconds a move waits after freezing the user's writes, for requests already writing to finish
+SHARD_MOVE_GRACE_SECONDS = get_setting('SHARD_MOVE_GRACE_SECONDS', default=30)
+
+DATABASE_ROUTERS = [
+    'dfys.core.db_routers.ShardRouter',
+    'dfys.core.db_routers.ReplicaRouter',
+]
+
+
+# Cache shared by sessions, throttling and response caches. Configure a shared backend
+# (e.g. memcached or redis) when running more than one app process.
+
+CACHES = get_setting('CACHES', default={
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+})
+
+
+# Sessions and authentication
+# Session rows are read through the cache and user records are kept in a per-process cache,
+# see dfys.core.backends.CachedModelBackend
+
+SESSION_ENGINE = get_setting('SESSION_ENGINE', default='django.contrib.sessions.backends.cached_db')
+
+AUTHENTICATION_BACKENDS = [
+    'dfys.core.backends.CachedModelBackend',
+]
+
+# Per-process cache of authenticated users, see dfys.core.backends. Changes made by other processes are
+# picked up through the shared cache, which therefore has to be shared (see CACHES)
+USER_CACHE_SIZE = get_setting('USER_CACHE_SIZE', default=1024)
+USER_CACHE_TIMEOUT = get_setting('USER_CACHE_TIMEOUT', default=60)
+
+# Stateless token authentication lifetimes in seconds, see dfys.core.authentication
+ACCESS_TOKEN_LIFETIME = get_setting('ACCESS_TOKEN_LIFETIME', default=5 * 60)
+REFRESH_TOKEN_LIFETIME = get_setting('REFRESH_TOKEN_LIFETIME', default=14 * 24 * 60 * 60)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -119,6 +185,10 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Admin changelists of tables with more rows than this show the estimated count from planner statistics,
+# see dfys.core.admin
+ADMIN_EXACT_COUNT_LIMIT = get_setting('ADMIN_EXACT_COUNT_LIMIT', default=10000)
+
 # Internationalization
 # https://docs.djangoproject.com/en/2.2/topics/i18n/
 
@@ -138,19 +208,102 @@ USE_TZ = True
 
 STATIC_URL = get_setting('STATIC_URL')
 
+# Uploaded files (ActivityEntry attachments)
+
+MEDIA_ROOT = get_setting('MEDIA_ROOT', default=os.path.join(os.path.dirname(BASE_DIR), 'media'))
+
+# Always stream uploads to a temporary file instead of buffering them in memory
+FILE_UPLOAD_HANDLERS = [
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+
+# Internal location prefix (e.g. '/protected/attachments/') under which the front server
+# serves MEDIA_ROOT. When set, downloads are delegated to it via X-Accel-Redirect.
+ATTACHMENT_ACCEL_REDIRECT = get_setting('ATTACHMENT_ACCEL_REDIRECT', default=None)
+
+# Response compression, see dfys.core.middleware.CompressionMiddleware
+
+COMPRESSION_MIN_SIZE = get_setting('COMPRESSION_MIN_SIZE', default=1024)
+COMPRESSION_CACHE_TIMEOUT = get_setting('COMPRESSION_CACHE_TIMEOUT', default=300)
+
+# Cache of serialized activities and entries, see dfys.core.fragments. Timeout 0 disables it,
+# bump the version when their representation changes
+FRAGMENT_CACHE_TIMEOUT = get_setting('FRAGMENT_CACHE_TIMEOUT', default=24 * 60 * 60)
+FRAGMENT_CACHE_VERSION = get_setting('FRAGMENT_CACHE_VERSION', default=1)
+
+# Activity entries: page size of the entries list and number of latest entries embedded in activity details
+ENTRIES_PAGE_SIZE = get_setting('ENTRIES_PAGE_SIZE', default=50)
+ENTRIES_MAX_PAGE_SIZE = get_setting('ENTRIES_MAX_PAGE_SIZE', default=500)
+ENTRIES_PREVIEW_SIZE = get_setting('ENTRIES_PREVIEW_SIZE', default=20)
+
+# Cold archive of old entries, see dfys.core.archive and `manage.py archive_entries`
+ENTRIES_ARCHIVE_AFTER_DAYS = get_setting('ENTRIES_ARCHIVE_AFTER_DAYS', default=365)
+ENTRIES_ARCHIVE_CHUNK_SIZE = get_setting('ENTRIES_ARCHIVE_CHUNK_SIZE', default=500)
+
+# Concurrent identical GET requests to these paths share one response, see dfys.core.middleware.CoalescingMiddleware.
+# Waiting requests give up after COALESCE_WAIT_TIMEOUT seconds and compute the response themselves
+COALESCE_PATHS = get_setting('COALESCE_PATHS', default=[
+    r'^/api/(categories|skills|activities)/$',
+    r'^/api/activities/recent/$',
+    r'^/api/activities/\d+/entries/$',
+])
+COALESCE_WAIT_TIMEOUT = get_setting('COALESCE_WAIT_TIMEOUT', default=10)
+COALESCE_LOCK_TIMEOUT = get_setting('COALESCE_LOCK_TIMEOUT', default=30)
+COALESCE_RESULT_TTL = get_setting('COALESCE_RESULT_TTL', default=5)
+
+# How long responses of POST requests with an Idempotency-Key header are kept for retries
+IDEMPOTENCY_KEY_TTL = get_setting('IDEMPOTENCY_KEY_TTL', default=24 * 60 * 60)
+# Seconds after which a retry takes over a request still marked in progress, its worker presumably died
+IDEMPOTENCY_LOCK_TIMEOUT = get_setting('IDEMPOTENCY_LOCK_TIMEOUT', default=5 * 60)
+# Streamed request bodies the middleware must not read. Those, like multipart uploads, are fingerprinted
+# by the client's Content-Digest header instead
+IDEMPOTENCY_STREAMING_PATHS = get_setting('IDEMPOTENCY_STREAMING_PATHS', default=[r'^/api/import$'])
+
+# Number of JSON lines validated and written together by the bulk import, see dfys.core.imports
+IMPORT_CHUNK_SIZE = get_setting('IMPORT_CHUNK_SIZE', default=500)
+
+# Background jobs, see dfys.core.tasks
+
+TASKS_ALWAYS_EAGER = get_setting('TASKS_ALWAYS_EAGER', default=False)
+TASKS_RETRY_DELAY = get_setting('TASKS_RETRY_DELAY', default=30)
+# Seconds a worker may run a batch of jobs before they count as abandoned and are retried
+TASKS_LEASE_SECONDS = get_setting('TASKS_LEASE_SECONDS', default=10 * 60)
+
+# Rows removed by one DELETE when purging deleted skills and accounts, see dfys.core.purge
+PURGE_BATCH_SIZE = get_setting('PURGE_BATCH_SIZE', default=1000)
+
+# Change events pushed to clients, see dfys.core.changes.
+# Use 'dfys.core.changes.PostgresBroker' when running more than one app process.
+
+CHANGES_BROKER = get_setting('CHANGES_BROKER', default='dfys.core.changes.InMemoryBroker')
+CHANGES_HEARTBEAT = get_setting('CHANGES_HEARTBEAT', default=15)
+
 # LOGIN_REDIRECT_URL = 'index'
 # LOGOUT_REDIRECT_URL = 'login'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
+        'dfys.core.authentication.SignedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated'
     ],
+    'DEFAULT_THROTTLE_CLASSES': [
+        'dfys.core.throttling.WriteRateThrottle',
+    ],
+    'DEFAULT_THROTTLE_RATES': {
+        'auth': get_setting('AUTH_THROTTLE_RATE', default='20/min'),
+        'auth_username': get_setting('AUTH_USERNAME_THROTTLE_RATE', default='10/min'),
+        'write': get_setting('WRITE_THROTTLE_RATE', default='240/min'),
+    },
+    # Reverse proxies in front of the app, X-Forwarded-For is ignored for throttling unless they append to it
+    'NUM_PROXIES': get_setting('NUM_PROXIES', default=0),
     'TEST_REQUEST_DEFAULT_FORMAT': 'json',
     'DEFAULT_RENDERER_CLASSES': (
         'djangorestframework_camel_case.render.CamelCaseJSONRenderer',
+        'dfys.core.renderers.ColumnarJSONRenderer',
+        'dfys.core.renderers.ColumnarMessagePackRenderer',
         'djangorestframework_camel_case.render.CamelCaseBrowsableAPIRenderer',
     ),
     'DEFAULT_PARSER_CLASSES': (
@@ -0,0 +1,12 @@
+"""
+Settings of the test run, see pytest.ini.
+"""
+from dfys.settings import *  # noqa: F401,F403
+from dfys.settings import DATABASES
+
+# In-memory SQLite database the sharding tests use as a second shard, see dfys.core.tests.test_sharding.
+# It is a shard only where a test adds it to SHARD_DATABASES
+DATABASES.setdefault('s1', {
+    'ENGINE': 'django.db.backends.sqlite3',
+    'NAME': ':memory:',
+})
@@ -31,6 +31,10 @@ auth_routes = [
     path('api/auth/login', views.login_view),
     path('api/auth/logout', views.logout_view),
     path('api/auth/register', views.register),
+    path('api/auth/token', views.token_obtain_view),
+    path('api/auth/token/refresh', views.token_refresh_view),
+    path('api/auth/token/revoke', views.token_revoke_view),
+    path('api/auth/delete', views.delete_account_view),
 ]
 
 urlpatterns = [
@@ -38,6 +42,9 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include(router.urls)),
     path('api/', include(activities_router.urls)),
+    path('api/changes', views.change_stream),
+    path('api/batch', views.batch_view),
+    path('api/import', views.import_view),
 ]
 
 urlpatterns += auth_routes